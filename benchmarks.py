@@ -0,0 +1,545 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Startup benchmark settings
+STARTUP_RUNS = 10
+STARTUP_IMPORT_BUDGET = 0.5  # Median seconds allowed for a cold `import system_diagnostics`
+STARTUP_CLI_BUDGET = 1.0  # Median seconds allowed for `system_diagnostics.py --help`, interpreter start included
+LAZY_MODULES = ('speedtest', 'patoolib', 'py7zr', 'aiofiles', 'tqdm', 'numpy')  # Must not load on import
+BENCHMARK_RESULTS_FILE = 'benchmark_results.json'
+
+# Scan benchmark settings: synthetic tree profiles at scale 1.0 and the levels compared
+# small: many small files, large: few huge files, archives: zip/7z with some corrupt, deep: long directory chains
+TREE_PROFILES = {
+    'small': {'files': 20000, 'size': 4 * 1024, 'fanout': 100},
+    'large': {'files': 4, 'size': 256 * 1024 * 1024},
+    'archives': {'files': 200, 'size': 256 * 1024, 'corrupt_every': 10},
+    'deep': {'depth': 64, 'chains': 20, 'files_per_level': 4, 'size': 16 * 1024},
+}
+READ_STRATEGIES = ('stream', 'mmap', 'chunked', 'aiofiles')
+SCAN_CONCURRENCY_LEVELS = (1, 4, 16, 64)
+SCAN_EXECUTORS = ('threads', 'processes')  # Read pools compared at every concurrency level
+RSS_POLL_SECONDS = 0.01
+COLLECTOR_SAMPLES = 20
+
+# Instrumentation overhead benchmark settings
+INSTRUMENTATION_RUNS = 30  # Interleaved pairs of scans, one with instrumentation enabled and one without
+INSTRUMENTATION_MAX_RUNS = 240  # Pairs are doubled up to this many until the noise margin is under the budget
+INSTRUMENTATION_MIN_RUNS = 5  # Fewer pairs give no usable noise margin
+INSTRUMENTATION_BUDGET = 1.0  # Percent of scan time the enabled instrumentation may cost
+INSTRUMENTATION_CALLS = 200000  # observe() calls timed for the per-call cost
+
+# Fleet benchmark settings: local agent processes on free localhost ports
+FLEET_AGENTS = 4
+FLEET_ROUNDS = 3  # Coordinator runs against the same agents, later ones reuse warm agents
+FLEET_STARTUP_TIMEOUT = 30  # Seconds for every agent to answer /healthz
+
+# Run in a fresh interpreter: import the module, then report the import time and which lazy modules got loaded
+IMPORT_PROBE = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+started = time.perf_counter()
+import system_diagnostics
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed, 'loaded': [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+# Function to time one cold import in an empty working directory
+# Returns (seconds, lazy modules that were loaded, files the import created)
+def measure_import(workdir):
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE, MODULE_DIR] + list(LAZY_MODULES), cwd=workdir)
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    return result['seconds'], result['loaded'], sorted(os.listdir(workdir))
+
+# Function to time the command-line entry point up to argument parsing
+def measure_cli(workdir):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(MODULE_DIR, 'system_diagnostics.py'), '--help'],
+                   cwd=workdir, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+# Function to benchmark cold start and check that importing the module has no side effects
+def benchmark_startup(runs=STARTUP_RUNS, import_budget=STARTUP_IMPORT_BUDGET, cli_budget=STARTUP_CLI_BUDGET):
+    import_times = []
+    cli_times = []
+    loaded = set()
+    created = set()
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            seconds, modules, files = measure_import(workdir)
+            import_times.append(seconds)
+            loaded.update(modules)
+            created.update(files)
+        with tempfile.TemporaryDirectory() as workdir:
+            cli_times.append(measure_cli(workdir))
+    failures = []
+    if statistics.median(import_times) > import_budget:
+        failures.append(f"median import time {statistics.median(import_times):.3f}s is over the {import_budget}s budget")
+    if statistics.median(cli_times) > cli_budget:
+        failures.append(f"median --help time {statistics.median(cli_times):.3f}s is over the {cli_budget}s budget")
+    if loaded:
+        failures.append(f"import loaded lazy modules: {', '.join(sorted(loaded))}")
+    if created:
+        failures.append(f"import created files: {', '.join(sorted(created))}")
+    return {
+        'benchmark': 'startup',
+        'environment': environment(),
+        'runs': runs,
+        'import_seconds': {'median': statistics.median(import_times), 'min': min(import_times), 'max': max(import_times)},
+        'cli_seconds': {'median': statistics.median(cli_times), 'min': min(cli_times), 'max': max(cli_times)},
+        'failures': failures,
+    }
+
+# Function to import the module under test from this checkout
+def import_system_diagnostics():
+    if MODULE_DIR not in sys.path:
+        sys.path.insert(0, MODULE_DIR)
+    import system_diagnostics
+    return system_diagnostics
+
+# Function to write a file of pseudo-random bytes (incompressible, so archive sizes stay realistic)
+def write_random_file(path, size, rng):
+    with open(path, 'wb') as file:
+        remaining = size
+        while remaining > 0:
+            chunk = min(remaining, 1024 * 1024)
+            file.write(rng.randbytes(chunk))
+            remaining -= chunk
+
+# Function to generate one synthetic tree profile under root, scaled by scale
+def make_tree(root, profile, scale=1.0, seed=0):
+    rng = random.Random(seed)
+    settings = TREE_PROFILES[profile]
+    os.makedirs(root, exist_ok=True)
+    if profile == 'small':
+        for index in range(max(1, int(settings['files'] * scale))):
+            directory = os.path.join(root, f"d{index // settings['fanout']:04d}")
+            os.makedirs(directory, exist_ok=True)
+            write_random_file(os.path.join(directory, f"f{index:06d}.txt"), settings['size'], rng)
+    elif profile == 'large':
+        for index in range(settings['files']):
+            write_random_file(os.path.join(root, f"big{index}.bin"), max(1, int(settings['size'] * scale)), rng)
+    elif profile == 'archives':
+        try:
+            from py7zr import SevenZipFile
+        except ImportError:
+            SevenZipFile = None
+        payload = os.path.join(root, 'payload.bin')
+        write_random_file(payload, settings['size'], rng)
+        for index in range(max(1, int(settings['files'] * scale))):
+            if SevenZipFile is not None and index % 2:
+                path = os.path.join(root, f"a{index:05d}.7z")
+                with SevenZipFile(path, 'w') as archive:
+                    archive.write(payload, 'payload.bin')
+            else:
+                path = os.path.join(root, f"a{index:05d}.zip")
+                with zipfile.ZipFile(path, 'w') as archive:
+                    archive.write(payload, 'payload.bin')
+            if index % settings['corrupt_every'] == 0:
+                with open(path, 'r+b') as file:
+                    file.truncate(os.path.getsize(path) // 2)
+        os.remove(payload)
+    elif profile == 'deep':
+        for chain in range(max(1, int(settings['chains'] * scale))):
+            directory = os.path.join(root, f"chain{chain:03d}")
+            for level in range(settings['depth']):
+                directory = os.path.join(directory, f"l{level:02d}")
+                os.makedirs(directory, exist_ok=True)
+                for index in range(settings['files_per_level']):
+                    write_random_file(os.path.join(directory, f"f{index}.dat"), settings['size'], rng)
+    return tree_size(root)
+
+# Function to list every file under root with its size
+def tree_size(root):
+    files = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            files.append((path, os.path.getsize(path)))
+    return files
+
+# Function to ask the kernel to drop its page cache so reads hit storage (Linux, root only)
+def drop_caches():
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as file:
+            file.write('3\n')
+        return True
+    except OSError:
+        return False
+
+# Peak resident memory of this process while a block runs, polled from a background thread
+class PeakRss:
+    def __init__(self, interval=RSS_POLL_SECONDS):
+        import psutil
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self.stopping = threading.Event()
+
+    def poll(self):
+        while not self.stopping.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self.stopping.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self.thread = threading.Thread(target=self.poll, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopping.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+# Function to read every file with one strategy on a pool of workers, returns seconds taken
+# Every strategy feeds each chunk of STREAM_CHUNK_SIZE bytes to the same signature matcher, so the rows
+# differ only in how the bytes are read; archives are left to run_archive_headers
+def run_read_strategy(sd, strategy, paths, workers):
+    matcher = sd.corruption_matcher
+    started = time.perf_counter()
+    if strategy == 'aiofiles':
+        async def read_all():
+            semaphore = asyncio.Semaphore(workers)
+
+            async def read_one(path):
+                async with semaphore:
+                    await sd.read_file_async(path, sd.STREAM_CHUNK_SIZE, matcher)
+            await asyncio.gather(*(read_one(path) for path in paths))
+        asyncio.run(read_all())
+    else:
+        read = {'stream': sd.check_scan_file, 'mmap': sd.memory_map_file,
+                'chunked': lambda path: sd.read_large_file(path, sd.STREAM_CHUNK_SIZE, matcher)}[strategy]
+        with ThreadPoolExecutor(workers) as pool:
+            for _ in pool.map(read, paths):
+                pass
+    return time.perf_counter() - started
+
+# Function to verify the archive headers of every archive on a pool of workers, returns seconds taken
+def run_archive_headers(sd, paths, workers):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        for _ in pool.map(sd.verify_archive_headers, paths):
+            pass
+    return time.perf_counter() - started
+
+# Function to run the scan engine over root with the given concurrency, returns (seconds, problems found)
+# The per-device read cap is raised to the same level, otherwise it would bound every row on the one device
+def run_scanner(sd, root, workers, use_processes=False):
+    problems = []
+    scanned = []
+    started = time.perf_counter()
+    asyncio.run(sd.scan_selected_drives([root], None, problems, scanned, workers=workers, max_reads=workers,
+                                        per_device_reads=workers, use_processes=use_processes))
+    return time.perf_counter() - started, len(problems)
+
+# Function to build one result record with throughput figures
+def throughput_result(profile, kind, name, workers, files, seconds, peak_rss, cold, **extra):
+    total_bytes = sum(size for _, size in files)
+    result = {
+        'profile': profile,
+        'kind': kind,
+        'name': name,
+        'workers': workers,
+        'cold_cache': cold,
+        'files': len(files),
+        'bytes': total_bytes,
+        'seconds': seconds,
+        'files_per_second': len(files) / seconds if seconds else None,
+        'mb_per_second': total_bytes / seconds / 10**6 if seconds else None,
+        'peak_rss': peak_rss,
+    }
+    result.update(extra)
+    return result
+
+# Function to benchmark read strategies and scanner concurrency levels over synthetic trees
+def benchmark_scan(profiles=tuple(TREE_PROFILES), strategies=READ_STRATEGIES, levels=SCAN_CONCURRENCY_LEVELS,
+                   scale=1.0, tree_dir=None, cold=False):
+    sd = import_system_diagnostics()
+    base = tree_dir or tempfile.mkdtemp(prefix='pctricorder-bench-')
+    results = []
+    logging.disable(logging.CRITICAL)  # The corrupt archives are expected, keep their errors out of the table
+    try:
+        for profile in profiles:
+            root = os.path.join(base, profile)
+            if os.path.isdir(root):
+                files = tree_size(root)
+            else:
+                started = time.perf_counter()
+                files = make_tree(root, profile, scale)
+                print(f"{profile}: generated {len(files)} files in {time.perf_counter() - started:.1f}s")
+            archives = [(path, size) for path, size in files if path.lower().endswith(sd.ARCHIVE_EXTENSIONS)]
+            plain = [(path, size) for path, size in files if not path.lower().endswith(sd.ARCHIVE_EXTENSIONS)]
+            for strategy in strategies if plain else ():
+                dropped = cold and drop_caches()
+                with PeakRss() as rss:
+                    seconds = run_read_strategy(sd, strategy, [path for path, _ in plain], sd.SCAN_WORKERS)
+                results.append(throughput_result(profile, 'read', strategy, sd.SCAN_WORKERS, plain, seconds, rss.peak, dropped))
+                print_result(results[-1])
+            if archives:
+                dropped = cold and drop_caches()
+                with PeakRss() as rss:
+                    seconds = run_archive_headers(sd, [path for path, _ in archives], sd.SCAN_WORKERS)
+                results.append(throughput_result(profile, 'read', 'archive-headers', sd.SCAN_WORKERS, archives, seconds,
+                                                 rss.peak, dropped))
+                print_result(results[-1])
+            for level in levels:
+                for executor in SCAN_EXECUTORS:
+                    dropped = cold and drop_caches()
+                    with PeakRss() as rss:
+                        seconds, problems = run_scanner(sd, root, level, use_processes=executor == 'processes')
+                    results.append(throughput_result(profile, 'scan', executor, level, files, seconds, rss.peak, dropped,
+                                                     problems=problems))
+                    print_result(results[-1])
+    finally:
+        logging.disable(logging.NOTSET)
+        if tree_dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+    return results
+
+# Function to time every resolved collector, in milliseconds per collect() call
+def benchmark_collectors(samples=COLLECTOR_SAMPLES, include_expensive=False):
+    sd = import_system_diagnostics()
+    collectors = sd.resolve_collectors(include_expensive=include_expensive)
+    results = {}
+    for name, collector in collectors.items():
+        timings = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            try:
+                collector.collect()
+            except Exception as e:
+                results[name] = {'error': str(e)}
+                break
+            timings.append((time.perf_counter() - started) * 1000)
+        else:
+            timings.sort()
+            results[name] = {'samples': samples, 'median_ms': statistics.median(timings),
+                             'p95_ms': timings[max(0, -(-95 * len(timings) // 100) - 1)], 'max_ms': timings[-1]}
+        print(f"{name}: " + (results[name].get('error') or f"median {results[name]['median_ms']:.3f} ms, max {results[name]['max_ms']:.3f} ms"))
+    sd.close_collectors()
+    return results
+
+# Function to turn paired scan timings into (median slowdown, noise margin) in percent
+# The margin is two standard errors of the median, from the interquartile range so single outlier pairs do not widen it
+def median_slowdown(timings):
+    slowdowns = [(enabled - disabled) / disabled * 100 for enabled, disabled in zip(timings[True], timings[False])]
+    quartiles = statistics.quantiles(slowdowns, n=4)
+    return statistics.median(slowdowns), 2 * 1.2533 * (quartiles[2] - quartiles[0]) / 1.349 / len(slowdowns) ** 0.5
+
+# Function to measure what the self-instrumentation costs a scan of the small tree profile
+# The gate is the median slowdown over interleaved pairs of scans, which sees all of the added work.
+# Identical pairs vary by several percent, so pairs are added until the noise margin is below the budget;
+# a median over budget fails, and so does a margin that never got there (the budget could not be checked).
+# observe() calls per scan x measured cost per call is a second, stable gate on the timing path itself
+def benchmark_instrumentation(runs=INSTRUMENTATION_RUNS, budget=INSTRUMENTATION_BUDGET, scale=0.25, tree_dir=None,
+                              max_runs=INSTRUMENTATION_MAX_RUNS):
+    if runs < INSTRUMENTATION_MIN_RUNS:
+        raise ValueError(f"the instrumentation benchmark needs at least {INSTRUMENTATION_MIN_RUNS} pairs to estimate its noise")
+    sd = import_system_diagnostics()
+    instrumentation = sd.instrumentation
+    base = tree_dir or tempfile.mkdtemp(prefix='pctricorder-bench-')
+    root = os.path.join(base, 'small')
+    if not os.path.isdir(root):
+        make_tree(root, 'small', scale)
+    timings = {True: [], False: []}
+    logging.disable(logging.CRITICAL)
+    try:
+        run_scanner(sd, root, sd.SCAN_WORKERS)  # Warm the page cache
+        while True:
+            for run in range(len(timings[True]), runs):
+                for enabled in ((False, True) if run % 2 else (True, False)):  # Alternate which mode goes first
+                    instrumentation.enabled = enabled
+                    instrumentation.reset()
+                    seconds, _ = run_scanner(sd, root, sd.SCAN_WORKERS)
+                    timings[enabled].append(seconds)
+            measured, margin = median_slowdown(timings)
+            if margin < budget or runs >= max_runs:
+                break
+            runs = min(max_runs, runs * 2)
+        instrumentation.enabled = True
+        instrumentation.reset()
+        run_scanner(sd, root, sd.SCAN_WORKERS)
+        calls = sum(timing[0] for timing in instrumentation.histograms().values())  # observe() calls per scan
+        started = time.perf_counter()
+        for _ in range(INSTRUMENTATION_CALLS):
+            instrumentation.observe('benchmark', 0.001)
+        observe_seconds = (time.perf_counter() - started) / INSTRUMENTATION_CALLS
+        instrumentation.enabled = False
+        started = time.perf_counter()
+        for _ in range(INSTRUMENTATION_CALLS):
+            instrumentation.observe('benchmark', 0.001)
+        disabled_seconds = (time.perf_counter() - started) / INSTRUMENTATION_CALLS
+    finally:
+        instrumentation.enabled = sd.INSTRUMENTATION_ENABLED
+        instrumentation.reset()
+        logging.disable(logging.NOTSET)
+        if tree_dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+    estimated = calls * observe_seconds / statistics.median(timings[False]) * 100
+    results = {'benchmark': 'instrumentation', 'environment': environment(), 'runs': runs, 'calls_per_scan': calls,
+               'observe_ns': observe_seconds * 10**9, 'disabled_observe_ns': disabled_seconds * 10**9,
+               'scan_seconds': {'disabled': statistics.median(timings[False]), 'enabled': statistics.median(timings[True])},
+               'measured_overhead_percent': measured, 'measured_margin_percent': margin,
+               'estimated_overhead_percent': estimated, 'budget_percent': budget, 'failures': []}
+    if measured > budget:
+        results['failures'].append(f"instrumentation slows scans by a median {measured:.2f}% (+/- {margin:.2f}%) "
+                                   f"over {runs} pairs, budget {budget}%")
+    if margin >= budget:
+        results['failures'].append(f"scan timings too noisy to check the budget: median {measured:.2f}% +/- {margin:.2f}% "
+                                   f"after {runs} pairs, budget {budget}%")
+    if estimated > budget:
+        results['failures'].append(f"observe() calls cost an estimated {estimated:.2f}% of scan time, budget {budget}%")
+    return results
+
+# Function to find a free localhost TCP port
+def free_port():
+    import socket
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+# Function to wait until an agent answers /healthz
+def wait_for_agent(port, deadline):
+    import urllib.request
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+# Function to run the coordinator against local agent processes and check every job's streamed result
+def benchmark_fleet(agents=FLEET_AGENTS, rounds=FLEET_ROUNDS, jobs=('hardware', 'storage', 'network', 'scan'), concurrency=None):
+    sd = import_system_diagnostics()
+    workdir = tempfile.mkdtemp(prefix='pctricorder-fleet-')
+    tree = os.path.join(workdir, 'tree')
+    make_tree(tree, 'archives', 0.1)
+    ports = [free_port() for _ in range(agents)]
+    processes = [subprocess.Popen([sys.executable, os.path.join(MODULE_DIR, 'system_diagnostics.py'), '--agent', '--agent-port', str(port)],
+                                  cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for port in ports]
+    results = {'benchmark': 'fleet', 'environment': environment(), 'agents': agents, 'jobs': list(jobs), 'rounds': [], 'failures': []}
+    logging.disable(logging.CRITICAL)
+    try:
+        deadline = time.monotonic() + FLEET_STARTUP_TIMEOUT
+        if not all(wait_for_agent(port, deadline) for port in ports):
+            results['failures'].append("agents did not start")
+            return results
+        params = {'network': {'targets': ['127.0.0.1'], 'probes': ['dns', 'ping']}, 'scan': {'roots': [tree]}}
+        addresses = [f"127.0.0.1:{port}" for port in ports]
+        for _ in range(rounds):
+            started = time.perf_counter()
+            report = sd.run_fleet(addresses, jobs, params, concurrency or sd.FLEET_CONCURRENCY)
+            seconds = time.perf_counter() - started
+            summary = report.summary()
+            results['rounds'].append({'seconds': seconds, 'jobs_per_second': agents * len(jobs) / seconds,
+                                      'failed_jobs': len(summary['failed_jobs']), 'scan_problems': summary.get('scan', {}).get('problems')})
+            print(f"{agents} agents x {len(jobs)} jobs: {seconds:.2f}s, {results['rounds'][-1]['jobs_per_second']:.1f} jobs/s, "
+                  f"{len(summary['failed_jobs'])} failed")
+            for failure in summary['failed_jobs']:
+                results['failures'].append(f"{failure['agent']} {failure['job']}: {failure['error']}")
+            scans = {(result['scanned'], result['problems']) for _, result, _ in report.finished('scan')}
+            if len(scans) > 1:  # Every agent scanned the same tree
+                results['failures'].append(f"agents disagree on the scan (files, problems): {sorted(scans)}")
+    finally:
+        logging.disable(logging.NOTSET)
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+# Function to print one throughput result as a table row
+def print_result(result):
+    print(f"{result['profile']:>8} {result['kind']:>5} {result['name']:>15} x{result['workers']:<3} "
+          f"{result['files_per_second']:>10.0f} files/s {result['mb_per_second']:>9.1f} MB/s "
+          f"peak RSS {result['peak_rss'] / 2**20:.0f} MB")
+
+# Function to describe the machine the results came from
+def environment():
+    return {'python': sys.version.split()[0], 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+# Function to parse the benchmark command line
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="PCtricorder benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    startup = subparsers.add_parser('startup', help="Cold start time and import side effects")
+    startup.add_argument('--runs', type=int, default=STARTUP_RUNS)
+    startup.add_argument('--import-budget', type=float, default=STARTUP_IMPORT_BUDGET)
+    startup.add_argument('--cli-budget', type=float, default=STARTUP_CLI_BUDGET)
+    scan = subparsers.add_parser('scan', help="Read strategies and scanner concurrency over synthetic trees")
+    scan.add_argument('--profiles', default=','.join(TREE_PROFILES), help="Comma-separated tree profiles")
+    scan.add_argument('--strategies', default=','.join(READ_STRATEGIES), help="Comma-separated read strategies")
+    scan.add_argument('--concurrency', default=','.join(map(str, SCAN_CONCURRENCY_LEVELS)), help="Comma-separated scanner worker counts")
+    scan.add_argument('--scale', type=float, default=1.0, help="Multiplier for file counts and sizes")
+    scan.add_argument('--tree-dir', help="Generate trees here and keep them for later runs")
+    scan.add_argument('--cold', action='store_true', help="Drop the page cache before each run (Linux, root)")
+    collectors = subparsers.add_parser('collectors', help="Latency of each collector's collect() call")
+    collectors.add_argument('--samples', type=int, default=COLLECTOR_SAMPLES)
+    collectors.add_argument('--include-expensive', action='store_true')
+    overhead = subparsers.add_parser('instrumentation', help="Cost of the self-instrumentation during a scan")
+    overhead.add_argument('--runs', type=int, default=INSTRUMENTATION_RUNS, help="Interleaved pairs of scans to start with")
+    overhead.add_argument('--max-runs', type=int, default=INSTRUMENTATION_MAX_RUNS,
+                          help="Pairs allowed while narrowing the noise margin below the budget")
+    overhead.add_argument('--budget', type=float, default=INSTRUMENTATION_BUDGET, help="Percent of scan time allowed")
+    overhead.add_argument('--scale', type=float, default=0.25, help="Multiplier for the small tree profile")
+    overhead.add_argument('--tree-dir', help="Generate the tree here and keep it for later runs")
+    fleet = subparsers.add_parser('fleet', help="Coordinator against agent processes on localhost")
+    fleet.add_argument('--agents', type=int, default=FLEET_AGENTS)
+    fleet.add_argument('--rounds', type=int, default=FLEET_ROUNDS)
+    fleet.add_argument('--jobs', default='hardware,storage,network,scan', help="Comma-separated agent jobs")
+    fleet.add_argument('--concurrency', type=int, help="Jobs in flight, defaults to FLEET_CONCURRENCY")
+    parser.add_argument('--output', default=BENCHMARK_RESULTS_FILE, help="JSON file the results are written to")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.benchmark == 'startup':
+        results = benchmark_startup(arguments.runs, arguments.import_budget, arguments.cli_budget)
+        print(f"import: median {results['import_seconds']['median']:.3f}s, "
+              f"--help: median {results['cli_seconds']['median']:.3f}s over {results['runs']} runs")
+    elif arguments.benchmark == 'scan':
+        results = {'benchmark': 'scan', 'environment': environment(), 'scale': arguments.scale, 'failures': [],
+                   'results': benchmark_scan(arguments.profiles.split(','), arguments.strategies.split(','),
+                                             [int(level) for level in arguments.concurrency.split(',')],
+                                             arguments.scale, arguments.tree_dir, arguments.cold)}
+    elif arguments.benchmark == 'collectors':
+        results = {'benchmark': 'collectors', 'environment': environment(), 'failures': [],
+                   'results': benchmark_collectors(arguments.samples, arguments.include_expensive)}
+    elif arguments.benchmark == 'fleet':
+        results = benchmark_fleet(arguments.agents, arguments.rounds, arguments.jobs.split(','), arguments.concurrency)
+    elif arguments.benchmark == 'instrumentation':
+        results = benchmark_instrumentation(arguments.runs, arguments.budget, arguments.scale, arguments.tree_dir,
+                                            arguments.max_runs)
+        print(f"observe(): {results['observe_ns']:.0f} ns enabled, {results['disabled_observe_ns']:.0f} ns disabled; "
+              f"{results['calls_per_scan']} calls per scan, estimated overhead {results['estimated_overhead_percent']:.3f}%, "
+              f"measured {results['measured_overhead_percent']:+.2f}% +/- {results['measured_margin_percent']:.2f}% "
+              f"(median of {results['runs']} paired scans)")
+    with open(arguments.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    for failure in results['failures']:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if results['failures'] else 0)
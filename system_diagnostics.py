@@ -4,77 +4,329 @@ import os
 import logging
 import time
 import asyncio
-import aiofiles
-from tqdm import tqdm
 import socket
-import speedtest
 import subprocess
 import mmap
+import io
+import abc
+import re
+import threading
+import queue
 import csv
+import ctypes
+import glob
+import json
+import hashlib
+import hmac
+import heapq
+import bisect
+import math
+import gzip
+import shutil
+import struct
+import sys
+import atexit
+import argparse
+import signal
+from array import array
+from collections import deque
+import sqlite3
+from datetime import datetime
 import zipfile
-import patoolib
-from py7zr import SevenZipFile 
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 
 # Define these variables at the module level
+LOG_FILE = 'system_diagnostics.log'
 file_extensions_to_scan = ('.zip', '.rar', '.7z')
-problem_files = []  # Define the problem_files list
-scanned_files = []  # Define the scanned_files list
-global_pbar = None  # Define the global progress bar
 
-# Create a console handler with a custom log format
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter('=== Hardware Information ===\nSystem: %(message)s'))
+# Scan engine limits: size of the read pool, concurrent directory listings,
+# concurrent file reads, and concurrent reads allowed against one device
+SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+SCAN_MAX_LISTINGS = 8
+SCAN_MAX_READS = SCAN_WORKERS
+SCAN_PER_DEVICE_READS = 16  # NVMe/SSD can keep a deep queue busy
+SCAN_ROTATIONAL_DEVICE_READS = 2  # Spinning disks thrash on concurrent seeks
+SCAN_FILE_QUEUE_SIZE = 10000  # Backpressure between listing and reading
+SCAN_INDEX_FILE = 'scan_index.sqlite'
+SCAN_INDEX_COMPACT_RATIO = 0.25  # Vacuum once a quarter of the index is free pages
+SCAN_RESULTS_FILE = 'scan_results.jsonl'  # Spool of findings and directory checkpoints
+SCAN_RESULTS_FLUSH_SECONDS = 2.0
+SCAN_CHECKPOINT_SUFFIX = '.done'  # SQLite table of the directories an interrupted scan completed, built on resume
+SCAN_REPORT_LIMIT = 100  # Problems repeated in the log after a scan, the spool has all of them
+SCAN_PROGRESS_INTERVAL = 0.5  # Seconds between progress refreshes
+SCAN_PROGRESS_SMOOTHING = 0.3  # Weight of the newest interval in the smoothed rates
+CORRUPTION_SIGNATURES = (b'corruption_pattern',)  # Byte signatures that mark a file as corrupted
+STREAM_CHUNK_SIZE = 1024 * 1024  # Window size for streaming signature matching
+ARCHIVE_EXTENSIONS = ('.zip', '.rar', '.7z')
+RAR_SIGNATURES = (b'Rar!\x1a\x07\x00', b'Rar!\x1a\x07\x01\x00')  # RAR 4.x and 5.x markers
 
-# Create a file handler to log to a file with timestamps
-file_handler = logging.FileHandler('system_diagnostics.log')
-file_formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-file_handler.setFormatter(file_formatter)
+# Duplicate finder settings
+DUPLICATE_MIN_SIZE = 1  # Empty files are all identical and not worth reporting
+DUPLICATE_SAMPLE_BYTES = 64 * 1024  # Bytes hashed from each end of a file before a full hash
+DUPLICATE_DIGEST_SIZE = 20  # BLAKE2b digest bytes
+DUPLICATE_REPORT_LIMIT = 50  # Largest duplicate groups written to the log
 
-# Initialize the logging configuration with both handlers
-logging.basicConfig(level=logging.INFO, handlers=[console_handler, file_handler])
+# Disk usage analyzer settings
+DISK_USAGE_TOP_N = 20  # Largest directories and files reported
+DISK_USAGE_EXPORT_PREFIX = 'disk_usage'  # Exports are written as disk_usage_<timestamp>.json
+DISK_USAGE_EXPORT_MIN_BYTES = 1024 * 1024  # Smaller directories are left out of the export
 
+# Historical data sink settings
+HISTORICAL_DATA_FORMAT = 'csv'  # 'csv' or 'bin' (columnar float64 blocks)
+HISTORICAL_DATA_FILE = 'historical_data.csv' if HISTORICAL_DATA_FORMAT == 'csv' else 'historical_data.bin'
+HISTORICAL_FIELDS = ['Timestamp', 'CPU Usage', 'Memory Percent']
+HISTORICAL_FLUSH_ROWS = 1000
+HISTORICAL_FLUSH_SECONDS = 5.0
+HISTORICAL_MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+HISTORICAL_KEEP_SEGMENTS = 30
+HISTORICAL_BINARY_MAGIC = b'PCTRICORDER-HISTORY-1\n'
 
-# Function for scanning files within drives
-def scan_files(self):
+# History query and trend settings
+HISTORY_RESOLUTIONS = (60, 3600, 86400)  # Rollup bucket sizes in seconds (1m/1h/1d)
+HISTORY_ROLLUP_SUFFIX = '.rollup.json'  # Sidecar next to each rotated segment
+HISTORY_TREND_SOURCES = {  # metric -> (daemon collector file, daemon field, main loop field)
+    'cpu': ('cpu', 'cpu_percent', 'CPU Usage'),
+    'memory': ('memory', 'memory_percent', 'Memory Percent'),
+}
+HISTORY_MIN_MINUTES = 15  # Recorded minutes needed before trends are reported
+HISTORY_SUSTAINED_WINDOW = 3600
+HISTORY_SUSTAINED_CPU_PERCENT = 90
+HISTORY_SUSTAINED_FRACTION = 0.8  # Share of busy minutes that counts as sustained
+HISTORY_LEAK_WINDOW = 86400
+HISTORY_LEAK_PERCENT_PER_HOUR = 1.0  # Memory growth that counts as a leak
+HISTORY_LEAK_MIN_R2 = 0.8  # How straight the climb must be
+
+# Static hardware inventory cache
+HARDWARE_INVENTORY_FILE = 'hardware_inventory.json'
+HARDWARE_INVENTORY_TTL = 7 * 24 * 3600  # Seconds, a reboot also invalidates it
+
+# Network diagnostics defaults (targets can be overridden per call or with --network-target)
+NETWORK_TARGETS = ('www.google.ca',)
+NETWORK_PROBES = ('dns', 'ping', 'traceroute')
+NETWORK_PROBE_TIMEOUTS = {'dns': 5, 'ping': 15, 'traceroute': 90, 'tcp': 10, 'speedtest': 180}
+NETWORK_PING_COUNT = 4
+DNS_CACHE_TTL = 300  # Seconds
+LATENCY_PROBE_TIMEOUT = 2.0  # Seconds to wait for each echo reply or TCP handshake
+LATENCY_PROBE_INTERVAL = 0.2  # Seconds between probes to the same host
+LATENCY_TCP_PORT = 80  # Used when ICMP sockets are not permitted
+LATENCY_HISTOGRAM_BOUNDS = (0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)  # ms
+
+# Default seconds between samples for each daemon collector
+DAEMON_INTERVALS = {'cpu': 1.0, 'memory': 5.0, 'disk': 30.0, 'network': 5.0, 'temperature': 15.0, 'latency': 5.0,
+                    'throughput': 5.0}
+
+# Throughput monitor settings
+THROUGHPUT_INTERVAL = 1.0  # Seconds between counter samples in the interactive monitor
+THROUGHPUT_WINDOW_SAMPLES = 300  # Ring buffer slots per device
+THROUGHPUT_MONITOR_SECONDS = 30
+THROUGHPUT_IGNORED_DEVICES = r'^(loop|ram|zram)\d+$|^lo\d*$'  # Loopback and RAM-backed devices
+
+# Process sampler settings
+PROCESS_ATTRS = ['pid', 'name', 'cpu_times', 'memory_info']  # Fetched in one pass per process
+PROCESS_WINDOW_SECONDS = 60  # Sliding window for per-process CPU usage
+PROCESS_TOP_N = 5
+PROCESS_CULPRIT_SHARE_PERCENT = 25  # Share of all CPU or RAM the top process needs before it is named as the cause
+
+# Structured export settings
+METRICS_HOST = '127.0.0.1'  # Bind address of the metrics endpoint, use 0.0.0.0 for remote scrapers
+METRICS_PORT = 9464
+METRICS_PREFIX = 'pctricorder'
+METRICS_COUNTER_FIELDS = {'disk_read_bytes', 'disk_write_bytes', 'disk_read_count', 'disk_write_count',
+                          'net_bytes_sent', 'net_bytes_recv', 'net_packets_sent', 'net_packets_recv',
+                          'net_errin', 'net_errout'}  # Cumulative fields, exported as counters so rate() works
+
+# Self-instrumentation settings
+INSTRUMENTATION_ENABLED = True  # Timing histograms and counters, --no-instrumentation turns them off
+TIMING_HISTOGRAM_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+PROFILER_INTERVAL = 0.01  # Seconds between stack samples
+PROFILER_TOP_N = 15
+PROFILER_IDLE_FRAMES = frozenset({  # (file, function) of innermost frames that mean a thread is parked, not working
+    ('thread.py', '_worker'), ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'),
+    ('selectors.py', 'select'), ('queue.py', 'get'), ('socketserver.py', 'serve_forever'),
+})
+
+# Background command settings: timeouts in seconds per check and how long slow, slowly-changing results are reused
+COMMAND_TIMEOUT = 300
+COMMAND_TIMEOUTS = {'antivirus': 120, 'malware': 3600, 'winget': 3600, 'updates': 900, 'battery': 60}
+COMMAND_CACHE_TTL = {'antivirus': 300, 'updates': 3600, 'battery': 600}
+COMMAND_OUTPUT_LIMIT = 1024 * 1024  # Characters of output kept per stream
+COMMAND_READ_SIZE = 4096
+SECURITY_PROGRESS_INTERVAL = 0.2  # Seconds between progress bar refreshes
+
+# Fleet mode settings: agents serve diagnostic jobs over HTTP, the coordinator fans them out and merges the results
+AGENT_HOST = '127.0.0.1'  # Bind address of --agent, use 0.0.0.0 (with a token) so coordinators on other machines can connect
+AGENT_PORT = 9465
+AGENT_TOKEN_ENV = 'PCTRICORDER_AGENT_TOKEN'  # Shared secret agents require and the coordinator sends, mandatory off loopback
+FLEET_JOBS = ('hardware', 'storage', 'network')  # Default jobs, 'scan' also needs --fleet-scan-root
+FLEET_CONCURRENCY = 32  # Jobs in flight across the fleet
+FLEET_CONNECTIONS_PER_AGENT = 2
+FLEET_TIMEOUTS = {'hardware': 60, 'storage': 60, 'network': 300, 'scan': 600}  # Seconds without a streamed record
+FLEET_RETRIES = 1  # Resends when a pooled connection turns out to be closed
+FLEET_PROGRESS_INTERVAL = 5.0  # Seconds between progress records of long jobs
+FLEET_PROBLEMS_PER_AGENT = 100  # Scan problems kept per agent in the report, all of them are counted
+FLEET_STORAGE_WARN_PERCENT = 90
+FLEET_TOP_N = 10
+FLEET_REPORT_PREFIX = 'fleet_report'  # Reports are written as fleet_report_<timestamp>.json
+
+# Storage inventory settings
+PSEUDO_FILESYSTEMS = frozenset({
+    'proc', 'procfs', 'sysfs', 'devtmpfs', 'devpts', 'devfs', 'tmpfs', 'ramfs', 'cgroup', 'cgroup2',
+    'securityfs', 'pstore', 'debugfs', 'tracefs', 'configfs', 'fusectl', 'mqueue', 'hugetlbfs', 'bpf',
+    'autofs', 'binfmt_misc', 'rpc_pipefs', 'nsfs', 'overlay', 'squashfs', 'efivarfs', 'selinuxfs',
+    'nullfs', 'fdescfs', 'kernfs', 'ptyfs', 'fuse.gvfsd-fuse', 'fuse.portal', 'fuse.lxcfs',
+})
+STORAGE_STAT_TIMEOUT = 2.0  # Seconds before a mount is reported as unresponsive
+STORAGE_STAT_WORKERS = 16
+STORAGE_CACHE_SECONDS = 10.0
+
+# Collectors to leave out entirely (e.g. 'gpu', 'updates'), extended with --disable-collector
+DISABLED_COLLECTORS = ()
+
+# Linux sensor keys (chip and label) that count as CPU package/die and GPU temperatures
+CPU_SENSOR_PREFIXES = ('coretemp package', 'k10temp tctl', 'k10temp tdie', 'zenpower', 'x86_pkg_temp', 'cpu_thermal', 'cpu-thermal')
+GPU_SENSOR_PREFIXES = ('amdgpu', 'nouveau', 'radeon', 'nvidia')
+
+# Function to set up console and file logging, called by the command-line entry point only
+# so importing this module as a library leaves logging and the working directory alone
+def configure_logging(log_file=LOG_FILE):
+    # Create a console handler with a custom log format
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    # Create a file handler to log to a file with timestamps
+    file_handler = logging.FileHandler(log_file)
+    file_formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    file_handler.setFormatter(file_formatter)
+
+    # Initialize the logging configuration with both handlers
+    logging.basicConfig(level=logging.INFO, handlers=[console_handler, file_handler])
+
+
+# Function for finding duplicate files within drives
+def find_duplicate_files():
         available_drives = display_available_drives()
         if available_drives:
-            drive_choice = input("Select drives to scan (e.g., 1,2,3): ").split(',')
+            drive_choice = input("Select drives to search for duplicates (e.g., 1,2,3): ").split(',')
             drives_to_scan = [available_drives[int(choice) - 1][0] for choice in drive_choice if 1 <= int(choice) <= len(available_drives)]
             if drives_to_scan:
-                with tqdm(total=sum(len(os.listdir(drive)) for drive in drives_to_scan if os.path.isdir(drive))) as pbar:
-                    problem_files = []  # Reset problem_files
-                    scanned_files = []  # Reset scanned_files
-                    asyncio.run(scan_selected_drives(drives_to_scan, file_extensions_to_scan, problem_files, scanned_files))
-
-                    if not problem_files:
-                        logging.info("No problems detected in files.")
-                    else:
-                        logging.info(f"Problems found in {len(problem_files)} files.")
-                        for problem_file in problem_files:
-                            logging.info(problem_file)
+                index = ScanIndex(SCAN_INDEX_FILE)
+                progress = ScanProgress(drives_to_scan)
+                try:
+                    duplicates = find_duplicates(drives_to_scan, index=index, progress=progress)
+                finally:
+                    progress.close()
+                    index.close()
 
+                if not duplicates:
+                    logging.info("No duplicate files found.")
+                else:
+                    reclaimable = sum(size * (len(paths) - 1) for size, paths in duplicates)
+                    logging.info(f"Found {len(duplicates)} groups of duplicate files, {reclaimable / (1024 ** 3):.2f} GB reclaimable.")
+                    for size, paths in duplicates[:DUPLICATE_REPORT_LIMIT]:
+                        logging.info(f"{len(paths)} copies of {size / (1024 ** 2):.2f} MB: " + ', '.join(paths))
+            else:
+                print("Invalid drive selection.")
 
-# Function for battery check
-def check_battery_health():
-    try:
-        if platform.system() == "Windows":
-            # Add code to check battery health on Windows if needed
-            pass
+# Function for showing where the space went on the selected drives
+def display_disk_usage():
+        available_drives = display_available_drives()
+        if available_drives:
+            drive_choice = input("Select drives to analyze (e.g., 1,2,3): ").split(',')
+            drives_to_scan = [available_drives[int(choice) - 1][0] for choice in drive_choice if 1 <= int(choice) <= len(available_drives)]
+            if drives_to_scan:
+                progress = ScanProgress(drives_to_scan)
+                try:
+                    tree = analyze_disk_usage(drives_to_scan, progress=progress)
+                finally:
+                    progress.close()
 
-        elif platform.system() == "Darwin":
-            # Run a command to check battery health on macOS
-            result = subprocess.run(['system_profiler', 'SPPowerDataType'], capture_output=True, text=True, check=True)
+                usage_info = ["=== Largest Directories ==="]
+                for path, size, files in tree.top_directories():
+                    usage_info.append(f"{path} - {size / (1024 ** 3):.2f} GB in {files} files")
+                usage_info.append("=== Largest Files ===")
+                for path, size in tree.top_files():
+                    usage_info.append(f"{path} - {size / (1024 ** 3):.2f} GB")
+                logging.info('\n'.join(usage_info))
+                tree.export_json(f"{DISK_USAGE_EXPORT_PREFIX}_{time.strftime('%Y%m%d_%H%M%S')}.json", DISK_USAGE_EXPORT_MIN_BYTES)
+            else:
+                print("Invalid drive selection.")
 
-            # Extract battery health information from the result
-            battery_health_info = extract_battery_health_info(result.stdout)
-            logging.info(f"Battery Health: {battery_health_info}")
+# Function for scanning files within drives
+# Results stream to SCAN_RESULTS_FILE; an interrupted scan can be resumed from its last checkpoint
+def scan_files():
+        resume = ScanResultSink.interrupted(SCAN_RESULTS_FILE)
+        if resume and input(f"Resume the interrupted scan of {', '.join(resume['roots'])}? (Y/n): ").strip().lower() != 'n':
+            drives_to_scan = resume['roots']
+            extensions = tuple(resume['extensions']) if resume['extensions'] else None
+        else:
+            resume = None
+            extensions = file_extensions_to_scan
+            available_drives = display_available_drives()
+            if not available_drives:
+                return
+            drive_choice = input("Select drives to scan (e.g., 1,2,3): ").split(',')
+            drives_to_scan = [available_drives[int(choice) - 1][0] for choice in drive_choice if 1 <= int(choice) <= len(available_drives)]
+            if not drives_to_scan:
+                print("Invalid drive selection.")
+                return
+        full_rescan = input("Force a full rescan of unchanged files? (y/N): ").strip().lower() == 'y'
+        full_crc = input("Verify archive member CRCs (slower)? (y/N): ").strip().lower() == 'y'
+        index = ScanIndex(SCAN_INDEX_FILE)
+        progress = ScanProgress(drives_to_scan, extensions=extensions)
+        sink = ScanResultSink(SCAN_RESULTS_FILE).start(drives_to_scan, extensions, resume=resume is not None)
+        try:
+            deleted_files = asyncio.run(scan_selected_drives(drives_to_scan, extensions, None, None,
+                                                             progress=progress, index=index, full_rescan=full_rescan,
+                                                             full_crc=full_crc, sink=sink))
+        except KeyboardInterrupt:
+            sink.close()
+            logging.info(f"Scan interrupted, choose S again to resume from {SCAN_RESULTS_FILE}.")
+            return
+        finally:
+            progress.close()
+            index.close()
+        sink.finish()
+        summary = progress.snapshot()
+        logging.info(f"Scanned {sink.scanned} files ({sink.bytes / 10**9:.2f} GB) in {summary['elapsed']:.1f}s, "
+                     f"read {summary['read_bytes'] / 10**6:.1f} MB, {summary['cached_files']} unchanged files skipped.")
 
+        if not sink.problems:
+            logging.info("No problems detected in files.")
         else:
-            logging.warning("Battery health check not supported on this operating system.")
+            logging.info(f"Problems found in {sink.problems} files (all listed in {SCAN_RESULTS_FILE}).")
+            for number, problem_file in enumerate(sink.iter_problems()):
+                if number >= SCAN_REPORT_LIMIT:
+                    logging.info(f"... and {sink.problems - SCAN_REPORT_LIMIT} more.")
+                    break
+                logging.info(problem_file)
 
+        if deleted_files:
+            logging.info(f"{len(deleted_files)} files were deleted since the last scan.")
+            for deleted_file in deleted_files:
+                logging.info(f"Deleted: {deleted_file}")
+
+
+# Function for battery check
+def check_battery_health():
+    collector = get_collector('battery')
+    if collector is None:
+        logging.warning("Battery health check not supported on this operating system.")
+        return None
+    try:
+        battery_health_info = collector.collect()
     except subprocess.CalledProcessError as e:
         logging.error(f"Error checking battery health: {e.stderr}")
+        return None
+    except Exception as e:
+        logging.error(f"Error checking battery health: {str(e)}")
+        return None
+    if battery_health_info:
+        logging.info(f"Battery Health: {battery_health_info['health']}")
+    else:
+        logging.info("No battery found.")
+    return battery_health_info
 
 def extract_battery_health_info(report):
     # Extract relevant information from the battery report
@@ -86,175 +338,1436 @@ def extract_battery_health_info(report):
     else:
         return "Battery health information not found in the report."
 
+# Buffered time-series sink for historical metrics
+# Rows are batched in memory and written by a background thread once HISTORICAL_FLUSH_ROWS rows are
+# queued or HISTORICAL_FLUSH_SECONDS have passed. Segments rotate at HISTORICAL_MAX_SEGMENT_BYTES and
+# old ones are gzip-compressed. format='bin' writes columnar blocks of float64 arrays instead of CSV:
+# a HISTORICAL_BINARY_MAGIC line, a comma-separated header line, then per block a little-endian
+# uint32 row count followed by each column as a float64 array (timestamps as epoch seconds)
+class HistoricalDataWriter:
+    def __init__(self, path=HISTORICAL_DATA_FILE, fieldnames=HISTORICAL_FIELDS, format='csv',
+                 flush_rows=HISTORICAL_FLUSH_ROWS, flush_seconds=HISTORICAL_FLUSH_SECONDS,
+                 max_segment_bytes=HISTORICAL_MAX_SEGMENT_BYTES, keep_segments=HISTORICAL_KEEP_SEGMENTS):
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.format = format
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_segment_bytes = max_segment_bytes
+        self.keep_segments = keep_segments
+        self.rows = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.flushed = threading.Condition(self.lock)
+        self.queued = 0  # Rows accepted so far
+        self.written = 0  # Rows handed to the file so far
+        self.closed = False
+        self.file = None
+        self.thread = None
+        self.reopen = False  # Fieldnames changed, the next rows start a new segment
+
+    # Queue one row: a sequence matching fieldnames, timestamp first (epoch seconds or a timestamp string)
+    def write(self, row):
+        with self.lock:
+            if self.closed:
+                return
+            self.rows.append(row)
+            self.queued += 1
+            queued = len(self.rows)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='historical-writer', daemon=True)
+                self.thread.start()
+        if queued >= self.flush_rows:
+            self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            with self.lock:
+                rows, self.rows = self.rows, []
+                target = self.queued
+                closed = self.closed
+            try:
+                if rows:
+                    self.write_rows(rows)
+            except Exception as e:
+                logging.error(f"Error writing historical data: {str(e)}")
+            with self.lock:
+                self.written = target
+                self.flushed.notify_all()
+            if closed:
+                if self.file:
+                    self.file.close()
+                    self.file = None
+                return
+
+    # Switch columns: rows queued so far are written under the old header, later ones go to a new segment
+    def set_fieldnames(self, fieldnames):
+        self.flush()
+        with self.lock:
+            self.fieldnames = list(fieldnames)
+            self.reopen = True
+
+    # Fieldnames in the header of the existing live file, None when it has no readable header
+    def existing_fieldnames(self):
+        try:
+            if self.format == 'bin':
+                with open(self.path, 'rb') as file:
+                    if file.readline() != HISTORICAL_BINARY_MAGIC:
+                        return None
+                    return file.readline().decode().rstrip('\n').split(',')
+            with open(self.path, newline='') as file:
+                return next(csv.reader(file), None)
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def open_segment(self):
+        is_new = not os.path.isfile(self.path) or os.path.getsize(self.path) == 0
+        if not is_new and self.existing_fieldnames() != self.fieldnames:
+            self.rotate()  # Written with other columns, keep it as a finished segment
+            is_new = True
+        if self.format == 'bin':
+            self.file = open(self.path, 'ab')
+            if is_new:
+                self.file.write(HISTORICAL_BINARY_MAGIC + ','.join(self.fieldnames).encode() + b'\n')
+        else:
+            self.file = open(self.path, 'a', newline='')
+            if is_new:
+                csv.writer(self.file).writerow(self.fieldnames)
+
+    # Rows are written in blocks that end at the first row reaching max_segment_bytes, so one large
+    # batch is split over several segments instead of overfilling one
+    def write_rows(self, rows):
+        if self.reopen:
+            self.reopen = False
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        while rows:
+            if self.file is None:
+                self.open_segment()
+            count = self.write_block(rows, self.max_segment_bytes - self.file.tell())
+            rows = rows[count:]
+            self.file.flush()
+            if self.file.tell() >= self.max_segment_bytes:
+                self.rotate()
+
+    # Write the leading rows that fit in room bytes (at least one), returns how many were written
+    def write_block(self, rows, room):
+        width = len(self.fieldnames)
+        if self.format == 'bin':
+            rows = rows[:max(1, -(-(room - 4) // (8 * width)))]  # Rows needed to fill the room, rounded up
+            columns = [array('d', [float('nan')]) * len(rows) for _ in range(width)]
+            for row_number, row in enumerate(rows):
+                columns[0][row_number] = to_epoch(row[0])
+                for column_number in range(1, min(width, len(row))):
+                    value = row[column_number]
+                    if value is not None:
+                        columns[column_number][row_number] = value
+            self.file.write(struct.pack('<I', len(rows)))
+            for column in columns:
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                self.file.write(column.tobytes())
+            return len(rows)
+        buffer = io.StringIO(newline='')
+        writer = csv.writer(buffer)
+        count = 0
+        for row in rows:
+            writer.writerow((to_timestamp_string(row[0]),) + tuple(row[1:]))
+            count += 1
+            if buffer.tell() >= room:
+                break
+        self.file.write(buffer.getvalue())
+        return count
+
+    # Close the current segment, compress it next to the live file and drop the oldest segments
+    def rotate(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        # Every name carries a zero-padded sequence, one past the highest used in the same second, so
+        # segments rotated within one second still sort in order (also after older ones were pruned)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = f"{os.path.basename(self.path)}.{time.strftime('%Y%m%d-%H%M%S')}-"
+        taken = [int(name[len(prefix):len(prefix) + 3]) for name in os.listdir(directory)
+                 if name.startswith(prefix) and name[len(prefix):len(prefix) + 3].isdigit()]
+        segment = os.path.join(directory, f"{prefix}{max(taken, default=-1) + 1:03d}")
+        os.replace(self.path, segment)
+        with open(segment, 'rb') as source, gzip.open(segment + '.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(segment)
+        segments = sorted(name for name in os.listdir(os.path.dirname(os.path.abspath(self.path)))
+                          if name.startswith(os.path.basename(self.path) + '.') and name.endswith('.gz'))
+        for name in segments[:-self.keep_segments] if self.keep_segments else []:
+            os.remove(os.path.join(os.path.dirname(os.path.abspath(self.path)), name))
+            sidecar = os.path.join(os.path.dirname(os.path.abspath(self.path)), name + HISTORY_ROLLUP_SUFFIX)
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+
+    # Block until everything queued so far is on disk
+    def flush(self):
+        with self.lock:
+            target = self.queued
+            if self.thread is None or self.closed:
+                return
+            self.wakeup.set()
+            while self.written < target:
+                self.flushed.wait()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            thread = self.thread
+        if thread is not None:
+            self.wakeup.set()
+            thread.join()
+
+# Function to convert a timestamp string or epoch seconds into epoch seconds
+def to_epoch(timestamp):
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp).timestamp()  # Local time, like time.mktime
+    return float(timestamp)
+
+# Function to convert epoch seconds or a timestamp string into the CSV timestamp format
+# Epoch seconds keep millisecond precision so sub-second samples stay distinct
+def to_timestamp_string(timestamp):
+    if isinstance(timestamp, str):
+        return timestamp
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp % 1 * 1000):03d}"
+
+historical_writer = None  # Created on first use by get_historical_writer
+
+# Function to get the shared historical data writer
+def get_historical_writer():
+    global historical_writer
+    if historical_writer is None:
+        historical_writer = HistoricalDataWriter(HISTORICAL_DATA_FILE, HISTORICAL_FIELDS, HISTORICAL_DATA_FORMAT)
+        atexit.register(historical_writer.close)
+    return historical_writer
+
 # Function for historical data
 def log_historical_data(cpu_usage, memory_percent, timestamp):
-    historical_data_file = 'historical_data.csv'
+    get_historical_writer().write((timestamp, cpu_usage, memory_percent))
 
-    # Check if the file exists; create headers if not
-    file_exists = os.path.isfile(historical_data_file)
-    with open(historical_data_file, 'a', newline='') as file:
-        fieldnames = ['Timestamp', 'CPU Usage', 'Memory Percent']
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
+numpy_module = False  # Resolved on first use by get_numpy, None when numpy is not installed
 
-        if not file_exists:
-            writer.writeheader()
+# Function to get numpy when it is installed, history queries fall back to pure Python without it
+def get_numpy():
+    global numpy_module
+    if numpy_module is False:
+        try:
+            import numpy
+            numpy_module = numpy
+        except ImportError:
+            numpy_module = None
+    return numpy_module
+
+# Function to list a history file's rotated segments, oldest first, followed by the live file
+def history_segments(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    prefix = os.path.basename(path) + '.'
+    segments = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                      if name.startswith(prefix) and name.endswith('.gz'))
+    if os.path.isfile(path):
+        segments.append(path)
+    return segments
+
+# Function to read timestamps and one field from a history segment (CSV or binary, plain or gzip)
+# Returns (timestamps, values) as float arrays; uncompressed binary files are memory-mapped
+def read_history_segment(path, field):
+    np = get_numpy()
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as file:
+        binary = file.read(len(HISTORICAL_BINARY_MAGIC)) == HISTORICAL_BINARY_MAGIC
+        if binary:
+            if opener is open and os.path.getsize(path) > 0:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                file.seek(0)
+                data = file.read()
+    if binary:
+        return read_binary_history(data, field)
+    with opener(path, 'rt', newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if not header or field not in header:
+            return array('d'), array('d')
+        column = header.index(field)
+        timestamps = array('d')
+        values = array('d')
+        for row in reader:
+            if len(row) > column:
+                try:
+                    timestamps.append(to_epoch(row[0]))
+                    values.append(float(row[column]) if row[column] else float('nan'))
+                except ValueError:
+                    continue  # Torn row from a crash mid-write
+    if np is not None:
+        return np.frombuffer(timestamps, dtype=np.float64), np.frombuffer(values, dtype=np.float64)
+    return timestamps, values
+
+# Function to pull timestamps and one column out of the columnar binary format
+def read_binary_history(data, field):
+    np = get_numpy()
+    header_end = data.find(b'\n', len(HISTORICAL_BINARY_MAGIC))
+    fieldnames = data[len(HISTORICAL_BINARY_MAGIC):header_end].decode().split(',')
+    if field not in fieldnames:
+        return array('d'), array('d')
+    column = fieldnames.index(field)
+    timestamp_parts = []
+    value_parts = []
+    offset = header_end + 1
+    while offset + 4 <= len(data):
+        count = struct.unpack_from('<I', data, offset)[0]
+        block_end = offset + 4 + count * 8 * len(fieldnames)
+        if block_end > len(data):
+            break  # Torn block from a crash mid-write
+        for index, parts in ((0, timestamp_parts), (column, value_parts)):
+            start = offset + 4 + index * count * 8
+            if np is not None:
+                parts.append(np.frombuffer(data, dtype='<f8', count=count, offset=start))
+            else:
+                part = array('d', bytes(data[start:start + count * 8]))
+                if sys.byteorder != 'little':
+                    part.byteswap()
+                parts.append(part)
+        offset = block_end
+    if np is not None:
+        return (np.concatenate(timestamp_parts) if timestamp_parts else np.empty(0),
+                np.concatenate(value_parts) if value_parts else np.empty(0))
+    timestamps = array('d')
+    values = array('d')
+    for part in timestamp_parts:
+        timestamps.extend(part)
+    for part in value_parts:
+        values.extend(part)
+    return timestamps, values
+
+# Function to downsample samples into fixed buckets of resolution seconds
+# Returns {'start', 'count', 'min', 'avg', 'max', 'p95'} as parallel lists, one entry per non-empty bucket
+def compute_rollups(timestamps, values, resolution):
+    np = get_numpy()
+    if np is not None:
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        keep = ~np.isnan(values)
+        timestamps, values = timestamps[keep], values[keep]
+        if not len(values):
+            return {key: [] for key in ('start', 'count', 'min', 'avg', 'max', 'p95')}
+        buckets = np.floor(timestamps / resolution).astype(np.int64)
+        order = np.lexsort((values, buckets))  # By bucket, then by value so percentiles are an index lookup
+        buckets, values = buckets[order], values[order]
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        counts = np.diff(np.r_[starts, len(values)])
+        return {
+            'start': (buckets[starts] * resolution).tolist(),
+            'count': counts.tolist(),
+            'min': values[starts].tolist(),
+            'avg': (np.add.reduceat(values, starts) / counts).tolist(),
+            'max': values[starts + counts - 1].tolist(),
+            'p95': values[starts + np.maximum(np.ceil(0.95 * counts).astype(np.int64) - 1, 0)].tolist(),
+        }
+    grouped = {}
+    for timestamp, value in zip(timestamps, values):
+        if value == value:  # Skip NaN gaps
+            grouped.setdefault(int(timestamp // resolution), []).append(value)
+    rollups = {key: [] for key in ('start', 'count', 'min', 'avg', 'max', 'p95')}
+    for bucket in sorted(grouped):
+        ordered = sorted(grouped[bucket])
+        rollups['start'].append(bucket * resolution)
+        rollups['count'].append(len(ordered))
+        rollups['min'].append(ordered[0])
+        rollups['avg'].append(sum(ordered) / len(ordered))
+        rollups['max'].append(ordered[-1])
+        rollups['p95'].append(percentile(ordered, 0.95))
+    return rollups
+
+# Function to merge rollups of the same resolution from consecutive segments
+# Buckets split across a rotation keep exact min/avg/max; their p95 is the larger of the two parts
+def merge_rollups(parts):
+    merged = {}
+    for rollups in parts:
+        for index, start in enumerate(rollups['start']):
+            bucket = [rollups[key][index] for key in ('count', 'min', 'avg', 'max', 'p95')]
+            existing = merged.get(start)
+            if existing is None:
+                merged[start] = bucket
+            else:
+                count = existing[0] + bucket[0]
+                merged[start] = [count, min(existing[1], bucket[1]),
+                                 (existing[2] * existing[0] + bucket[2] * bucket[0]) / count,
+                                 max(existing[3], bucket[3]), max(existing[4], bucket[4])]
+    result = {key: [] for key in ('start', 'count', 'min', 'avg', 'max', 'p95')}
+    for start in sorted(merged):
+        result['start'].append(start)
+        for key, value in zip(('count', 'min', 'avg', 'max', 'p95'), merged[start]):
+            result[key].append(value)
+    return result
+
+# History query over one field of a history file and its rotated segments
+# Rotated segments never change, so their rollups are computed once and kept in a
+# <segment>.rollup.json sidecar; only the live file is re-read on each query
+class HistoryQuery:
+    def __init__(self, path, field, resolutions=HISTORY_RESOLUTIONS):
+        self.path = path
+        self.field = field
+        self.resolutions = resolutions
+        self.cache = {}  # segment path -> (mtime, size, {resolution: rollups})
+
+    def segment_rollups(self, segment):
+        st = os.stat(segment)
+        cached = self.cache.get(segment)
+        if cached and cached[:2] == (st.st_mtime, st.st_size):
+            return cached[2]
+        rotated = segment != self.path
+        sidecar = segment + HISTORY_ROLLUP_SUFFIX
+        rollups = None
+        if rotated and os.path.isfile(sidecar):
+            try:
+                with open(sidecar) as file:
+                    stored = json.load(file)
+                rollups = {int(resolution): value for resolution, value in stored.get(self.field, {}).items()} or None
+            except (OSError, ValueError):
+                rollups = None
+        if rollups is None or set(rollups) != set(self.resolutions):
+            timestamps, values = read_history_segment(segment, self.field)
+            rollups = {resolution: compute_rollups(timestamps, values, resolution) for resolution in self.resolutions}
+            if rotated:
+                self.store_sidecar(sidecar, rollups)
+        self.cache[segment] = (st.st_mtime, st.st_size, rollups)
+        return rollups
+
+    def store_sidecar(self, sidecar, rollups):
+        try:
+            stored = {}
+            if os.path.isfile(sidecar):
+                with open(sidecar) as file:
+                    stored = json.load(file)
+            stored[self.field] = rollups
+            with open(sidecar + '.tmp', 'w') as file:
+                json.dump(stored, file)
+            os.replace(sidecar + '.tmp', sidecar)
+        except (OSError, ValueError) as e:
+            logging.error(f"Error writing history rollups {sidecar}: {str(e)}")
+
+    # Returns merged rollups at one resolution, optionally only buckets starting at or after since (epoch seconds)
+    def rollup(self, resolution, since=None):
+        parts = []
+        for segment in history_segments(self.path):
+            try:
+                rollups = self.segment_rollups(segment)[resolution]
+                if since is None or (rollups['start'] and rollups['start'][-1] >= since - resolution):
+                    parts.append(rollups)
+            except (OSError, EOFError, ValueError) as e:
+                logging.error(f"Error reading history segment {segment}: {str(e)}")
+        rollups = merge_rollups(parts)
+        if since is not None:
+            first = next((index for index, start in enumerate(rollups['start']) if start >= since - resolution), len(rollups['start']))
+            rollups = {key: value[first:] for key, value in rollups.items()}
+        return rollups
+
+    # Returns min/avg/max/p95 and sample count since the given time, p95 is taken over the bucket p95s
+    def summary(self, since=None, resolution=None):
+        rollups = self.rollup(resolution or min(self.resolutions), since)
+        count = sum(rollups['count'])
+        if not count:
+            return None
+        return {
+            'samples': count,
+            'min': min(rollups['min']),
+            'avg': sum(avg * bucket_count for avg, bucket_count in zip(rollups['avg'], rollups['count'])) / count,
+            'max': max(rollups['max']),
+            'p95': percentile(rollups['p95'], 0.95),
+        }
+
+history_queries = {}  # (path, field) -> HistoryQuery, so segment rollups stay cached between queries
+
+# Function to get the shared query for one field of a history file
+def get_history_query(path, field):
+    query = history_queries.get((path, field))
+    if query is None:
+        query = history_queries[(path, field)] = HistoryQuery(path, field)
+    return query
+
+# Function to fit a least-squares line, returns (slope per second, r squared) or None
+def linear_trend(xs, ys):
+    count = len(xs)
+    if count < 3:
+        return None
+    mean_x = sum(xs) / count
+    mean_y = sum(ys) / count
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    syy = sum((y - mean_y) ** 2 for y in ys)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    if not sxx:
+        return None
+    return sxy / sxx, (sxy * sxy / (sxx * syy) if syy else 0.0)
+
+# Function to pick the history file and field for a metric, preferring the daemon's per-collector files
+def history_source(metric):
+    extension = 'csv' if HISTORICAL_DATA_FORMAT == 'csv' else 'bin'
+    daemon_file, daemon_field, main_field = HISTORY_TREND_SOURCES[metric]
+    if history_segments(f"historical_{daemon_file}.{extension}"):
+        return f"historical_{daemon_file}.{extension}", daemon_field
+    return HISTORICAL_DATA_FILE, main_field
+
+# Function to derive recommendations from recent trends instead of a single sample
+def history_recommendations(now=None):
+    now = time.time() if now is None else now
+    recommendations = []
+    try:
+        cpu = get_history_query(*history_source('cpu')).rollup(60, now - HISTORY_SUSTAINED_WINDOW)
+        busy_minutes = sum(1 for avg in cpu['avg'] if avg > HISTORY_SUSTAINED_CPU_PERCENT)
+        if len(cpu['avg']) >= HISTORY_MIN_MINUTES and busy_minutes / len(cpu['avg']) >= HISTORY_SUSTAINED_FRACTION:
+            recommendations.append(f"CPU averaged above {HISTORY_SUSTAINED_CPU_PERCENT}% for {busy_minutes} of the last "
+                                   f"{len(cpu['avg'])} recorded minutes. Sustained load, check the top processes.")
+
+        memory = get_history_query(*history_source('memory')).rollup(60, now - HISTORY_LEAK_WINDOW)
+        trend = linear_trend(memory['start'], memory['avg']) if len(memory['avg']) >= HISTORY_MIN_MINUTES else None
+        if trend and trend[0] * 3600 >= HISTORY_LEAK_PERCENT_PER_HOUR and trend[1] >= HISTORY_LEAK_MIN_R2:
+            slope = trend[0] * 3600
+            hours_left = (100 - memory['avg'][-1]) / slope
+            recommendations.append(f"Memory usage has climbed steadily by {slope:.1f}% per hour "
+                                   f"(about {hours_left:.0f} hours until full). Possible memory leak.")
+    except (OSError, KeyError, ValueError) as e:
+        logging.error(f"Error reading historical data: {str(e)}")
+    return recommendations
+
+# Function to format CPU and memory summaries for the last hour, day and month
+def display_history_summary():
+    history_info = ["=== Historical Usage ==="]
+    now = time.time()
+    for metric in ('cpu', 'memory'):
+        query = get_history_query(*history_source(metric))
+        for label, seconds, resolution in (('hour', 3600, 60), ('day', 86400, 60), ('month', 30 * 86400, 3600)):
+            summary = query.summary(now - seconds, resolution)
+            if summary:
+                history_info.append(f"{query.field} over the last {label}: min {summary['min']:.1f}, avg {summary['avg']:.1f}, "
+                                    f"max {summary['max']:.1f}, p95 {summary['p95']:.1f} ({summary['samples']} samples)")
+    if len(history_info) == 1:
+        history_info.append("No historical data recorded yet.")
+    return '\n'.join(history_info)
+
+
+# Process sampler: per-process CPU time deltas between samples over a sliding window
+# One process_iter pass with a minimal attrs set per sample; only non-zero deltas are kept,
+# so idle processes cost a dict lookup, and USS is only read for the reported top entries
+class ProcessSampler:
+    def __init__(self, window=PROCESS_WINDOW_SECONDS, top_n=PROCESS_TOP_N):
+        self.window = window
+        self.top_n = top_n
+        self.cpu_times = {}  # pid -> cumulative user+system seconds at the last sample
+        self.names = {}
+        self.rss = {}
+        self.samples = deque()  # (time, {pid: cpu seconds used since the previous sample})
+        self.window_cpu = {}  # pid -> cpu seconds used inside the window
+        self.started = None
+        self.last = None
+
+    def sample(self):
+        now = time.monotonic()
+        cpu_times = {}
+        names = {}
+        rss = {}
+        deltas = {}
+        for process in psutil.process_iter(PROCESS_ATTRS, ad_value=None):
+            info = process.info
+            pid = info['pid']
+            if info['cpu_times'] is not None:
+                used = info['cpu_times'].user + info['cpu_times'].system
+                cpu_times[pid] = used
+                previous = self.cpu_times.get(pid)
+                # A pid that went backwards was reused by a new process
+                delta = used - previous if previous is not None and used >= previous else 0.0
+                if delta > 0:
+                    deltas[pid] = delta
+            if info['memory_info'] is not None:
+                rss[pid] = info['memory_info'].rss
+            names[pid] = info['name']
+        self.cpu_times, self.names, self.rss = cpu_times, names, rss
+        if self.last is not None:
+            self.samples.append((now, deltas))
+            for pid, delta in deltas.items():
+                self.window_cpu[pid] = self.window_cpu.get(pid, 0.0) + delta
+        else:
+            self.started = now
+        self.last = now
+        while self.samples and now - self.samples[0][0] > self.window:
+            self.started, expired = self.samples.popleft()  # The window now starts where that sample ended
+            for pid, delta in expired.items():
+                remaining = self.window_cpu[pid] - delta
+                if remaining > 1e-9:
+                    self.window_cpu[pid] = remaining
+                else:
+                    del self.window_cpu[pid]
+        return len(cpu_times)
+
+    # Seconds covered by the samples currently in the window
+    def window_span(self):
+        return self.last - self.started if self.samples else 0.0
+
+    # Returns [(pid, name, percent of one core)] for the heaviest CPU users in the window
+    def top_cpu(self, count=None):
+        span = self.window_span()
+        if span <= 0:
+            return []
+        top = heapq.nlargest(count or self.top_n, self.window_cpu.items(), key=lambda item: item[1])
+        return [(pid, self.names.get(pid), used / span * 100) for pid, used in top]
+
+    # Returns [(pid, name, rss, uss)] for the largest resident processes, uss is None when unavailable
+    def top_memory(self, count=None):
+        top = heapq.nlargest(count or self.top_n, self.rss.items(), key=lambda item: item[1])
+        consumers = []
+        for pid, rss in top:
+            try:
+                uss = psutil.Process(pid).memory_full_info().uss
+            except (psutil.Error, AttributeError):
+                uss = None
+            consumers.append((pid, self.names.get(pid), rss, uss))
+        return consumers
 
-        # Write the data to the CSV file
-        writer.writerow({'Timestamp': timestamp, 'CPU Usage': cpu_usage, 'Memory Percent': memory_percent})
+    def report(self):
+        return {'cpu': self.top_cpu(), 'memory': self.top_memory()}
 
+# Function to format the process report
+def display_top_processes(report):
+    process_info = ["=== Top Processes ==="]
+    for pid, name, percent in report['cpu']:
+        process_info.append(f"CPU: {name} (PID {pid}) - {percent:.1f}% of one core")
+    for pid, name, rss, uss in report['memory']:
+        unique = f", unique {uss / (1024 ** 2):.0f} MB" if uss is not None else ""
+        process_info.append(f"Memory: {name} (PID {pid}) - resident {rss / (1024 ** 2):.0f} MB{unique}")
+    return '\n'.join(process_info)
 
 # Function for System recommendations
-def system_recommendations(cpu_usage, memory_percent):
+def system_recommendations(cpu_usage, memory_percent, processes=None):
     recommendations = []
+    top_cpu = processes['cpu'][0] if processes and processes['cpu'] else None
+    top_memory = processes['memory'][0] if processes and processes['memory'] else None
+    # Only blame a process that accounts for a real share of the machine, not just the biggest of many small ones
+    if top_cpu and top_cpu[2] / (psutil.cpu_count() or 1) < PROCESS_CULPRIT_SHARE_PERCENT:
+        top_cpu = None
+    if top_memory and top_memory[2] / psutil.virtual_memory().total * 100 < PROCESS_CULPRIT_SHARE_PERCENT:
+        top_memory = None
 
     # CPU Recommendations
     if cpu_usage > 90:
-        recommendations.append("High CPU usage detected. Consider upgrading your CPU.")
+        if top_cpu:
+            recommendations.append(f"High CPU usage detected. Top consumer: {top_cpu[1]} (PID {top_cpu[0]}) at {top_cpu[2]:.0f}% of one core.")
+        else:
+            recommendations.append("High CPU usage detected. Consider upgrading your CPU.")
     elif cpu_usage > 70:
-        recommendations.append("Moderate CPU usage. Monitor performance for potential upgrades.")
+        if top_cpu:
+            recommendations.append(f"Moderate CPU usage. Mostly from {top_cpu[1]} (PID {top_cpu[0]}), check it before planning upgrades.")
+        else:
+            recommendations.append("Moderate CPU usage. Monitor performance for potential upgrades.")
 
     # Memory Recommendations
     if memory_percent > 90:
-        recommendations.append("High memory usage detected. Consider adding more RAM.")
+        if top_memory:
+            recommendations.append(f"High memory usage detected. Largest process: {top_memory[1]} (PID {top_memory[0]}) with {top_memory[2] / (1024 ** 3):.2f} GB resident.")
+        else:
+            recommendations.append("High memory usage detected. Consider adding more RAM.")
     elif memory_percent > 70:
-        recommendations.append("Moderate memory usage. Monitor performance for potential upgrades.")
+        if top_memory:
+            recommendations.append(f"Moderate memory usage. Largest process: {top_memory[1]} (PID {top_memory[0]}), check it before adding RAM.")
+        else:
+            recommendations.append("Moderate memory usage. Monitor performance for potential upgrades.")
 
     return recommendations
 
-# Example Usage
-cpu_usage = 85  # Replace with actual CPU usage percentage
-memory_percent = 80  # Replace with actual memory usage percentage
+# Storage inventory: real filesystems only, statvfs'd concurrently by daemon threads so a hung
+# mount (e.g. a stale NFS export) is reported as unresponsive instead of blocking the caller
+storage_cache = None  # (time collected, entries) from the last get_storage_inventory
+hung_mounts = {}  # Mountpoint -> time its still-unfinished stat call started
+storage_jobs = queue.Queue()
+storage_workers = []
+storage_lock = threading.Lock()
 
-recommendations = system_recommendations(cpu_usage, memory_percent)
+# Function to list mounted filesystems worth reporting: no pseudo filesystems, one entry per bind-mounted device
+def list_real_partitions():
+    partitions = {}
+    for partition in psutil.disk_partitions(all=True):
+        if partition.fstype.lower() in PSEUDO_FILESYSTEMS and partition.mountpoint not in ('/', os.path.abspath(os.sep)):
+            continue
+        if not partition.fstype and platform.system() != "Windows":
+            continue
+        key = (partition.device, partition.fstype)
+        known = partitions.get(key)
+        if known is None or len(partition.mountpoint) < len(known.mountpoint):
+            partitions[key] = partition  # Keep the shortest mountpoint of a bind-mounted device
+    return sorted(partitions.values(), key=lambda partition: partition.mountpoint)
 
-if recommendations:
-    logging.info("System Recommendations:")
-    for recommendation in recommendations:
-        logging.info("- " + recommendation)
-else:
-    logging.info("No specific recommendations at the moment.")
-
-# Function to start a scan
-def start_scan(drives_to_scan):
-    problem_files = []  # Define the problem_files list
-    scanned_files = []  # Define the scanned_files list
-
-    # Log that the scan is starting
-    logging.info("Scan started for the following drives: " + ', '.join(drives_to_scan))
-
-    # Scan the selected drives
-    for drive in drives_to_scan:
-        scan_drive(drive, problem_files, scanned_files)
+def storage_worker():
+    while True:
+        mountpoint, results, done = storage_jobs.get()
+        started = time.monotonic()
+        with storage_lock:
+            hung_mounts[mountpoint] = started
+        try:
+            results[mountpoint] = psutil.disk_usage(mountpoint)
+        except Exception as e:
+            results[mountpoint] = e
+        finally:
+            with storage_lock:
+                hung_mounts.pop(mountpoint, None)
+            done.release()
 
-    # Log that the scan is completed
-    logging.info("Scan completed for all selected drives.")
+# Function to stat many mountpoints concurrently, giving up on each after timeout seconds
+# Returns {mountpoint: usage, exception, or None when the mount did not answer in time}
+def stat_mountpoints(mountpoints, timeout=STORAGE_STAT_TIMEOUT):
+    results = {}
+    done = threading.Semaphore(0)
+    with storage_lock:
+        skipped = [mountpoint for mountpoint in mountpoints if mountpoint in hung_mounts]
+        busy = len(hung_mounts)
+    pending = [mountpoint for mountpoint in mountpoints if mountpoint not in skipped]
+    # Workers stuck on hung mounts never come back, so keep enough live ones around
+    while len(storage_workers) - busy < min(STORAGE_STAT_WORKERS, len(pending)):
+        worker = threading.Thread(target=storage_worker, name='storage-stat', daemon=True)
+        worker.start()
+        storage_workers.append(worker)
+    for mountpoint in pending:
+        storage_jobs.put((mountpoint, results, done))
+    deadline = time.monotonic() + timeout
+    for _ in pending:
+        if not done.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            break
+    return {mountpoint: results.get(mountpoint) for mountpoint in mountpoints}
 
-    # Log the scan results for problem files
-    if problem_files:
-        logging.info("Problems found in files:")
-        for problem_file in problem_files:
-            logging.info(problem_file)
+# Function to get the storage inventory, cached for STORAGE_CACHE_SECONDS
+# Each entry has device, mountpoint, fstype, status ('ok', 'unresponsive' or 'error') and sizes when ok
+def get_storage_inventory(refresh=False):
+    global storage_cache
+    if storage_cache is not None and not refresh and time.monotonic() - storage_cache[0] < STORAGE_CACHE_SECONDS:
+        return storage_cache[1]
+    partitions = list_real_partitions()
+    usages = stat_mountpoints([partition.mountpoint for partition in partitions])
+    entries = []
+    for partition in partitions:
+        usage = usages[partition.mountpoint]
+        entry = {'device': partition.device, 'mountpoint': partition.mountpoint, 'fstype': partition.fstype}
+        if usage is None:
+            entry['status'] = 'unresponsive'
+        elif isinstance(usage, Exception):
+            entry.update(status='error', error=str(usage))
+        else:
+            entry.update(status='ok', total=usage.total, used=usage.used, free=usage.free, percent=usage.percent)
+        entries.append(entry)
+    storage_cache = (time.monotonic(), entries)
+    return entries
 
 # Function to display storage information
 def display_storage_info():
     storage_info = []
     storage_info.append("=== Storage Information ===")
-    for partition in psutil.disk_partitions():
-        usage = psutil.disk_usage(partition.mountpoint)
-        storage_info.append(f"{partition.device} - Total: {usage.total / (1024 ** 3):.2f} GB, Free: {usage.free / (1024 ** 3):.2f} GB, Used: {usage.percent}%")
+    for entry in get_storage_inventory():
+        if entry['status'] == 'ok':
+            storage_info.append(f"{entry['device']} ({entry['mountpoint']}) - Total: {entry['total'] / (1024 ** 3):.2f} GB, Free: {entry['free'] / (1024 ** 3):.2f} GB, Used: {entry['percent']}%")
+        elif entry['status'] == 'unresponsive':
+            storage_info.append(f"{entry['device']} ({entry['mountpoint']}) - Not responding (skipped)")
+        else:
+            storage_info.append(f"{entry['device']} ({entry['mountpoint']}) - Error: {entry['error']}")
     return '\n'.join(storage_info)
 
-# Function to perform network diagnostics
-def perform_network_diagnostics():
+# Disk usage tree: one array slot per directory (name, parent index, own bytes, own file count)
+# Files are never kept, only folded into their directory and a bounded heap of the largest ones,
+# so memory grows with the number of directories rather than files (plus hard-linked inodes, counted once)
+class DiskUsageTree:
+    def __init__(self, roots, top_n=DISK_USAGE_TOP_N):
+        self.roots = [root for root in roots if os.path.isdir(root)]
+        self.top_n = top_n
+        self.names = []
+        self.parents = array('q')
+        self.own_bytes = array('Q')
+        self.own_files = array('Q')
+        self.total_bytes = None  # Filled in bottom-up by finish()
+        self.total_files = None
+        self.pending = {}  # Listed-but-not-yet-walked directory path -> index
+        self.largest_files = []  # Min-heap of (size, path)
+        self.linked = set()  # (dev, ino) of hard-linked files already counted under another name
+        for root in self.roots:
+            self.pending[root] = self.add(root, -1)
+
+    def add(self, name, parent):
+        self.names.append(name)
+        self.parents.append(parent)
+        self.own_bytes.append(0)
+        self.own_files.append(0)
+        return len(self.names) - 1
+
+    # ScanEngine on_directory callback, runs on the event loop
+    def on_directory(self, path, subdirs, files):
+        index = self.pending.pop(path, None)
+        if index is None:
+            return
+        for subdir in subdirs:
+            self.pending[subdir] = self.add(os.path.basename(subdir), index)
+        size = 0
+        count = 0
+        for file_entry in files:
+            if file_entry[5] > 1:
+                if (file_entry[1], file_entry[2]) in self.linked:
+                    continue
+                self.linked.add((file_entry[1], file_entry[2]))
+            size += file_entry[3]
+            count += 1
+            if len(self.largest_files) < self.top_n:
+                heapq.heappush(self.largest_files, (file_entry[3], file_entry[0]))
+            elif file_entry[3] > self.largest_files[0][0]:
+                heapq.heapreplace(self.largest_files, (file_entry[3], file_entry[0]))
+        self.own_bytes[index] = size
+        self.own_files[index] = count
+
+    # Roll sizes up into parents; children always have higher indices than their parent
+    def finish(self):
+        self.total_bytes = array('Q', self.own_bytes)
+        self.total_files = array('Q', self.own_files)
+        for index in range(len(self.names) - 1, -1, -1):
+            parent = self.parents[index]
+            if parent >= 0:
+                self.total_bytes[parent] += self.total_bytes[index]
+                self.total_files[parent] += self.total_files[index]
+        self.pending.clear()
+        self.linked.clear()
+        return self
+
+    def path(self, index):
+        parts = []
+        while index >= 0:
+            parts.append(self.names[index])
+            index = self.parents[index]
+        return os.path.join(*reversed(parts))
+
+    # Returns [(path, bytes, files)] for the largest directories including their subdirectories
+    def top_directories(self, count=None):
+        largest = heapq.nlargest(count or self.top_n, range(len(self.names)), key=self.total_bytes.__getitem__)
+        return [(self.path(index), self.total_bytes[index], self.total_files[index]) for index in largest]
+
+    # Returns [(path, bytes)] for the largest files
+    def top_files(self):
+        return [(path, size) for size, path in sorted(self.largest_files, reverse=True)]
+
+    # Stream the tree to JSON as {"directories": {path: [bytes, files]}} so exports can be diffed by path
+    def export_json(self, path, min_bytes=0):
+        with open(path, 'w') as file:
+            file.write('{"generated": %s, "roots": %s, "largest_files": %s, "directories": {' % (
+                json.dumps(time.strftime("%Y-%m-%d %H:%M:%S")), json.dumps(self.roots), json.dumps(self.top_files())))
+            separator = '\n'
+            for index in range(len(self.names)):
+                if self.total_bytes[index] >= min_bytes:
+                    file.write(f"{separator}{json.dumps(self.path(index))}: [{self.total_bytes[index]}, {self.total_files[index]}]")
+                    separator = ',\n'
+            file.write('\n}}\n')
+        logging.info(f"Disk usage exported to {path}")
+
+# Function to build a disk usage tree for the roots in one scandir pass
+def analyze_disk_usage(roots, top_n=DISK_USAGE_TOP_N, progress=None):
+    tree = DiskUsageTree(roots, top_n)
+    engine = ScanEngine(check_file=None, on_directory=tree.on_directory, progress=progress)
+    asyncio.run(engine.run(tree.roots))
+    return tree.finish()
+
+# Function to compute nearest-rank percentiles over a list of numbers
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+# Function to summarize round-trip times (ms) into loss and latency percentiles
+def latency_summary(rtts, sent):
+    received = len(rtts)
+    return {
+        'sent': sent,
+        'received': received,
+        'packet_loss': (sent - received) / sent * 100 if sent else 0.0,
+        'min_ms': min(rtts) if rtts else None,
+        'avg_ms': sum(rtts) / received if rtts else None,
+        'max_ms': max(rtts) if rtts else None,
+        'p50_ms': percentile(rtts, 0.50),
+        'p90_ms': percentile(rtts, 0.90),
+        'p99_ms': percentile(rtts, 0.99),
+    }
+
+dns_cache = {}  # Host -> (expiry time, addresses)
+
+# Function to resolve a host without blocking the event loop, results are cached for ttl seconds
+async def resolve_host(host, ttl=DNS_CACHE_TTL):
+    cached = dns_cache.get(host)
+    if cached and cached[0] > time.monotonic():
+        return {'probe': 'dns', 'target': host, 'ok': True, 'addresses': cached[1], 'elapsed_ms': 0.0, 'cached': True}
+    start = time.perf_counter()
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        return {'probe': 'dns', 'target': host, 'ok': False, 'error': str(e), 'elapsed_ms': (time.perf_counter() - start) * 1000}
+    addresses = list(dict.fromkeys(info[4][0] for info in infos))
+    dns_cache[host] = (time.monotonic() + ttl, addresses)
+    return {'probe': 'dns', 'target': host, 'ok': True, 'addresses': addresses,
+            'elapsed_ms': (time.perf_counter() - start) * 1000, 'cached': False}
+
+# Function to run a command without blocking the event loop, killing it if the caller gives up
+async def run_probe_command(*command):
+    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
     try:
-        # Check network connectivity using ping
-        target_host = "www.google.ca"
-        response = subprocess.run(["ping", "-c", "4", target_host], capture_output=True, text=True, check=True)
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+    return process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
 
-        if "4 packets transmitted, 4 received" in response.stdout:
-            logging.info("Ping Test: Network is reachable.")
+# Function to ping a host with the in-process prober (ICMP, or TCP connect when ICMP is not permitted)
+async def probe_ping(host, count=NETWORK_PING_COUNT, prober=None):
+    own_prober = prober is None
+    prober = prober or LatencyProber()
+    try:
+        result = await prober.probe(host, count)
+    finally:
+        if own_prober:
+            prober.close()
+    result['probe'] = 'ping'
+    return result
+
+# Function to compute the internet checksum of an ICMP packet
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+# Function to bucket round-trip times (ms) into a fixed histogram, keys are bucket upper bounds
+def rtt_histogram(rtts, bounds=LATENCY_HISTOGRAM_BOUNDS):
+    histogram = dict.fromkeys([*bounds, 'inf'], 0)
+    for rtt in rtts:
+        for bound in bounds:
+            if rtt <= bound:
+                histogram[bound] += 1
+                break
         else:
-            logging.warning("Ping Test: Network is unreachable.")
+            histogram['inf'] += 1
+    return histogram
+
+# In-process latency prober: ICMP echo over one unprivileged (or raw) socket shared by every
+# target, with TCP connect timing as the fallback when ICMP sockets are not permitted
+class LatencyProber:
+    def __init__(self, timeout=LATENCY_PROBE_TIMEOUT, tcp_port=LATENCY_TCP_PORT, use_icmp=True):
+        self.timeout = timeout
+        self.tcp_port = tcp_port
+        self.identifier = os.getpid() & 0xffff
+        self.sequence = 0
+        self.pending = {}  # (address, sequence) -> (future, send time)
+        self.sock = None
+        self.raw = False
+        if use_icmp:
+            self.open_icmp_socket()
 
-        # Measure network speed TODO: fix this for windows, works 100% fine on Mac
-        st = speedtest.Speedtest()
-        download_speed = st.download() / 10**6  # in Mbps
-        upload_speed = st.upload() / 10**6  # in Mbps
-        logging.info(f"Speed Test: Download Speed: {download_speed:.2f} Mbps, Upload Speed: {upload_speed:.2f} Mbps")
+    def open_icmp_socket(self):
+        for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+            try:
+                self.sock = socket.socket(socket.AF_INET, sock_type, socket.IPPROTO_ICMP)
+            except OSError:
+                continue
+            self.sock.setblocking(False)
+            self.raw = sock_type == socket.SOCK_RAW
+            return
+        logging.debug("ICMP sockets not permitted, latency probes will use TCP connect")
 
-        # DNS resolution check
+    @property
+    def method(self):
+        return 'icmp' if self.sock is not None else 'tcp'
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            except RuntimeError:
+                pass
+            self.sock.close()
+            self.sock = None
+
+    def on_readable(self):
+        while True:
+            try:
+                data, (address, _) = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            received = time.perf_counter()
+            if data and data[0] >> 4 == 4:
+                data = data[(data[0] & 0x0f) * 4:]  # Strip the IPv4 header (raw sockets, macOS datagram sockets)
+            if len(data) < 8:
+                continue
+            icmp_type, _, _, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+            if icmp_type != 0 or (self.raw and identifier != self.identifier):
+                continue  # Not an echo reply, or a reply to another process's raw socket
+            waiter = self.pending.pop((address, sequence), None)
+            if waiter and not waiter[0].done():
+                waiter[0].set_result((received - waiter[1]) * 1000)
+
+    async def ping_icmp(self, address):
+        loop = asyncio.get_running_loop()
+        if not self.pending:
+            loop.add_reader(self.sock.fileno(), self.on_readable)
+        self.sequence = (self.sequence + 1) & 0xffff
+        sequence = self.sequence
+        header = struct.pack('!BBHHH', 8, 0, 0, self.identifier, sequence)
+        payload = b'pctricorder-probe'
+        packet = struct.pack('!BBHHH', 8, 0, icmp_checksum(header + payload), self.identifier, sequence) + payload
+        future = loop.create_future()
+        self.pending[(address, sequence)] = (future, time.perf_counter())
+        try:
+            self.sock.sendto(packet, (address, 0))
+            return await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            self.pending.pop((address, sequence), None)
+            if not self.pending and self.sock is not None:
+                loop.remove_reader(self.sock.fileno())
+
+    # A refused connection still proves the host answered, so it counts as a reply
+    async def ping_tcp(self, address, port=None):
+        start = time.perf_counter()
         try:
-            socket.gethostbyname(target_host)
-            logging.info("DNS Resolution: DNS is working properly.")
-        except socket.error:
-            logging.warning("DNS Resolution: Unable to resolve DNS.")
+            _, writer = await asyncio.wait_for(asyncio.open_connection(address, port or self.tcp_port), self.timeout)
+        except ConnectionRefusedError:
+            return (time.perf_counter() - start) * 1000
+        except (asyncio.TimeoutError, OSError):
+            return None
+        rtt = (time.perf_counter() - start) * 1000
+        writer.close()
+        return rtt
 
-        # Traceroute
-        target_ip = socket.gethostbyname(target_host)
-        traceroute_output = subprocess.run(["traceroute", target_ip], capture_output=True, text=True)
-        logging.info(f"Traceroute:\n{traceroute_output.stdout}")    
+    # Send count probes to one host, interval seconds apart, returning the summary and RTT histogram
+    async def probe(self, host, count=NETWORK_PING_COUNT, interval=LATENCY_PROBE_INTERVAL, port=None):
+        dns_result = await resolve_host(host)
+        if not dns_result['ok']:
+            return {'probe': 'latency', 'target': host, 'ok': False, 'error': dns_result['error']}
+        address = next((candidate for candidate in dns_result['addresses'] if ':' not in candidate), dns_result['addresses'][0])
+        use_icmp = self.sock is not None and port is None and ':' not in address
+        rtts = []
+        for number in range(count):
+            if number:
+                await asyncio.sleep(interval)
+            rtt = await (self.ping_icmp(address) if use_icmp else self.ping_tcp(address, port))
+            if rtt is not None:
+                rtts.append(rtt)
+        result = {'probe': 'latency', 'target': host, 'address': address, 'method': 'icmp' if use_icmp else 'tcp', 'ok': bool(rtts)}
+        result.update(latency_summary(rtts, count))
+        result['histogram'] = rtt_histogram(rtts)
+        return result
 
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error during network diagnostics: {e.stderr}")
-        logging.warning("Ping Test: Network is unreachable. Check network configuration and firewall settings.")
+    # Probe many hosts concurrently from this one socket and event loop
+    async def probe_many(self, hosts, count=NETWORK_PING_COUNT, interval=LATENCY_PROBE_INTERVAL, port=None):
+        return await asyncio.gather(*(self.probe(host, count, interval, port) for host in hosts))
+
+# Function to trace the route to a host and return the hop list
+async def probe_traceroute(host, max_hops=30):
+    if platform.system() == "Windows":
+        command = ["tracert", "-d", "-h", str(max_hops), host]
+    else:
+        command = ["traceroute", "-n", "-q", "1", "-w", "2", "-m", str(max_hops), host]
+    returncode, stdout, stderr = await run_probe_command(*command)
+    hops = []
+    for line in stdout.splitlines():
+        match = re.match(r'\s*(\d+)\s+(.*)', line)
+        if not match:
+            continue
+        address = re.search(r'(\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F]*:[0-9a-fA-F:]+)', match.group(2))
+        rtt = re.search(r'<?([\d.]+)\s*ms', match.group(2))
+        hops.append({'hop': int(match.group(1)), 'address': address.group(1) if address else None,
+                     'rtt_ms': float(rtt.group(1)) if rtt else None})
+    result = {'probe': 'traceroute', 'target': host, 'ok': returncode == 0 and bool(hops), 'hops': hops}
+    if returncode != 0 and stderr:
+        result['error'] = stderr.strip()
+    return result
+
+# Function to time TCP connections to a host port
+async def probe_tcp(host, port, count=NETWORK_PING_COUNT):
+    rtts = []
+    errors = []
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError as e:
+            errors.append(str(e))
+            continue
+        rtts.append((time.perf_counter() - start) * 1000)
+        writer.close()
+        await writer.wait_closed()
+    result = {'probe': 'tcp', 'target': host, 'port': port, 'ok': bool(rtts)}
+    result.update(latency_summary(rtts, count))
+    if errors:
+        result['error'] = errors[-1]
+    return result
+
+# Function to measure download and upload speed with speedtest (runs in a worker thread)
+def measure_speed():
+    import speedtest  # Imported here so startup does not pay for it
+    st = speedtest.Speedtest()
+    download_speed = st.download() / 10**6  # in Mbps
+    upload_speed = st.upload() / 10**6  # in Mbps
+    return {'probe': 'speedtest', 'ok': True, 'download_mbps': download_speed, 'upload_mbps': upload_speed}
+
+# Function to run one probe with a timeout, turning failures into a structured result
+async def run_probe(name, target, coroutine, timeout):
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(coroutine, timeout)
+    except asyncio.TimeoutError:
+        result = {'probe': name, 'target': target, 'ok': False, 'error': f"timed out after {timeout}s"}
     except Exception as e:
-        logging.error(f"Unexpected error during network diagnostics: {str(e)}")
+        result = {'probe': name, 'target': target, 'ok': False, 'error': str(e)}
+    result.setdefault('elapsed_ms', (time.perf_counter() - start) * 1000)
+    instrumentation.observe(f"probe.{name}", time.perf_counter() - start)
+    if not result.get('ok', True):
+        instrumentation.count(f"probe.{name}.errors")
+    return result
 
-        
+# Function to probe one target: resolve it once, then run its other probes concurrently against the address
+async def diagnose_target(target, probes, timeouts, tcp_port, prober):
+    dns_result = await run_probe('dns', target, resolve_host(target), timeouts['dns'])
+    results = [dns_result]
+    if not dns_result['ok']:
+        return results
+    address = dns_result['addresses'][0]
+    pending = []
+    if 'ping' in probes:
+        pending.append(run_probe('ping', target, probe_ping(address, prober=prober), timeouts['ping']))
+    if 'traceroute' in probes:
+        pending.append(run_probe('traceroute', target, probe_traceroute(address), timeouts['traceroute']))
+    if 'tcp' in probes and tcp_port:
+        pending.append(run_probe('tcp', target, probe_tcp(address, tcp_port), timeouts['tcp']))
+    for result in await asyncio.gather(*pending):
+        result['target'] = target
+        result['address'] = address
+        results.append(result)
+    return results
 
-def perform_security_checks():
+# Function to run network diagnostics against many targets concurrently
+# Returns a list of result dicts, one per probe, each with 'probe', 'target', 'ok' and probe-specific fields
+async def run_network_diagnostics(targets=NETWORK_TARGETS, probes=NETWORK_PROBES, timeouts=None,
+                                  tcp_port=None, speed_test=False):
+    timeouts = dict(NETWORK_PROBE_TIMEOUTS, **(timeouts or {}))
+    prober = LatencyProber()
+    pending = [diagnose_target(target, probes, timeouts, tcp_port, prober) for target in targets]
+    if speed_test:
+        loop = asyncio.get_running_loop()
+        pending.append(run_probe('speedtest', None, loop.run_in_executor(None, measure_speed), timeouts['speedtest']))
+    results = []
+    try:
+        for outcome in await asyncio.gather(*pending):
+            results.extend(outcome if isinstance(outcome, list) else [outcome])
+    finally:
+        prober.close()
+    return results
+
+# Function to log structured network diagnostics results
+def log_network_results(results):
+    for result in results:
+        target = result.get('target')
+        if result['probe'] == 'ping':
+            if result['ok'] and result['packet_loss'] == 0:
+                logging.info(f"Ping Test ({target}, {result['method']}): Network is reachable. {result['received']}/{result['sent']} received, "
+                             f"avg {result['avg_ms']:.2f} ms, p90 {result['p90_ms']:.2f} ms")
+            elif result['ok']:
+                logging.warning(f"Ping Test ({target}): {result['packet_loss']:.0f}% packet loss, avg {result['avg_ms']:.2f} ms")
+            else:
+                logging.warning(f"Ping Test ({target}): Network is unreachable. {result.get('error', '')}")
+        elif result['probe'] == 'dns':
+            if result['ok']:
+                logging.info(f"DNS Resolution ({target}): DNS is working properly. {', '.join(result['addresses'])}")
+            else:
+                logging.warning(f"DNS Resolution ({target}): Unable to resolve DNS. {result.get('error', '')}")
+        elif result['probe'] == 'traceroute':
+            if result['ok']:
+                hops = '\n'.join(f"{hop['hop']:>3}  {hop['address'] or '*'}  " + ('' if hop['rtt_ms'] is None else f"{hop['rtt_ms']:.2f} ms")
+                                 for hop in result['hops'])
+                logging.info(f"Traceroute ({target}):\n{hops}")
+            else:
+                logging.warning(f"Traceroute ({target}) failed: {result.get('error', '')}")
+        elif result['probe'] == 'tcp':
+            if result['ok']:
+                logging.info(f"TCP Connect ({target}:{result['port']}): avg {result['avg_ms']:.2f} ms, {result['packet_loss']:.0f}% failed")
+            else:
+                logging.warning(f"TCP Connect ({target}:{result['port']}) failed: {result.get('error', '')}")
+        elif result['probe'] == 'speedtest':
+            if result['ok']:
+                logging.info(f"Speed Test: Download Speed: {result['download_mbps']:.2f} Mbps, Upload Speed: {result['upload_mbps']:.2f} Mbps")
+            else:
+                logging.warning(f"Speed Test failed: {result.get('error', '')}")
+
+# Function to perform network diagnostics
+def perform_network_diagnostics(targets=NETWORK_TARGETS, speed_test=True):
     try:
-        # Check for antivirus status
-        check_antivirus_status()
+        results = asyncio.run(run_network_diagnostics(targets, speed_test=speed_test))
+        log_network_results(results)
+        return results
+    except Exception as e:
+        logging.error(f"Unexpected error during network diagnostics: {str(e)}")
+        return []
 
-        # Scan for malware
-        scan_for_malware()
-        # For example, scan for malware or check antivirus status
-        logging.info("Performing security checks...")
         
 
-        # You can add more security checks here
+# Background command runner: subprocesses run on one asyncio loop in a worker thread, so several slow
+# checks proceed at once while the menu stays responsive. Output is read incrementally and handed to
+# on_line as it arrives (carriage-return progress updates count as lines), every run has a timeout and
+# can be cancelled, and finished results are cached per command for a caller-chosen TTL
+class CommandRunner:
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.cache = {}  # Command tuple -> (expiry time, result)
+        self.running = {}  # Command tuple -> Future of the run in progress
 
-        logging.info("Security checks completed.")
-    # Check for software updates on Windows
-        if platform.system() == "Windows":
-            logging.info("Checking for software updates...")
-            update_command = "winget upgrade --all"
-            # Run the update command with tqdm progress bar
-        with tqdm(total=100, desc="Updating", dynamic_ncols=True) as pbar:
-            update_process = subprocess.Popen(update_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, shell=True, bufsize=1, universal_newlines=True)
-
-            for line in update_process.stdout:
-                # Check if the line contains progress information
-                # You need to adjust this based on the actual output format of the command
-                if "progress" in line:
-                    # Extract progress information and update the progress bar
-                    progress_value = extract_progress_from_line(line)
-                    pbar.update(progress_value)
-
-            # Wait for the process to complete
-            update_process.wait()
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name='command-runner', daemon=True)
+                self.thread.start()
+        return self.loop
 
-    except Exception as e:
-        logging.error(f"Error performing security checks: {str(e)}")
+    # Start a command in the background and return a concurrent.futures.Future of its result dict
+    # A cached result younger than ttl seconds, or an identical command already running, is reused
+    def submit(self, command, timeout=COMMAND_TIMEOUT, ttl=0, on_line=None):
+        key = tuple(command)
+        with self.lock:
+            cached = self.cache.get(key)
+            if ttl and cached and cached[0] > time.monotonic():
+                future = concurrent.futures.Future()
+                future.set_result(dict(cached[1], cached=True))
+                return future
+            running = self.running.get(key)
+            if running is not None and not running.done():
+                return running
+        future = asyncio.run_coroutine_threadsafe(self.execute(list(command), timeout, on_line), self.start())
+        with self.lock:
+            self.running[key] = future
 
-def extract_progress_from_line(line):
-    # Implement logic to extract progress information from the line
-    # You need to adjust this based on the actual output format of the command
-    # Return the progress value (percentage) as an integer
-    return 10  # Placeholder value, replace with actual extraction logic   
+        def finished(done):
+            with self.lock:
+                if self.running.get(key) is done:
+                    del self.running[key]
+                if ttl and not done.cancelled() and done.exception() is None and done.result()['status'] in ('ok', 'failed'):
+                    self.cache[key] = (time.monotonic() + ttl, done.result())
+        future.add_done_callback(finished)
+        return future
 
-def check_antivirus_status():
+    # Run a command and wait for it, raising like subprocess.run: FileNotFoundError when the program is
+    # missing, subprocess.TimeoutExpired on timeout and, with check, CalledProcessError on a non-zero exit
+    def run(self, command, timeout=COMMAND_TIMEOUT, ttl=0, on_line=None, check=False):
+        future = self.submit(command, timeout, ttl, on_line)
+        try:
+            result = future.result()
+        except KeyboardInterrupt:
+            future.cancel()
+            raise
+        if result['status'] == 'missing':
+            raise FileNotFoundError(result['stderr'])
+        if result['status'] == 'timeout':
+            raise subprocess.TimeoutExpired(command, timeout, result['stdout'], result['stderr'])
+        if check and result['returncode'] != 0:
+            raise subprocess.CalledProcessError(result['returncode'], command, result['stdout'], result['stderr'])
+        return result
+
+    def invalidate(self, command=None):
+        with self.lock:
+            if command is None:
+                self.cache.clear()
+            else:
+                self.cache.pop(tuple(command), None)
+
+    async def execute(self, command, timeout, on_line):
+        started = time.monotonic()
+        result = {'command': command, 'returncode': None, 'stdout': '', 'stderr': '', 'status': 'ok', 'cached': False}
+        try:
+            process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.DEVNULL,
+                                                           stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except (FileNotFoundError, PermissionError) as e:
+            result.update(status='missing', stderr=str(e), seconds=time.monotonic() - started)
+            return result
+        stdout = []
+        stderr = []
+        readers = asyncio.gather(read_command_stream(process.stdout, stdout, on_line),
+                                 read_command_stream(process.stderr, stderr, None))
+        try:
+            await asyncio.wait_for(asyncio.shield(readers), timeout)
+            result['returncode'] = await process.wait()
+            result['status'] = 'ok' if result['returncode'] == 0 else 'failed'
+        except asyncio.TimeoutError:
+            result['status'] = 'timeout'
+        except asyncio.CancelledError:
+            result['status'] = 'cancelled'
+            raise
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            if not readers.done():
+                await asyncio.wait({readers}, timeout=1)  # Collect what the killed process left in the pipes
+                readers.cancel()
+            result.update(stdout=''.join(stdout), stderr=''.join(stderr), seconds=time.monotonic() - started)
+            instrumentation.observe(f"command.{os.path.basename(command[0])}", result['seconds'])
+        return result
+
+# Function to read a command's output stream into parts, calling on_line for every \n or \r terminated piece
+# Stored output is capped at COMMAND_OUTPUT_LIMIT characters, the callback still sees everything
+async def read_command_stream(stream, parts, on_line):
+    pending = ''
+    stored = 0
+    while True:
+        chunk = await stream.read(COMMAND_READ_SIZE)
+        if not chunk:
+            break
+        text = chunk.decode(errors='replace')
+        if stored < COMMAND_OUTPUT_LIMIT:
+            parts.append(text[:COMMAND_OUTPUT_LIMIT - stored])
+            stored += len(text)
+        if on_line is not None:
+            pieces = re.split(r'[\r\n]', pending + text)
+            pending = pieces.pop()
+            for piece in pieces:
+                if piece.strip():
+                    on_line(piece)
+    if on_line is not None and pending.strip():
+        on_line(pending)
+
+command_runner = None  # Created on first use by get_command_runner
+
+# Function to get the shared background command runner
+def get_command_runner():
+    global command_runner
+    if command_runner is None:
+        command_runner = CommandRunner()
+    return command_runner
+
+# Function for security checks: antivirus status, a malware scan and (on Windows) winget upgrades run
+# concurrently in the background; Ctrl+C cancels whatever is still running
+def perform_security_checks():
+    logging.info("Performing security checks...")
+    runner = get_command_runner()
+    checks = {}
+    progress = WingetProgress()
     if platform.system() == "Windows":
+        checks['malware'] = runner.submit(['powershell', '-NoProfile', 'Start-MpScan'], COMMAND_TIMEOUTS['malware'])
+        logging.info("Checking for software updates...")
+        checks['winget'] = runner.submit(['winget', 'upgrade', '--all', '--accept-source-agreements', '--accept-package-agreements'],
+                                         COMMAND_TIMEOUTS['winget'], on_line=progress.feed)
+    with ThreadPoolExecutor(1, thread_name_prefix='security-check') as pool:
+        antivirus = pool.submit(check_antivirus_status)
         try:
-            # Run a command to check antivirus status on Windows
-            result = subprocess.run(['powershell', 'Get-MpComputerStatus'], capture_output=True, text=True, check=True)
-            logging.info(f"Antivirus Status: {result.stdout.strip()}")
+            if 'winget' in checks:
+                from tqdm import tqdm
+                with tqdm(total=100, desc="Updating", dynamic_ncols=True) as pbar:
+                    while not checks['winget'].done():
+                        pbar.n = progress.percent
+                        pbar.set_postfix_str(progress.status, refresh=False)
+                        pbar.refresh()
+                        time.sleep(SECURITY_PROGRESS_INTERVAL)
+                    pbar.n = 100 if checks['winget'].result()['status'] == 'ok' else progress.percent
+                    pbar.refresh()
+            concurrent.futures.wait(list(checks.values()) + [antivirus])
+        except KeyboardInterrupt:
+            for future in checks.values():
+                future.cancel()
+            logging.info("Security checks cancelled.")
+            return
+    for name, future in checks.items():
+        if future.cancelled():
+            continue
+        result = future.result()
+        if result['status'] in ('missing', 'timeout'):
+            logging.error(f"Error running {' '.join(result['command'])}: {result['status']} {result['stderr'].strip()}")
+        elif name == 'malware':
+            log_malware_scan_result(result['stdout'])
+        elif name == 'winget':
+            logging.info(f"Software updates: {progress.summary(result)}")
+    logging.info("Security checks completed.")
+
+# Progress parser for `winget upgrade --all` output
+# winget prints "N upgrades available.", a "(i/N) Found ..." line per package, then a bar ending in
+# "12.5 MB / 40.0 MB" while downloading or "45%" while installing, each update ending in \r
+class WingetProgress:
+    def __init__(self):
+        self.total = None
+        self.index = 0
+        self.fraction = 0.0
+        self.installed = 0
+        self.failed = 0
+        self.status = ''
+
+    def feed(self, line):
+        line = line.strip()
+        counted = re.match(r'\((\d+)/(\d+)\)\s*(.*)', line)
+        available = re.match(r'(\d+)\s+upgrades?\s+available', line)
+        if counted:
+            self.index, self.total = int(counted.group(1)), int(counted.group(2))
+            self.fraction = 0.0
+            self.status = counted.group(3)[:60]
+        elif available:
+            self.total = int(available.group(1))
+        else:
+            fraction = extract_progress_from_line(line)
+            if fraction is not None:
+                self.fraction = fraction / 100
+            elif 'Successfully installed' in line:
+                self.installed += 1
+                self.fraction = 1.0
+            elif 'failed' in line.lower() and 'installer' in line.lower():
+                self.failed += 1
 
-            
+    @property
+    def percent(self):
+        if self.total:
+            return min(100.0, (max(self.index - 1, 0) + self.fraction) / self.total * 100)
+        return self.fraction * 100
 
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Error checking antivirus status: {e.stderr}")
+    def summary(self, result):
+        if self.total is None and result['returncode'] == 0:
+            return "no upgrades available."
+        return f"{self.installed} of {self.total or '?'} packages upgraded, {self.failed} failed."
+
+# Function to read a progress percentage (0-100) from one line of command output, None when there is none
+# Understands "45%" and "12.5 MB / 40.0 MB" style counters
+def extract_progress_from_line(line):
+    sizes = re.search(r'([\d.]+)\s*([KMGT]?B)\s*/\s*([\d.]+)\s*([KMGT]?B)', line)
+    if sizes:
+        units = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+        done = float(sizes.group(1)) * units[sizes.group(2)]
+        total = float(sizes.group(3)) * units[sizes.group(4)]
+        return min(100.0, done / total * 100) if total else None
+    percent = re.search(r'(\d+(?:\.\d+)?)\s*%', line)
+    if percent:
+        return min(100.0, float(percent.group(1)))
+    return None
+
+# Function to check antivirus status
+def check_antivirus_status():
+    collector = get_collector('antivirus')
+    if collector is None:
+        return None
+    try:
+        antivirus_status = collector.collect()
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Error checking antivirus status: {e.stderr}")
+        return None
+    except Exception as e:
+        logging.error(f"Error checking antivirus status: {str(e)}")
+        return None
+    logging.info(f"Antivirus Status: {antivirus_status['status']}")
+    return antivirus_status
 
 # You can add similar checks for other operating systems
 
@@ -263,13 +1776,15 @@ def scan_for_malware():
     try:
         if platform.system() == "Windows":
             # Run a command to scan for malware on Windows
-            result = subprocess.run(['powershell', 'Start-MpScan'], capture_output=True, text=True, check=True)
-            log_malware_scan_result(result.stdout)
+            result = get_command_runner().run(['powershell', '-NoProfile', 'Start-MpScan'], COMMAND_TIMEOUTS['malware'], check=True)
+            log_malware_scan_result(result['stdout'])
 
         # Add conditions for other operating systems if needed
 
     except subprocess.CalledProcessError as e:
         logging.error(f"Error scanning for malware: {e.stderr}")
+    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+        logging.error(f"Error scanning for malware: {str(e)}")
 
 def log_malware_scan_result(scan_output):
     # Display the results of the malware scan
@@ -281,65 +1796,22 @@ def log_malware_scan_result(scan_output):
 
 #Function to check for software updates of the OS this is running on
 def check_updates():
+    collector = get_collector('updates')
+    if collector is None:
+        logging.warning("Update checks not supported on this operating system.")
+        return None
     try:
-        system = platform.system()
-
-        if system == "Darwin":  # macOS
-            logging.info("Checking for macOS updates...")
-            subprocess.run(["softwareupdate", "-l"])
-
-        elif system == "Windows":
-            logging.info("Checking for Windows updates...")
-            subprocess.run(["choco", "upgrade", "all", "-y"])
-
-        else:
-            logging.warning("Update checks not supported on this operating system.")
-
-    except Exception as e:
-        logging.error(f"Error checking for updates: {str(e)}")                  
-
-# Function to scan a single drive
-def scan_drive(drive, problem_files, scanned_files):
-    try:
-        # Prepare the drive (e.g., list files and perform initial setup)
-        for root, _, files in os.walk(drive):
-            for file in files:
-                file_path = os.path.join(root, file)
-                # Handle file preparation tasks if needed
-                if not file_path.endswith(tuple(file_extensions_to_scan)):
-                    scan_file(file_path, problem_files, scanned_files)
-
-        logging.info(f"Prepared drive: {drive}")
-
-
-
-        # Perform the scan on the prepared drive
-        scan_selected_drives([drive], problem_files, scanned_files)
-
-    except Exception as e:
-        logging.error(f"Error preparing and scanning drive {drive}: {str(e)}")
-
-# Function to scan a single file for corruption (excluding ZIP archives)
-def scan_file_for_corruption(file_path, problem_files):
-    try:
-        # Skip ZIP files
-        if not file_path.lower().endswith('.zip'):
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-                if b'corruption_pattern' in file_data:
-                    problem_files.append(file_path)
-                    logging.warning(f"Corruption detected in file: {file_path}")
-                    logging.warning("This file is corrupted and needs to be repaired.")
-    except IsADirectoryError:
-        pass  # Skip directories
-    except FileNotFoundError:
-        pass  # Skip files not found
+        logging.info("Checking for macOS updates..." if platform.system() == "Darwin" else "Checking for Windows updates...")
+        updates = collector.collect()
+        logging.info(updates['output'])
+        return updates
     except Exception as e:
-        pass  # Handle any additional exceptions here
+        logging.error(f"Error checking for updates: {str(e)}")
+        return None
 
-# Function to check CPU usage
+# Function to check CPU usage (percentage since the previous call, does not block)
 def check_cpu_usage():
-    cpu_usage = psutil.cpu_percent(interval=1)
+    cpu_usage = psutil.cpu_percent(interval=None)
     logging.info(f"CPU Usage: {cpu_usage}%")
 
 # Function to check memory usage
@@ -347,65 +1819,112 @@ def check_memory_usage():
     virtual_memory = psutil.virtual_memory()
     logging.info(f"Memory Usage: {virtual_memory.percent}%")
 
+# Function to read CPU or GPU temperatures based on the operating system
+# Returns a dict such as {'cpu_temperature': 51.0}, empty when no sensor could be read
+def read_temperatures():
+    collector = get_collector('temperature')
+    return collector.collect() if collector is not None else {}
+
 # Function to check CPU or GPU temperature based on the operating system
 def check_temperature():
-    if platform.system() == "Darwin":
-        try:
-            osx_cpu_temp_path = '/Users/davemills/Documents/Projects/diagnostics/osx-cpu-temp/osx-cpu-temp'
-            temperature_output = os.popen(osx_cpu_temp_path).read().strip()
-            # Extract the numeric temperature value (removing '°C')
-            temperature = float(temperature_output.split(' ')[0])
-            logging.info(f"CPU Temperature: {temperature}°C")
-        except Exception as e:
-            logging.error(f"Error checking temperature: {str(e)}")
-    elif platform.system() == "Windows":
-        try:
-            import wmi
-            w = wmi.WMI()
-            temperature_info = w.Win32_TemperatureProbe()[0]
-            logging.info(f"CPU Temperature: {temperature_info.CurrentReading}°C")
-        except Exception as e:
-            logging.error(f"Error checking temperature: {str(e)}")
-    elif platform.system() == "Linux":
-        temperature = get_gpu_temperature_nvidia()
-        if temperature is not None:
-            logging.info(f"GPU Temperature: {temperature}°C")
-    else:
+    if get_collector('temperature') is None:
         logging.info("Temperature monitoring not supported on this OS")
+        return
+    try:
+        temperatures = read_temperatures()
+    except Exception as e:
+        logging.error(f"Error checking temperature: {str(e)}")
+        return
+    if 'cpu_temperature' in temperatures:
+        logging.info(f"CPU Temperature: {temperatures['cpu_temperature']}°C")
+    if 'gpu_temperature' in temperatures:
+        logging.info(f"GPU Temperature: {temperatures['gpu_temperature']}°C")
+    sensors = [f"{key} {value}°C" for key, value in temperatures.items() if key not in ('cpu_temperature', 'gpu_temperature')]
+    if sensors:
+        logging.info(f"Sensors: {', '.join(sensors)}")
 
 # Function to get RAM information
 def get_ram_info():
-    virtual_memory = psutil.virtual_memory()
-    total_ram = virtual_memory.total / (1024 ** 3)  # Convert to GB
+    total_ram = get_hardware_inventory()['total_ram'] / (1024 ** 3)  # Convert to GB
     logging.info(f"Total RAM: {total_ram:.2f} GB")
 
+# Function to read the active GPU description based on the operating system, None when unavailable
+def read_gpu_info():
+    collector = get_collector('gpu')
+    return collector.collect()['gpu'] if collector is not None else None
+
 # Function to get GPU information based on the operating system
 def get_gpu_info():
-    if platform.system() == "Darwin":
-        try:
-            gpu_info = os.popen('system_profiler SPDisplaysDataType').read()
-            # Extract the active GPU information
-            active_gpu_info = gpu_info.split("Graphics/Displays:", 1)[-1].split("Displays:", 1)[0].strip()
-            logging.info(f"Active GPU: {active_gpu_info}")
-        except Exception as e:
-            logging.error(f"Error getting GPU information: {str(e)}")
-    elif platform.system() == "Windows":
-        try:
-            import wmi
-            w = wmi.WMI()
-            gpu_info = w.Win32_VideoController()[0]
-            logging.info(f"Active GPU: {gpu_info.Caption}")
-        except Exception as e:
-            logging.error(f"Error getting GPU information: {str(e)}")
+    gpu_info = get_hardware_inventory().get('gpu')
+    if gpu_info:
+        logging.info(f"Active GPU: {gpu_info}")
     else:
         logging.info("GPU information not available on this OS")
 
+# Function to identify the current boot, so a persisted inventory is dropped after a reboot
+def get_boot_id():
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as file:
+            return file.read().strip()
+    except OSError:
+        return str(int(psutil.boot_time()))
+
+# Function to collect static hardware facts that do not change while the system is running
+def collect_hardware_inventory():
+    inventory = {
+        'system': platform.system(),
+        'release': platform.release(),
+        'architecture': platform.architecture()[0],
+        'processor': platform.processor(),
+        'cpu_count_logical': psutil.cpu_count(logical=True),
+        'cpu_count_physical': psutil.cpu_count(logical=False),
+        'total_ram': psutil.virtual_memory().total,
+        'gpu': None,
+    }
+    try:
+        inventory['gpu'] = read_gpu_info()
+    except Exception as e:
+        logging.error(f"Error getting GPU information: {str(e)}")
+    return inventory
+
+# Function to load a persisted inventory if it is from this boot and younger than ttl seconds
+def load_hardware_inventory(path=HARDWARE_INVENTORY_FILE, ttl=HARDWARE_INVENTORY_TTL):
+    try:
+        with open(path) as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if cached.get('boot_id') != get_boot_id() or time.time() - cached.get('collected_at', 0) > ttl:
+        return None
+    return cached.get('inventory')
+
+hardware_inventory = None  # Static hardware facts, collected once per run by get_hardware_inventory
+
+# Function to get the cached hardware inventory, collecting (and persisting) it only when needed
+def get_hardware_inventory(refresh=False, persist=True, path=HARDWARE_INVENTORY_FILE):
+    global hardware_inventory
+    if hardware_inventory is not None and not refresh:
+        return hardware_inventory
+    inventory = None if refresh or not persist else load_hardware_inventory(path)
+    if inventory is None:
+        inventory = collect_hardware_inventory()
+        if persist:
+            try:
+                with open(path, 'w') as file:
+                    json.dump({'boot_id': get_boot_id(), 'collected_at': time.time(), 'inventory': inventory}, file)
+            except OSError as e:
+                logging.warning(f"Could not save hardware inventory: {str(e)}")
+    hardware_inventory = inventory
+    return inventory
+
 # Function to display hardware information
+# Static facts come from the inventory cache, only live counters are sampled on each refresh
 def display_hardware_info():
+    inventory = get_hardware_inventory()
     hardware_info = []
     hardware_info.append("=== Hardware Information ===")
-    hardware_info.append(f"System: {platform.system()} {platform.release()} ({platform.architecture()[0]})")
-    hardware_info.append(f"CPU: {platform.processor()}")
+    hardware_info.append(f"System: {inventory['system']} {inventory['release']} ({inventory['architecture']})")
+    hardware_info.append(f"CPU: {inventory['processor']}")
 
     # CPU, Memory, and GPU information
     check_cpu_usage()
@@ -416,159 +1935,2624 @@ def display_hardware_info():
 
     return '\n'.join(hardware_info)
 
-# Function to list available drives
-def list_available_drives():
-    available_drives = []
-    for partition in psutil.disk_partitions():
-        # Check if the 'is_physical' attribute exists and is True
-        if hasattr(partition, 'device') and hasattr(partition, 'fstype'):
-            # Some versions of psutil might not have 'is_physical'
-            is_physical = getattr(partition, 'is_physical', True)
-            if is_physical:
-                available_drives.append(partition.device)
-    return available_drives
-
 # Function to display available drives
+# Returns [(mountpoint, storage entry)] for drives that answered, so selections can be scanned directly
 def display_available_drives():
-    available_drives_info = []
-
-    for drive in psutil.disk_partitions(all=True):
-        drive_info = psutil.disk_usage(drive.mountpoint)
-        available_drives_info.append((drive.device, drive_info))
+    available_drives_info = [(entry['mountpoint'], entry) for entry in get_storage_inventory() if entry['status'] == 'ok']
 
     if available_drives_info:
         print("Available drives:")
-        for idx, (drive, drive_info) in enumerate(available_drives_info, start=1):
-            print(f"{idx}. {drive} - Size: {drive_info.total / (1024 ** 3):.2f} GB")
+        for idx, (mountpoint, drive_info) in enumerate(available_drives_info, start=1):
+            print(f"{idx}. {drive_info['device']} ({mountpoint}) - Size: {drive_info['total'] / (1024 ** 3):.2f} GB")
         return available_drives_info
     else:
         print("No drives found on the system.")
         return []
 
 # Function to read a large file synchronously
-def read_large_file(file_path, buffer_size=1024 * 1024):
+# With a matcher every chunk is searched for signatures, returns {signature: first offset}
+def read_large_file(file_path, buffer_size=1024 * 1024, matcher=None):
+    matches = {}
     try:
         with open(file_path, 'rb') as file:
+            tail = b''
+            offset = 0
             while True:
                 data = file.read(buffer_size)
                 if not data:
                     break
-                # Process data here
+                if matcher is not None:
+                    tail = matcher.scan_chunk(data, tail, offset, matches)
+                offset += len(data)
     except Exception as e:
         logging.error(f"Error reading file: {file_path}")
         logging.error(f"Error: {str(e)}")
+    return matches
 
 # Function to read a large file asynchronously
-async def read_file_async(file_path):
+# With a matcher every chunk is searched for signatures, returns {signature: first offset}
+async def read_file_async(file_path, buffer_size=1024 * 1024, matcher=None):
+    import aiofiles
+    matches = {}
     try:
         async with aiofiles.open(file_path, mode='rb') as file:
-            buffer_size = 1024 * 1024  # 1 MB buffer size
+            tail = b''
+            offset = 0
             while True:
                 data = await file.read(buffer_size)
                 if not data:
                     break
-                # Process data here
+                if matcher is not None:
+                    tail = matcher.scan_chunk(data, tail, offset, matches)
+                offset += len(data)
     except Exception as e:
         logging.error(f"Error reading file asynchronously: {file_path}")
         logging.error(f"Error: {str(e)}")
+    return matches
 
-# Function to memory-map a file
-def memory_map_file(file_path):
+# Function to memory-map a file and match signatures in place, without copying the mapping
+def memory_map_file(file_path, matcher=None):
+    matcher = matcher or corruption_matcher
     try:
         with open(file_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return {}  # Empty files cannot be mapped
             with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mmapped_file:
-                # Access mmapped_file as if it were an array in memory
-                data = mmapped_file[:]
-                # Process data here
+                if hasattr(mmapped_file, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mmapped_file.madvise(mmap.MADV_SEQUENTIAL)
+                matches, _ = matcher.scan_mmap(mmapped_file)
+                return matches
     except Exception as e:
         logging.error(f"Error memory mapping file: {file_path}")
         logging.error(f"Error: {str(e)}")
+        return {}
 
-# Function to scan selected drives with specified file extensions
-async def scan_selected_drives_wrapper(drives, extensions):
-    await scan_selected_drives(drives, extensions)
+# Function to check an archive's headers: central directory for .zip, header block for .7z, signature for .rar
+# Returns a problem description or None, nothing is extracted
+def verify_archive_headers(file_path):
+    lower_path = file_path.lower()
+    try:
+        if lower_path.endswith('.zip'):
+            archive_size = os.path.getsize(file_path)
+            with zipfile.ZipFile(file_path) as archive, open(file_path, 'rb') as raw:
+                for info in archive.infolist():
+                    if info.header_offset + 30 + info.compress_size > archive_size:
+                        return f"Corrupt archive: {file_path} (Member {info.filename} extends past the end of the file)"
+                    raw.seek(info.header_offset)
+                    if raw.read(4) != b'PK\x03\x04':
+                        return f"Corrupt archive: {file_path} (Bad local header for member {info.filename})"
+        elif lower_path.endswith('.7z'):
+            from py7zr import SevenZipFile
+            with SevenZipFile(file_path, mode='r') as archive:
+                archive.getnames()
+        elif lower_path.endswith('.rar'):
+            with open(file_path, 'rb') as raw:
+                if not raw.read(8).startswith(RAR_SIGNATURES):
+                    return f"Corrupt archive: {file_path} (Missing RAR signature)"
+    except FileNotFoundError:
+        return f"File not found: {file_path}"
+    except Exception as e:
+        return f"Corrupt archive: {file_path} (Error: {str(e)})"
+    return None
+
+# Function to stream every member of an archive through its CRC check without writing to disk
+def verify_archive_crc(file_path):
+    lower_path = file_path.lower()
+    try:
+        if lower_path.endswith('.zip'):
+            with zipfile.ZipFile(file_path) as archive:
+                if any(info.flag_bits & 0x1 for info in archive.infolist()):
+                    logging.info(f"Skipping CRC check of encrypted archive: {file_path}")
+                    return None
+                bad_member = archive.testzip()
+                if bad_member is not None:
+                    return f"Corrupt archive: {file_path} (CRC mismatch in member {bad_member})"
+        elif lower_path.endswith('.7z'):
+            from py7zr import SevenZipFile
+            with SevenZipFile(file_path, mode='r') as archive:
+                if archive.needs_password():
+                    logging.info(f"Skipping CRC check of encrypted archive: {file_path}")
+                    return None
+                if archive.test() is False:
+                    return f"Corrupt archive: {file_path} (Packed stream CRC mismatch)"
+            with SevenZipFile(file_path, mode='r') as archive:
+                bad_member = archive.testzip()
+                if bad_member is not None:
+                    return f"Corrupt archive: {file_path} (CRC mismatch in member {bad_member})"
+        elif lower_path.endswith('.rar'):
+            import patoolib
+            try:
+                patoolib.find_archive_program('rar', 'test')
+            except patoolib.util.PatoolError:
+                logging.info(f"No RAR tester installed, skipping CRC check of: {file_path}")
+                return None
+            patoolib.test_archive(file_path, verbosity=-1, interactive=False)
+    except FileNotFoundError:
+        return f"File not found: {file_path}"
+    except Exception as e:
+        return f"Corrupt archive: {file_path} (Error: {str(e)})"
+    return None
 
+# Function to run the cheap header pass and then the full CRC pass over one archive
+def check_archive_file(file_path):
+    if not file_path.lower().endswith(ARCHIVE_EXTENSIONS):
+        return check_scan_file(file_path)
+    return verify_archive_headers(file_path) or verify_archive_crc(file_path)
 
-# Function to scan a single file
-async def scan_file(file_path, problem_files, scanned_files, file_extensions_to_scan):
+# Function to verify many archives in parallel across a process pool
+# Returns {path: problem or None}
+def verify_archives(file_paths, full_crc=True, workers=None):
+    check = check_archive_file if full_crc else verify_archive_headers
+    with ProcessPoolExecutor(workers) as pool:
+        return dict(zip(file_paths, pool.map(check, file_paths, chunksize=4)))
+
+# Function to read one file for the scan engine, returns a problem description or None
+# Archives only get the cheap header pass here, check_archive_file adds the CRC pass
+def check_scan_file(file_path):
+    if file_path.lower().endswith(ARCHIVE_EXTENSIONS):
+        return verify_archive_headers(file_path)
     try:
-        # Check file extension and skip if not in the list of allowed extensions
-        if file_path.lower().endswith(tuple(file_extensions_to_scan)):
-            read_large_file(file_path)  # Use the appropriate file reading function
-        scanned_files.append(file_path)  # Add the scanned file to the list
+        start = time.perf_counter()
+        with open(file_path, 'rb', buffering=0) as file:
+            matches, total = corruption_matcher.scan_stream(file)
+        elapsed = time.perf_counter() - start
+        logging.debug("Scanned %s: %d bytes in %.3fs (%.1f MB/s)", file_path, total, elapsed, total / elapsed / 10**6 if elapsed > 0 else 0.0)
     except IsADirectoryError:
-        problem_files.append(f"Skipped directory: {file_path} (Not a file)")
+        return f"Skipped directory: {file_path} (Not a file)"
     except FileNotFoundError:
-        problem_files.append(f"File not found: {file_path}")
+        return f"File not found: {file_path}"
     except Exception as e:
-        problem_files.append(f"Problem detected in file: {file_path} (Error: {str(e)}")
-        logging.error(f"Problem detected in file: {file_path}")
-        logging.error(f"Error: {str(e)}")
-        # Handle any additional exceptions here
+        return f"Problem detected in file: {file_path} (Error: {str(e)})"
+    if matches:
+        return f"Corruption detected in file: {file_path} (Signatures: {', '.join(repr(signature) for signature in matches)})"
+    return None
 
-# Function to prepare and scan a single drive
-async def prepare_and_scan_drive(drive, file_extensions_to_scan):
+# Function to list one directory with os.scandir
+# Returns (subdirectories, files, problems, file count, byte count, unlisted) where each file is
+# (path, device, inode, size, mtime_ns, links) and unlisted holds the directory (when listing it failed)
+# and file paths that could not be looked at; with count_bytes every regular file is stat'ed for the totals
+def list_directory(path, extensions=None, count_bytes=False):
+    subdirs = []
+    files = []
+    problems = []
+    unlisted = []
+    file_count = 0
+    byte_count = 0
+    to_stat = []  # (entry, wanted), stat'ed after the listing so the two phases can be timed apart
+    started = time.perf_counter()
     try:
-        problem_files = []  # Define the problem_files list
-        scanned_files = []  # Define the scanned_files list
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        file_count += 1
+                        wanted = not extensions or entry.name.lower().endswith(extensions)
+                        if wanted or count_bytes:  # Files with non-allowed extensions are only counted
+                            to_stat.append((entry, wanted))
+                except OSError as e:
+                    problems.append(f"Problem detected in file: {entry.path} (Error: {str(e)})")
+                    unlisted.append(entry.path)
+    except OSError as e:
+        problems.append(f"Problem listing directory: {path} (Error: {str(e)})")
+        unlisted.append(path)
+    listed = time.perf_counter()
+    for entry, wanted in to_stat:
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError as e:
+            problems.append(f"Problem detected in file: {entry.path} (Error: {str(e)})")
+            unlisted.append(entry.path)
+            continue
+        byte_count += st.st_size
+        if wanted:
+            files.append((entry.path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_nlink))
+    # scan.walk is the directory listing itself, scan.stat the stat calls that follow it
+    instrumentation.observe('scan.walk', listed - started)
+    instrumentation.observe('scan.stat', time.perf_counter() - listed)
+    return subdirs, files, problems, file_count, byte_count, unlisted
 
-        # Prepare the drive (e.g., list files and perform initial setup)
-        for root, dirs, files in os.walk(drive):
-            for file in files:
-                file_path = os.path.join(root, file)
-                # ... Handle file preparation tasks if needed
-                if not file_path.endswith(tuple(file_extensions_to_scan)):
-                    await scan_file(file_path, problem_files, scanned_files)
+# Function to decide how many concurrent reads one device should get
+def device_read_limit(device, default=SCAN_PER_DEVICE_READS):
+    if platform.system() == "Linux":
+        # /sys/dev/block/MAJ:MIN points at the disk or one of its partitions
+        base = os.path.realpath(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+        for queue_dir in (os.path.join(base, 'queue'), os.path.join(base, '..', 'queue')):
+            try:
+                with open(os.path.join(queue_dir, 'rotational')) as file:
+                    if file.read().strip() == '1':
+                        return min(default, SCAN_ROTATIONAL_DEVICE_READS)
+                    return default
+            except OSError:
+                continue
+    return default
 
-        logging.info(f"Prepared drive: {drive}")
+# Multi-signature matcher that streams a file through one reused buffer
+# All signatures are checked in a single pass, and the last (longest signature - 1)
+# bytes of each window are carried over so matches spanning chunk boundaries are found
+class SignatureMatcher:
+    def __init__(self, signatures=CORRUPTION_SIGNATURES, chunk_size=STREAM_CHUNK_SIZE):
+        self.signatures = tuple(sorted(set(signatures), key=len, reverse=True))
+        self.pattern = re.compile(b'|'.join(re.escape(signature) for signature in self.signatures))
+        self.overlap = max(len(signature) for signature in self.signatures) - 1
+        self.chunk_size = chunk_size
+        self.buffers = threading.local()  # One buffer per worker thread, reused across files
 
-        # Perform the scan on the prepared drive
-        await scan_selected_drives([drive], file_extensions_to_scan, problem_files, scanned_files)
+    def buffer(self):
+        buffer = getattr(self.buffers, 'buffer', None)
+        if buffer is None:
+            buffer = bytearray(self.overlap + self.chunk_size)
+            self.buffers.buffer = buffer
+        return buffer
 
-    except Exception as e:
-        logging.error(f"Error preparing and scanning drive {drive}: {str(e)}")
+    # Returns {signature: first offset} for every signature found in the file object
+    def scan_stream(self, file):
+        matches = {}
+        buffer = self.buffer()
+        view = memoryview(buffer)
+        carry = 0  # Bytes kept from the previous window
+        offset = 0  # File offset of buffer[0]
+        total = 0
+        try:
+            while True:
+                count = file.readinto(view[carry:])
+                if not count:
+                    break
+                total += count
+                end = carry + count
+                for match in self.pattern.finditer(buffer, 0, end):
+                    if match.end() > carry:  # Matches inside the carried bytes were already seen
+                        matches.setdefault(match.group(), offset + match.start())
+                keep = min(self.overlap, end)
+                view[:keep] = view[end - keep:end]
+                offset += end - keep
+                carry = keep
+        finally:
+            view.release()
+        return matches, total
 
-    # Log the scan results for all drives
-    logging.info("Scanning completed for all selected drives.")
+    # Same as scan_stream for callers that read their own chunks: adds the matches of chunk (at offset)
+    # to matches, tail is what the previous call returned; only signatures spanning the boundary look at it
+    def scan_chunk(self, chunk, tail, offset, matches):
+        if tail:
+            for match in self.pattern.finditer(tail + chunk[:self.overlap]):
+                if match.start() < len(tail) < match.end():
+                    matches.setdefault(match.group(), offset - len(tail) + match.start())
+        for match in self.pattern.finditer(chunk):
+            matches.setdefault(match.group(), offset + match.start())
+        if len(chunk) >= self.overlap:
+            return chunk[len(chunk) - self.overlap:]
+        return (tail + chunk)[-self.overlap:]  # Chunks shorter than a signature keep part of the old tail
 
-# Function to scan selected drives with specified file extensions
-async def scan_selected_drives(drives_to_scan, file_extensions_to_scan, problem_files, scanned_files):
-    for drive in drives_to_scan:
-        if os.path.isdir(drive):
-            for root, _, files in os.walk(drive):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if not any(file_path.lower().endswith(ext) for ext in file_extensions_to_scan):
-                        continue  # Skip files with non-allowed extensions
-                    await scan_file(file_path, problem_files, scanned_files, file_extensions_to_scan)
-                    global_pbar.update(1)
-
-# Function to get GPU temperature for NVIDIA GPUs on Linux
-def get_gpu_temperature_nvidia():
-    if platform.system() == "Linux" and "NVIDIA" in platform.processor():
-        try:
-            output = subprocess.check_output(['nvidia-smi', '--query-gpu=temperature.gpu', '--format=csv,noheader,nounits'])
-            temperature = float(output.decode('utf-8').strip())
-            return temperature
-        except Exception as e:
-            logging.error(f"Error getting NVIDIA GPU temperature: {str(e)}")
-            return None
-    else:
-        logging.info("GPU temperature monitoring not supported on this system.")
-        return None
+    # Same as scan_stream but over a memory map, searched in place window by window
+    def scan_mmap(self, mapped):
+        matches = {}
+        size = len(mapped)
+        for start in range(0, size, self.chunk_size):
+            end = min(size, start + self.chunk_size + self.overlap)
+            for match in self.pattern.finditer(mapped, start, end):
+                if start == 0 or match.end() > start + self.overlap:
+                    matches.setdefault(match.group(), match.start())
+        return matches, size
+
+corruption_matcher = SignatureMatcher()
+
+# Function to estimate how many bytes a scan will walk from the used space of the filesystems under the roots
+# Only whole filesystems match their used space, so any root that is not a mountpoint, or an extension
+# filter, makes the total unknown (None) until the walk has counted it
+def estimate_scan_bytes(roots, extensions=None):
+    if extensions or not all(os.path.ismount(root) for root in roots):
+        return None
+    total = 0
+    devices = set()
+    for root in roots:
+        try:
+            device = os.stat(root).st_dev
+            if device in devices:
+                continue
+            devices.add(device)
+            total += psutil.disk_usage(root).used
+        except OSError:
+            continue
+    return total
+
+# Scan progress: walked/read byte and file counters with live MB/s, files/s and ETA
+# Counters are only updated on the event loop thread, once per directory listing or finished file,
+# so the hot path takes no locks; rendering runs on its own timer instead of once per file
+class ScanProgress:
+    def __init__(self, roots, interval=SCAN_PROGRESS_INTERVAL, use_tqdm=True, extensions=None):
+        self.total_bytes = estimate_scan_bytes(roots, extensions)  # No pre-count walk, statvfs used bytes or None
+        self.interval = interval
+        self.walked_files = 0
+        self.walked_bytes = 0
+        self.read_files = 0
+        self.read_bytes = 0
+        self.cached_files = 0
+        self.problems = 0
+        self.started = time.monotonic()
+        self.last = (self.started, 0, 0, 0)  # (time, walked files, walked bytes, read bytes)
+        self.rates = (0.0, 0.0, 0.0)  # Smoothed (files/s, walked bytes/s, read bytes/s)
+        if use_tqdm:
+            from tqdm import tqdm
+        self.bar = tqdm(total=self.total_bytes or None, unit='B', unit_scale=True, unit_divisor=1024,
+                        desc="Scanning", dynamic_ncols=True) if use_tqdm else None
+
+    def add_walked(self, files, size):
+        self.walked_files += files
+        self.walked_bytes += size
+
+    # Called once every directory has been listed, the walked bytes are now the exact total
+    def walk_finished(self):
+        self.total_bytes = self.walked_bytes
+        if self.bar is not None:
+            self.bar.total = self.walked_bytes
+
+    def add_file(self, size, problem, cached=False):
+        if cached:
+            self.cached_files += 1
+        else:
+            self.read_files += 1
+            self.read_bytes += size
+        if problem:
+            self.problems += 1
+
+    def update_rates(self):
+        now = time.monotonic()
+        last_time, last_files, last_walked, last_read = self.last
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return
+        current = ((self.walked_files - last_files) / elapsed, (self.walked_bytes - last_walked) / elapsed,
+                   (self.read_bytes - last_read) / elapsed)
+        self.rates = tuple(SCAN_PROGRESS_SMOOTHING * new + (1 - SCAN_PROGRESS_SMOOTHING) * old
+                           for new, old in zip(current, self.rates))
+        self.last = (now, self.walked_files, self.walked_bytes, self.read_bytes)
+
+    # Seconds left at the average walk rate so far, None while unknown
+    def eta(self):
+        elapsed = time.monotonic() - self.started
+        if not self.walked_bytes or not self.total_bytes or elapsed <= 0:
+            return None
+        return max(0.0, self.total_bytes - self.walked_bytes) / (self.walked_bytes / elapsed)
+
+    def snapshot(self):
+        return {
+            'elapsed': time.monotonic() - self.started,
+            'total_bytes': self.total_bytes,
+            'walked_files': self.walked_files,
+            'walked_bytes': self.walked_bytes,
+            'read_files': self.read_files,
+            'read_bytes': self.read_bytes,
+            'cached_files': self.cached_files,
+            'problems': self.problems,
+            'files_per_second': self.rates[0],
+            'walk_bytes_per_second': self.rates[1],
+            'read_bytes_per_second': self.rates[2],
+            'eta_seconds': self.eta(),
+        }
+
+    def render(self):
+        self.update_rates()
+        eta = self.eta()
+        status = (f"{self.rates[0]:.0f} files/s, read {self.rates[2] / 10**6:.1f} MB/s, "
+                  f"{self.read_files + self.cached_files} checked, {self.problems} problems, "
+                  f"ETA {'?' if eta is None else time.strftime('%H:%M:%S', time.gmtime(eta))}")
+        if self.bar is not None:
+            if self.bar.total is not None and self.walked_bytes > self.bar.total:
+                self.bar.total = self.walked_bytes  # The used-space estimate was low
+            self.bar.n = self.walked_bytes
+            self.bar.set_postfix_str(status, refresh=False)
+            self.bar.refresh()
+        else:
+            total = '?' if self.total_bytes is None else f"~{self.total_bytes / 10**9:.2f}"
+            logging.info(f"Scan progress: {self.walked_bytes / 10**9:.2f} of {total} GB walked, {status}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.render()
+
+    def close(self):
+        self.render()
+        if self.bar is not None:
+            self.bar.close()
+            self.bar = None
+
+# Function to key a directory the way os.path.dirname keys the files scandir returns inside it
+def directory_key(path):
+    return os.path.dirname(os.path.join(path, '_'))
+
+# Streaming scan results: findings are appended to a JSON lines spool as they are produced and only
+# counters stay in memory, so memory is flat whatever the number of files. Each fully checked directory
+# is recorded too, which is the checkpoint an interrupted scan resumes from.
+# Records: {"type": "scan", roots, extensions, started}, {"type": "problem", path, problem},
+# {"type": "directory", path, files, bytes} and a final {"type": "finished", counters}
+class ScanResultSink:
+    def __init__(self, path=SCAN_RESULTS_FILE):
+        self.path = path
+        self.file = None
+        self.roots = []
+        self.completed = None  # SQLite connection to the directories checked before an interruption, skipped on resume
+        self.scanned = 0
+        self.bytes = 0
+        self.problems = 0
+        self.resumed_directories = 0
+        self.last_flush = time.monotonic()
+
+    # Returns the header record of an interrupted scan in the spool, or None when there is nothing to resume
+    @staticmethod
+    def interrupted(path=SCAN_RESULTS_FILE):
+        try:
+            with open(path) as file:
+                header = json.loads(file.readline())
+                finished = False
+                for line in file:
+                    if line.startswith('{"type": "finished"'):
+                        finished = True
+        except (OSError, ValueError):
+            return None
+        return None if finished or header.get('type') != 'scan' else header
+
+    def start(self, roots, extensions=None, resume=False):
+        if resume and self.resume():
+            return self
+        self.roots = list(roots)
+        self.file = open(self.path, 'w')
+        self.write({'type': 'scan', 'roots': self.roots, 'extensions': list(extensions) if extensions else None,
+                    'started': time.time()})
+        return self
+
+    # Reload the checkpoint: keep the records of completed directories and drop the rest, they get rescanned
+    # Completed directories go to an on-disk table rather than a set, so resuming does not grow with the tree
+    def resume(self):
+        header = self.interrupted(self.path)
+        if header is None:
+            return False
+        self.completed = sqlite3.connect(self.path + SCAN_CHECKPOINT_SUFFIX)
+        self.completed.execute("DROP TABLE IF EXISTS completed")
+        self.completed.execute("CREATE TABLE completed (path TEXT PRIMARY KEY) WITHOUT ROWID")
+        with open(self.path) as file:
+            # A torn last line is dropped
+            self.completed.executemany("INSERT OR IGNORE INTO completed VALUES (?)",
+                                       ((json.loads(line)['path'],) for line in file
+                                        if line.startswith('{"type": "directory"') and line.endswith('\n')))
+        self.completed.commit()
+        with open(self.path) as source, open(self.path + '.tmp', 'w') as target:
+            for line in source:
+                if not line.endswith('\n'):
+                    continue
+                record = json.loads(line)
+                if record['type'] == 'directory':
+                    self.scanned += record['files']
+                    self.bytes += record['bytes']
+                elif record['type'] == 'problem':
+                    if not self.skip_directory(os.path.dirname(record['path'])) and not self.skip_directory(directory_key(record['path'])):
+                        continue
+                    self.problems += 1
+                target.write(line)
+        os.replace(self.path + '.tmp', self.path)
+        self.roots = header['roots']
+        self.resumed_directories = self.completed.execute("SELECT COUNT(*) FROM completed").fetchone()[0]
+        self.file = open(self.path, 'a')
+        logging.info(f"Resuming scan of {', '.join(self.roots)}: {self.resumed_directories} directories and {self.scanned} files already checked.")
+        return True
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        now = time.monotonic()
+        if now - self.last_flush >= SCAN_RESULTS_FLUSH_SECONDS:
+            self.file.flush()
+            self.last_flush = now
+
+    # ScanEngine on_result callback: count every checked file, spool only the problems
+    def add(self, file_entry, problem):
+        if file_entry[1] is not None:
+            self.scanned += 1
+            self.bytes += file_entry[3]
+        if problem:
+            self.problems += 1
+            self.write({'type': 'problem', 'path': file_entry[0], 'problem': problem})
+
+    # ScanEngine on_directory_done callback: every file of the directory has been checked
+    def directory_done(self, path, files, size):
+        self.write({'type': 'directory', 'path': path, 'files': files, 'bytes': size})
+
+    def skip_directory(self, path):
+        if self.completed is None:
+            return False
+        return self.completed.execute("SELECT 1 FROM completed WHERE path = ?", (path,)).fetchone() is not None
+
+    # Iterate over the spooled problem descriptions without loading them all
+    def iter_problems(self):
+        if self.file is not None:
+            self.file.flush()
+        with open(self.path) as file:
+            for line in file:
+                if line.startswith('{"type": "problem"'):
+                    yield json.loads(line)['problem']
+
+    def counters(self):
+        return {'scanned': self.scanned, 'bytes': self.bytes, 'problems': self.problems}
+
+    def finish(self):
+        if self.file is not None:
+            self.write({'type': 'finished', **self.counters(), 'finished': time.time()})
+            self.close()
+
+    # Close without finishing, so the spool stays resumable (the checkpoint table is rebuilt from it)
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.completed is not None:
+            self.completed.close()
+            self.completed = None
+            os.remove(self.path + SCAN_CHECKPOINT_SUFFIX)
+
+# Persistent scan index keyed by device+inode so repeat scans only read new or changed files
+class ScanIndex:
+    def __init__(self, path=SCAN_INDEX_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "dev INTEGER, ino INTEGER, path TEXT, size INTEGER, mtime_ns INTEGER, "
+            "checker TEXT, verdict TEXT, scan_id INTEGER, PRIMARY KEY (dev, ino)) WITHOUT ROWID")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS scans ("
+            "scan_id INTEGER PRIMARY KEY AUTOINCREMENT, roots TEXT, started REAL, finished REAL)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER, ino INTEGER, path TEXT, size INTEGER, mtime_ns INTEGER, "
+            "sample TEXT, full TEXT, PRIMARY KEY (dev, ino)) WITHOUT ROWID")
+        self.connection.commit()
+        self.scan_id = None
+        self.pending_seen = []
+        self.pending_results = []
+        self.replaced = []  # Paths whose inode was reused by a different file
+
+    def start_scan(self, roots):
+        cursor = self.connection.execute("INSERT INTO scans (roots, started) VALUES (?, ?)", ('\n'.join(roots), time.time()))
+        self.connection.commit()
+        self.scan_id = cursor.lastrowid
+        return self.scan_id
+
+    # Split a directory's files into changed ones (returned) and unchanged ones (passed to on_cached)
+    def filter_unchanged(self, files, checker, on_cached):
+        changed = []
+        rows = {}
+        for start in range(0, len(files), 500):  # Stay under SQLite's bound-parameter limit
+            batch = files[start:start + 500]
+            placeholders = ','.join('(?, ?)' for _ in batch)
+            params = [value for file_entry in batch for value in (file_entry[1], file_entry[2])]
+            for row in self.connection.execute(
+                    f"SELECT dev, ino, size, mtime_ns, checker, verdict, path FROM files WHERE (dev, ino) IN (VALUES {placeholders})", params):
+                rows[(row[0], row[1])] = row
+        for file_entry in files:
+            row = rows.get((file_entry[1], file_entry[2]))
+            if row and row[2] == file_entry[3] and row[3] == file_entry[4] and row[4] == checker:
+                self.pending_seen.append((file_entry[0], self.scan_id, file_entry[1], file_entry[2]))
+                on_cached(file_entry, row[5] or None)
+            else:
+                if row and row[6] != file_entry[0] and (row[2] != file_entry[3] or row[3] != file_entry[4]):
+                    self.replaced.append(row[6])
+                changed.append(file_entry)
+        if len(self.pending_seen) >= 5000:
+            self.flush()
+        return changed
+
+    # Mark files as seen by this scan without checking them (directories already finished before a resume)
+    def mark_seen(self, files):
+        self.pending_seen.extend((file_entry[0], self.scan_id, file_entry[1], file_entry[2]) for file_entry in files)
+        if len(self.pending_seen) >= 5000:
+            self.flush()
+
+    def record(self, file_entry, checker, verdict):
+        path, dev, ino, size, mtime_ns = file_entry[:5]
+        self.pending_results.append((dev, ino, path, size, mtime_ns, checker, verdict or '', self.scan_id))
+        if len(self.pending_results) >= 1000:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            if self.pending_results:
+                self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.pending_results)
+            if self.pending_seen:
+                self.connection.executemany("UPDATE files SET path = ?, scan_id = ? WHERE dev = ? AND ino = ?", self.pending_seen)
+        self.pending_results = []
+        self.pending_seen = []
+
+    # Remove and return files under the scanned roots that this scan would have listed (matching
+    # extensions) but never saw; paths in unlisted (and everything below them) could not be looked at
+    # this time, so they are kept rather than reported as deleted
+    def finish_scan(self, roots, extensions=None, unlisted=()):
+        self.flush()
+        deleted = self.replaced
+        self.replaced = []
+        unlisted_paths = set(unlisted)
+        unlisted_prefixes = tuple(path.rstrip(os.sep) + os.sep for path in unlisted)
+        with self.connection:
+            for root in roots:
+                prefix = root.rstrip(os.sep) + os.sep
+                rows = self.connection.execute(
+                    "SELECT dev, ino, path FROM files WHERE scan_id < ? AND substr(path, 1, ?) = ?",
+                    (self.scan_id, len(prefix), prefix)).fetchall()
+                if extensions:
+                    rows = [row for row in rows if row[2].lower().endswith(extensions)]
+                if unlisted:
+                    rows = [row for row in rows if not row[2].startswith(unlisted_prefixes) and row[2] not in unlisted_paths]
+                self.connection.executemany("DELETE FROM files WHERE dev = ? AND ino = ?", [row[:2] for row in rows])
+                deleted.extend(row[2] for row in rows)
+            self.connection.execute("UPDATE scans SET finished = ? WHERE scan_id = ?", (time.time(), self.scan_id))
+        return deleted
+
+    # Return cached (sample, full) hashes for file entries whose size and mtime still match
+    def lookup_hashes(self, files):
+        hashes = {}
+        for start in range(0, len(files), 500):
+            batch = files[start:start + 500]
+            placeholders = ','.join('(?, ?)' for _ in batch)
+            params = [value for file_entry in batch for value in (file_entry[1], file_entry[2])]
+            for row in self.connection.execute(
+                    f"SELECT dev, ino, size, mtime_ns, sample, full FROM hashes WHERE (dev, ino) IN (VALUES {placeholders})", params):
+                hashes[(row[0], row[1])] = row
+        valid = {}
+        for file_entry in files:
+            row = hashes.get((file_entry[1], file_entry[2]))
+            if row and row[2] == file_entry[3] and row[3] == file_entry[4]:
+                valid[(row[0], row[1])] = (row[4], row[5])
+        return valid
+
+    def record_hashes(self, files, samples, fulls):
+        rows = []
+        for file_entry in files:
+            path, dev, ino, size, mtime_ns = file_entry[:5]
+            sample = samples.get((dev, ino))
+            if sample:
+                rows.append((dev, ino, path, size, mtime_ns, sample, fulls.get((dev, ino))))
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    # Drop cached hashes under the roots for files the last walk did not see
+    def prune_hashes(self, roots, seen):
+        with self.connection:
+            for root in roots:
+                prefix = root.rstrip(os.sep) + os.sep
+                rows = self.connection.execute(
+                    "SELECT dev, ino FROM hashes WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)).fetchall()
+                self.connection.executemany("DELETE FROM hashes WHERE dev = ? AND ino = ?",
+                                            [row for row in rows if row not in seen])
+
+    # Reclaim space left by deleted rows once enough of the file is free pages
+    def compact(self, force=False):
+        page_count = self.connection.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if force or (page_count and freelist_count / page_count > SCAN_INDEX_COMPACT_RATIO):
+            self.connection.execute("DELETE FROM scans WHERE scan_id NOT IN (SELECT scan_id FROM scans ORDER BY scan_id DESC LIMIT 100)")
+            self.connection.commit()
+            self.connection.execute("VACUUM")
+            logging.info(f"Compacted scan index: {self.path}")
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+# Scan engine: scandir traversal feeding a bounded work queue of file reads
+class ScanEngine:
+    def __init__(self, check_file=check_scan_file, extensions=None, workers=SCAN_WORKERS,
+                 max_listings=SCAN_MAX_LISTINGS, max_reads=SCAN_MAX_READS,
+                 per_device_reads=SCAN_PER_DEVICE_READS, use_processes=False,
+                 on_result=None, on_directory=None, index=None, full_rescan=False, progress=None,
+                 skip_directory=None, on_directory_done=None):
+        self.check_file = check_file  # Runs in the pool, must be a module-level function for processes
+        self.extensions = tuple(extensions) if extensions else None
+        self.workers = workers
+        self.max_listings = max_listings
+        self.max_reads = max_reads
+        self.per_device_reads = per_device_reads
+        self.use_processes = use_processes
+        self.on_result = on_result  # Called as on_result(file_entry, result) on the event loop
+        self.on_directory = on_directory  # Called as on_directory(path, subdirs, files)
+        self.index = index  # Optional ScanIndex used to skip unchanged files
+        self.full_rescan = full_rescan  # Read every file even when the index says it is unchanged
+        self.progress = progress  # Optional ScanProgress fed with walked and checked counts
+        self.skip_directory = skip_directory  # Called with a directory key, True skips its files (subdirectories are still walked)
+        self.on_directory_done = on_directory_done  # Called as on_directory_done(key, files, bytes) once all its files are checked
+        self.pending_files = {}  # Directory key -> [files still unchecked, files, bytes]
+        self.unlisted = []  # Directories and files that could not be listed, their index rows are not stale
+        # File counters for the instrumentation, kept on the event loop thread and handed over once per run
+        self.counts = dict.fromkeys(('scan.files', 'scan.bytes', 'scan.cached_files', 'scan.cached_bytes', 'scan.problems', 'scan.errors'), 0)
+        self.checker = getattr(check_file, '__name__', '')
+        self.device_semaphores = {}
+
+    def finish_file(self, file_entry, result, cached=False):
+        if self.progress is not None:
+            self.progress.add_file(file_entry[3], result, cached)
+        counts = self.counts
+        if cached:
+            counts['scan.cached_files'] += 1
+            counts['scan.cached_bytes'] += file_entry[3]
+        else:
+            counts['scan.files'] += 1
+            counts['scan.bytes'] += file_entry[3]
+        if result:
+            counts['scan.problems'] += 1
+        if self.on_result:
+            self.on_result(file_entry, result)
+        if self.pending_files:
+            key = os.path.dirname(file_entry[0])
+            pending = self.pending_files.get(key)
+            if pending is not None:
+                pending[0] -= 1
+                if not pending[0]:
+                    del self.pending_files[key]
+                    self.on_directory_done(key, pending[1], pending[2])
+
+    def finish_cached_file(self, file_entry, result):
+        self.finish_file(file_entry, result, cached=True)
+
+    def device_semaphore(self, device):
+        semaphore = self.device_semaphores.get(device)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(device_read_limit(device, self.per_device_reads))
+            self.device_semaphores[device] = semaphore
+        return semaphore
+
+    async def run(self, roots):
+        loop = asyncio.get_running_loop()
+        list_pool = ThreadPoolExecutor(self.max_listings, thread_name_prefix='scan-list')
+        if self.check_file is None:
+            read_pool = None
+        elif self.use_processes:
+            read_pool = ProcessPoolExecutor(self.workers)
+        else:
+            read_pool = ThreadPoolExecutor(self.workers, thread_name_prefix='scan-read')
+        dir_queue = asyncio.Queue()
+        file_queue = asyncio.Queue(maxsize=SCAN_FILE_QUEUE_SIZE)
+
+        async def lister():
+            while True:
+                path = await dir_queue.get()
+                try:
+                    subdirs, files, problems, file_count, byte_count, unlisted = await loop.run_in_executor(
+                        list_pool, list_directory, path, self.extensions, self.progress is not None)
+                    self.unlisted.extend(unlisted)
+                    if self.progress is not None:
+                        self.progress.add_walked(file_count, byte_count)
+                    for subdir in subdirs:
+                        dir_queue.put_nowait(subdir)
+                    skipped = self.skip_directory is not None and self.skip_directory(directory_key(path))
+                    for problem in problems:
+                        if self.on_result and not skipped:
+                            self.on_result((path, None, None, 0, 0), problem)
+                    if self.on_directory:
+                        self.on_directory(path, subdirs, files)
+                    if skipped:
+                        if self.progress is not None:
+                            for file_entry in files:
+                                self.progress.add_file(file_entry[3], None, True)
+                        if self.index is not None:
+                            self.index.mark_seen(files)
+                        files = []
+                    elif self.on_directory_done is not None:
+                        if files and read_pool is not None:
+                            self.pending_files[directory_key(path)] = [len(files), len(files), sum(file_entry[3] for file_entry in files)]
+                        else:
+                            self.on_directory_done(directory_key(path), len(files), sum(file_entry[3] for file_entry in files))
+                    if read_pool is not None and self.index is not None and not self.full_rescan:
+                        started = time.perf_counter()
+                        files = self.index.filter_unchanged(files, self.checker, self.finish_cached_file)
+                        instrumentation.observe('scan.index', time.perf_counter() - started)
+                    if read_pool is not None:
+                        for file_entry in files:
+                            await file_queue.put(file_entry)
+                except Exception as e:
+                    self.unlisted.append(path)
+                    logging.error(f"Error scanning directory {path}: {str(e)}")
+                finally:
+                    dir_queue.task_done()
+
+        async def reader():
+            while True:
+                file_entry = await file_queue.get()
+                try:
+                    async with self.device_semaphore(file_entry[1]):
+                        started = time.perf_counter()
+                        result = await loop.run_in_executor(read_pool, self.check_file, file_entry[0])
+                        # Timed here rather than in the worker so process pool runs are counted too
+                        instrumentation.observe('scan.verify' if file_entry[0].lower().endswith(ARCHIVE_EXTENSIONS) else 'scan.read',
+                                                time.perf_counter() - started)
+                except Exception as e:
+                    self.counts['scan.errors'] += 1
+                    result = f"Problem detected in file: {file_entry[0]} (Error: {str(e)})"
+                try:
+                    if self.index is not None:
+                        self.index.record(file_entry, self.checker, result)
+                    self.finish_file(file_entry, result)
+                finally:
+                    file_queue.task_done()
+
+        for root in roots:
+            if os.path.isdir(root):
+                dir_queue.put_nowait(root)
+        tasks = [asyncio.create_task(lister()) for _ in range(self.max_listings)]
+        if read_pool is not None:
+            tasks += [asyncio.create_task(reader()) for _ in range(self.max_reads)]
+        if self.progress is not None:
+            tasks.append(asyncio.create_task(self.progress.run()))
+        completed = False
+        try:
+            await dir_queue.join()
+            if self.progress is not None:
+                self.progress.walk_finished()
+            await file_queue.join()
+            completed = True
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Pools are idle after a completed run, so waiting reaps their threads and worker processes;
+            # only an interrupted run leaves them to wind down on their own
+            list_pool.shutdown(wait=completed, cancel_futures=not completed)
+            if read_pool is not None:
+                read_pool.shutdown(wait=completed, cancel_futures=not completed)
+            if self.index is not None:
+                self.index.flush()
+            for name, value in self.counts.items():
+                if value:
+                    instrumentation.count(name, value)
+                    self.counts[name] = 0
+
+# Function to scan selected drives with specified file extensions
+# With an index only new or changed files are read; returns the indexed files that were deleted
+# full_crc streams every archive member through its CRC check on a process pool, progress is a ScanProgress
+# With a ScanResultSink results are streamed to it instead of the lists (pass None for them), and
+# directories it already completed are skipped
+async def scan_selected_drives(drives_to_scan, file_extensions_to_scan, problem_files, scanned_files,
+                               progress=None, index=None, full_rescan=False, full_crc=False, sink=None, **engine_options):
+    def on_result(file_entry, problem):
+        if problem:
+            logging.error(problem)
+        if sink is not None:
+            sink.add(file_entry, problem)
+            return
+        if problem:
+            problem_files.append(problem)
+        if file_entry[1] is not None:
+            scanned_files.append(file_entry[0])
+
+    if full_crc:
+        engine_options.setdefault('check_file', check_archive_file)
+        engine_options.setdefault('use_processes', True)
+    if index is not None:
+        index.start_scan(drives_to_scan)
+    if sink is not None:
+        engine_options.setdefault('on_directory_done', sink.directory_done)
+        engine_options.setdefault('skip_directory', sink.skip_directory)
+    engine = ScanEngine(extensions=file_extensions_to_scan, on_result=on_result, index=index,
+                        full_rescan=full_rescan, progress=progress, **engine_options)
+    await engine.run(drives_to_scan)
+    if index is None:
+        return []
+    deleted_files = index.finish_scan([drive for drive in drives_to_scan if os.path.isdir(drive)], file_extensions_to_scan,
+                                      engine.unlisted)
+    index.compact()
+    return deleted_files
+
+# Function to hash the head and tail of a file (the whole file when it fits in the sample)
+def hash_file_sample(path, size, sample_bytes=DUPLICATE_SAMPLE_BYTES):
+    digest = hashlib.blake2b(digest_size=DUPLICATE_DIGEST_SIZE)
+    with open(path, 'rb') as file:
+        if size <= 2 * sample_bytes:
+            digest.update(file.read())
+        else:
+            digest.update(file.read(sample_bytes))
+            file.seek(size - sample_bytes)
+            digest.update(file.read(sample_bytes))
+    return digest.hexdigest()
+
+# Function to hash a whole file in fixed-size chunks with a reused buffer
+def hash_file(path, chunk_size=STREAM_CHUNK_SIZE):
+    digest = hashlib.blake2b(digest_size=DUPLICATE_DIGEST_SIZE)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as file:
+        while True:
+            count = file.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+# Function to hash file entries on the pool, returns {(dev, ino): digest} for the readable ones
+def hash_entries(pool, hasher, entries):
+    def run(file_entry):
+        try:
+            return file_entry, hasher(file_entry)
+        except OSError as e:
+            logging.error(f"Error hashing file {file_entry[0]}: {str(e)}")
+            return file_entry, None
+    return {(file_entry[1], file_entry[2]): digest for file_entry, digest in pool.map(run, entries) if digest}
+
+# Function to keep only the groups with more than one member
+def duplicate_candidates(groups):
+    return [members for members in groups.values() if len(members) > 1]
+
+# Function to find duplicate files under the roots
+# Files are grouped by size, then by a head/tail sample hash, and only the remaining candidates are
+# hashed in full; hashes are cached in the scan index keyed by (dev, ino) and reused while size and mtime match
+# Returns [(size, [paths])] sorted by the space the extra copies take
+def find_duplicates(roots, index=None, min_size=DUPLICATE_MIN_SIZE, workers=SCAN_WORKERS, progress=None):
+    by_size = {}
+    seen = set()
+
+    def on_directory(path, subdirs, files):
+        for file_entry in files:
+            key = (file_entry[1], file_entry[2])
+            if file_entry[3] >= min_size and key not in seen:  # Hard links are one file, not duplicates
+                seen.add(key)
+                by_size.setdefault(file_entry[3], []).append(file_entry)
+
+    engine = ScanEngine(check_file=None, on_directory=on_directory, progress=progress)
+    asyncio.run(engine.run(roots))
+    candidates = [file_entry for members in duplicate_candidates(by_size) for file_entry in members]
+    logging.info(f"Walked {len(seen)} files, {len(candidates)} share a size with another file.")
+
+    cached = index.lookup_hashes(candidates) if index is not None else {}
+    with ThreadPoolExecutor(workers, thread_name_prefix='dup-hash') as pool:
+        samples = {key: hashes[0] for key, hashes in cached.items() if hashes[0]}
+        samples.update(hash_entries(pool, lambda file_entry: hash_file_sample(file_entry[0], file_entry[3]),
+                                    [file_entry for file_entry in candidates if (file_entry[1], file_entry[2]) not in samples]))
+        by_sample = {}
+        for file_entry in candidates:
+            sample = samples.get((file_entry[1], file_entry[2]))
+            if sample:
+                by_sample.setdefault((file_entry[3], sample), []).append(file_entry)
+
+        fulls = {}
+        to_hash = []
+        for (size, sample), members in by_sample.items():
+            if len(members) < 2:
+                continue
+            for file_entry in members:
+                key = (file_entry[1], file_entry[2])
+                if size <= 2 * DUPLICATE_SAMPLE_BYTES:
+                    fulls[key] = sample  # The sample already covered the whole file
+                elif key in cached and cached[key][1]:
+                    fulls[key] = cached[key][1]
+                else:
+                    to_hash.append(file_entry)
+        logging.info(f"{len(to_hash)} candidates need a full hash ({sum(file_entry[3] for file_entry in to_hash) / 10**6:.1f} MB).")
+        fulls.update(hash_entries(pool, lambda file_entry: hash_file(file_entry[0]), to_hash))
+
+    if index is not None:
+        index.record_hashes(candidates, samples, fulls)
+        index.prune_hashes([root for root in roots if os.path.isdir(root)], seen)
+
+    by_content = {}
+    for file_entry in candidates:
+        digest = fulls.get((file_entry[1], file_entry[2]))
+        if digest:
+            by_content.setdefault((file_entry[3], digest), []).append(file_entry[0])
+    duplicates = [(size, sorted(paths)) for (size, digest), paths in by_content.items() if len(paths) > 1]
+    duplicates.sort(key=lambda group: group[0] * (len(group[1]) - 1), reverse=True)
+    return duplicates
+
+# Function to get GPU temperature for NVIDIA GPUs on Linux with nvidia-smi
+# The temperature collector reads NVML in-process instead, this is kept for one-off checks
+def get_gpu_temperature_nvidia():
+    if platform.system() == "Linux" and shutil.which('nvidia-smi'):
+        try:
+            output = subprocess.check_output(['nvidia-smi', '--query-gpu=temperature.gpu', '--format=csv,noheader,nounits'])
+            temperature = float(output.decode('utf-8').strip().splitlines()[0])
+            return temperature
+        except Exception as e:
+            logging.error(f"Error getting NVIDIA GPU temperature: {str(e)}")
+            return None
+    else:
+        logging.info("GPU temperature monitoring not supported on this system.")
+        return None
+
+# Function to sample CPU usage without blocking (percentages are deltas since the previous sample)
+def sample_cpu():
+    return {'cpu_percent': psutil.cpu_percent(interval=None)}
+
+# Function to sample memory usage
+def sample_memory():
+    virtual_memory = psutil.virtual_memory()
+    swap_memory = psutil.swap_memory()
+    return {'memory_percent': virtual_memory.percent, 'memory_available': virtual_memory.available,
+            'swap_percent': swap_memory.percent}
+
+# Function to sample disk counters and system drive usage
+def sample_disk():
+    usage = psutil.disk_usage(os.environ.get('SystemDrive', 'C:') + '\\' if platform.system() == "Windows" else '/')
+    sample = {'disk_percent': usage.percent, 'disk_free': usage.free}
+    counters = psutil.disk_io_counters()
+    if counters is not None:
+        sample.update(disk_read_bytes=counters.read_bytes, disk_write_bytes=counters.write_bytes,
+                      disk_read_count=counters.read_count, disk_write_count=counters.write_count)
+    return sample
+
+# Function to sample network counters
+def sample_network():
+    counters = psutil.net_io_counters()
+    return {'net_bytes_sent': counters.bytes_sent, 'net_bytes_recv': counters.bytes_recv,
+            'net_packets_sent': counters.packets_sent, 'net_packets_recv': counters.packets_recv,
+            'net_errin': counters.errin, 'net_errout': counters.errout}
+
+# Fixed-size ring buffer of float samples, one array('d') column per field
+class RingBuffer:
+    def __init__(self, capacity, fields):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.columns = {field: array('d', bytes(8 * capacity)) for field in self.fields}
+        self.head = 0  # Next slot to write
+        self.count = 0
+
+    def append(self, values):
+        for field in self.fields:
+            self.columns[field][self.head] = values.get(field, float('nan'))
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    # Samples of one field, oldest first
+    def values(self, field):
+        column = self.columns[field]
+        if self.count < self.capacity:
+            return column[:self.count]
+        return column[self.head:] + column[:self.head]
+
+    def latest(self, field):
+        return self.columns[field][self.head - 1] if self.count else None
+
+# Function to turn two counter snapshots into per-second rates for the given (field, counter) pairs
+# Returns None when a counter went backwards (device reset or counter wrap)
+def counter_rates(previous, current, elapsed, counters):
+    rates = {}
+    for field, counter in counters:
+        delta = getattr(current, counter) - getattr(previous, counter)
+        if delta < 0:
+            return None
+        rates[field] = delta / elapsed
+    return rates
+
+# Passive throughput monitor: per-disk and per-NIC counter deltas at each sample, kept in ring buffers
+# Nothing is generated on the wire or the disks, a sample is two reads of kernel counters
+class ThroughputMonitor:
+    disk_fields = ('read_bytes_per_s', 'write_bytes_per_s', 'read_iops', 'write_iops',
+                   'read_latency_ms', 'write_latency_ms', 'busy_percent')
+    nic_fields = ('recv_bytes_per_s', 'sent_bytes_per_s', 'recv_packets_per_s', 'sent_packets_per_s',
+                  'errors_per_s', 'drops_per_s')
+
+    def __init__(self, capacity=THROUGHPUT_WINDOW_SAMPLES, ignored=THROUGHPUT_IGNORED_DEVICES):
+        self.capacity = capacity
+        self.ignored = re.compile(ignored)
+        self.disks = {}  # Disk name -> RingBuffer
+        self.nics = {}  # NIC name -> RingBuffer
+        self.previous = None  # (time, disk counters, nic counters)
+
+    def sample(self):
+        now = time.monotonic()
+        disk_counters = psutil.disk_io_counters(perdisk=True, nowrap=True) or {}
+        nic_counters = psutil.net_io_counters(pernic=True, nowrap=True) or {}
+        previous = self.previous
+        self.previous = (now, disk_counters, nic_counters)
+        if previous is None or now <= previous[0]:
+            return False
+        elapsed = now - previous[0]
+        for name, current in disk_counters.items():
+            last = previous[1].get(name)
+            if last is None or self.ignored.match(name):
+                continue
+            rates = counter_rates(last, current, elapsed, (('read_bytes_per_s', 'read_bytes'), ('write_bytes_per_s', 'write_bytes'),
+                                                           ('read_iops', 'read_count'), ('write_iops', 'write_count')))
+            if rates is None:
+                continue
+            # Average service time per completed operation over the interval (read_time/write_time are in ms)
+            reads = current.read_count - last.read_count
+            writes = current.write_count - last.write_count
+            rates['read_latency_ms'] = (current.read_time - last.read_time) / reads if reads > 0 else float('nan')
+            rates['write_latency_ms'] = (current.write_time - last.write_time) / writes if writes > 0 else float('nan')
+            if hasattr(current, 'busy_time'):
+                rates['busy_percent'] = min(100.0, (current.busy_time - last.busy_time) / (elapsed * 1000) * 100)
+            self.buffer(self.disks, name, self.disk_fields).append(rates)
+        for name, current in nic_counters.items():
+            last = previous[2].get(name)
+            if last is None or self.ignored.match(name):
+                continue
+            rates = counter_rates(last, current, elapsed, (('recv_bytes_per_s', 'bytes_recv'), ('sent_bytes_per_s', 'bytes_sent'),
+                                                           ('recv_packets_per_s', 'packets_recv'), ('sent_packets_per_s', 'packets_sent')))
+            if rates is None:
+                continue
+            rates['errors_per_s'] = max(0, current.errin + current.errout - last.errin - last.errout) / elapsed
+            rates['drops_per_s'] = max(0, current.dropin + current.dropout - last.dropin - last.dropout) / elapsed
+            self.buffer(self.nics, name, self.nic_fields).append(rates)
+        return True
+
+    def buffer(self, buffers, name, fields):
+        ring = buffers.get(name)
+        if ring is None:
+            ring = buffers[name] = RingBuffer(self.capacity, fields)
+        return ring
+
+    # Latest rates as a flat {"<device> <field>": value} dict, the shape the daemon and exporters expect
+    def current(self):
+        sample = {}
+        for buffers in (self.disks, self.nics):
+            for name, ring in buffers.items():
+                for field in ring.fields:
+                    sample[f"{name} {field}"] = ring.latest(field)
+        return sample
+
+    # Returns {'disks': {name: {field: stats}}, 'nics': {...}} with current/avg/p50/p95/max over the window
+    def summary(self):
+        report = {}
+        for kind, buffers in (('disks', self.disks), ('nics', self.nics)):
+            report[kind] = {}
+            for name, ring in buffers.items():
+                stats = {}
+                for field in ring.fields:
+                    values = [value for value in ring.values(field) if value == value]  # Drop NaN gaps
+                    if values:
+                        stats[field] = {'current': ring.latest(field), 'avg': sum(values) / len(values),
+                                        'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95), 'max': max(values)}
+                report[kind][name] = stats
+        return report
+
+# Function to format a throughput summary, skipping idle devices
+def display_throughput(report):
+    throughput_info = ["=== Disk Throughput (avg / p95 / max) ==="]
+    for name, stats in sorted(report['disks'].items()):
+        if not any(stats.get(field, {}).get('max') for field in ('read_iops', 'write_iops')):
+            continue
+        line = (f"{name}: read {format_rate(stats['read_bytes_per_s'])}, write {format_rate(stats['write_bytes_per_s'])}, "
+                f"IOPS {stats['read_iops']['avg']:.0f}r/{stats['write_iops']['avg']:.0f}w")
+        for operation in ('read', 'write'):
+            if f'{operation}_latency_ms' in stats:
+                line += f", {operation} latency p95 {stats[f'{operation}_latency_ms']['p95']:.2f} ms"
+        if 'busy_percent' in stats:
+            line += f", busy {stats['busy_percent']['avg']:.0f}%"
+        throughput_info.append(line)
+    throughput_info.append("=== Network Throughput (avg / p95 / max) ===")
+    for name, stats in sorted(report['nics'].items()):
+        if not stats.get('recv_packets_per_s', {}).get('max') and not stats.get('sent_packets_per_s', {}).get('max'):
+            continue
+        throughput_info.append(f"{name}: in {format_rate(stats['recv_bytes_per_s'])}, out {format_rate(stats['sent_bytes_per_s'])}, "
+                               f"{stats['recv_packets_per_s']['avg']:.0f}/{stats['sent_packets_per_s']['avg']:.0f} packets/s, "
+                               f"{stats['errors_per_s']['max']:.1f} errors/s max")
+    return '\n'.join(throughput_info)
+
+# Function to format avg / p95 / max byte rates in MB/s
+def format_rate(stats):
+    return f"{stats['avg'] / 10**6:.2f} / {stats['p95'] / 10**6:.2f} / {stats['max'] / 10**6:.2f} MB/s"
+
+# Function to watch throughput for a while (Ctrl+C stops early) and report it
+def monitor_throughput(duration=THROUGHPUT_MONITOR_SECONDS, interval=THROUGHPUT_INTERVAL):
+    monitor = ThroughputMonitor()
+    monitor.sample()
+    logging.info(f"Monitoring disk and network throughput for {duration:.0f}s (Ctrl+C to stop)...")
+    deadline = time.monotonic() + duration
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            monitor.sample()
+    except KeyboardInterrupt:
+        pass
+    report = monitor.summary()
+    logging.info(display_throughput(report))
+    return report
+
+# Self-instrumentation: timing histograms and counters for collectors, probes, commands and scan stages
+# (scan.walk, scan.stat, scan.index, scan.read, scan.verify). Each thread records into its own shard, so
+# the hot path takes no lock; shards are merged when a report is built, and folded into one when their
+# thread has exited. When disabled observe() and count() return before doing anything
+class Instrumentation:
+    def __init__(self, enabled=INSTRUMENTATION_ENABLED, bounds=TIMING_HISTOGRAM_BOUNDS):
+        self.enabled = enabled
+        self.bounds = bounds
+        self.lock = threading.Lock()  # Guards the shard list only
+        self.local = threading.local()
+        self.shards = []  # (thread, timings, counters) per recording thread
+        self.retired = ({}, {})  # Merged shards of threads that have exited
+        self.started = time.time()
+        self.profiler = None
+
+    # This thread's (timings, counters); timings map name -> [count, total seconds, max seconds, buckets..., overflow]
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = ({}, {})
+            with self.lock:
+                self.shards.append((threading.current_thread(), *shard))
+            return shard
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        try:
+            timings = self.local.shard[0]
+        except AttributeError:
+            timings = self.shard()[0]
+        timing = timings.get(name)
+        if timing is None:
+            timing = timings[name] = [0, 0.0, 0.0] + [0] * (len(self.bounds) + 1)
+        timing[0] += 1
+        timing[1] += seconds
+        if seconds > timing[2]:
+            timing[2] = seconds
+        timing[3 + bisect.bisect_left(self.bounds, seconds)] += 1
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        counters = self.shard()[1]
+        counters[name] = counters.get(name, 0) + value
+
+    # Wrap a function so every call is observed under name and exceptions are counted as name.errors
+    def timed(self, name, function):
+        def timed_function(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                self.count(f"{name}.errors")
+                raise
+            finally:
+                self.observe(name, time.perf_counter() - start)
+        return timed_function
+
+    # Bucket upper bound holding the given fraction of observations (the max for the overflow bucket)
+    def quantile(self, timing, fraction):
+        rank = max(1, math.ceil(fraction * timing[0]))
+        seen = 0
+        for bound, count in zip(self.bounds, timing[3:]):
+            seen += count
+            if seen >= rank:
+                return min(bound, timing[2])
+        return timing[2]
+
+    # Add one shard's timings and counters into another
+    @staticmethod
+    def merge(target, timings, counters):
+        for name, timing in list(timings.items()):
+            merged = target[0].get(name)
+            if merged is None:
+                target[0][name] = list(timing)
+            else:
+                merged[0] += timing[0]
+                merged[1] += timing[1]
+                merged[2] = max(merged[2], timing[2])
+                for bucket in range(3, len(timing)):
+                    merged[bucket] += timing[bucket]
+        for name, value in list(counters.items()):
+            target[1][name] = target[1].get(name, 0) + value
+
+    # Returns merged (timings, counters) over every thread
+    def totals(self):
+        with self.lock:
+            live = []
+            for thread, timings, counters in self.shards:
+                if thread.is_alive():
+                    live.append((thread, timings, counters))
+                else:
+                    self.merge(self.retired, timings, counters)
+            self.shards = live
+            totals = ({}, {})
+            self.merge(totals, *self.retired)
+            for thread, timings, counters in live:
+                self.merge(totals, timings, counters)
+        return totals
+
+    def histograms(self):
+        return self.totals()[0]
+
+    def report(self, profile=True):
+        totals, counters = self.totals()
+        timings = {}
+        for name, timing in sorted(totals.items()):
+            timings[name] = {
+                'count': timing[0],
+                'total_seconds': timing[1],
+                'mean_ms': timing[1] / timing[0] * 1000,
+                'p50_ms': self.quantile(timing, 0.50) * 1000,
+                'p95_ms': self.quantile(timing, 0.95) * 1000,
+                'p99_ms': self.quantile(timing, 0.99) * 1000,
+                'max_ms': timing[2] * 1000,
+            }
+        process = psutil.Process()
+        with process.oneshot():
+            cpu_times = process.cpu_times()
+            report = {
+                'enabled': self.enabled,
+                'uptime_seconds': time.time() - self.started,
+                'process': {'cpu_seconds': cpu_times.user + cpu_times.system, 'rss_bytes': process.memory_info().rss,
+                            'threads': process.num_threads()},
+                'timings': timings,
+                'counters': dict(sorted(counters.items())),
+            }
+        if profile and self.profiler is not None:
+            report['profile'] = self.profiler.report()
+        return report
+
+    # Swaps in empty shards instead of clearing the live ones, which worker threads may be writing to:
+    # each thread registers a fresh shard on its next record and the old ones are dropped whole
+    def reset(self):
+        with self.lock:
+            self.local = threading.local()
+            self.shards = []
+            self.retired = ({}, {})
+        self.started = time.time()
+
+    def start_profiler(self, interval=PROFILER_INTERVAL):
+        if self.profiler is None or not self.profiler.running():
+            self.profiler = SamplingProfiler(interval)
+            self.profiler.start()
+            logging.info(f"Sampling profiler started ({interval * 1000:.0f} ms interval).")
+        return self.profiler
+
+    # Stops the profiler, its samples stay in the report until the next start
+    def stop_profiler(self):
+        if self.profiler is not None and self.profiler.running():
+            self.profiler.stop()
+            logging.info(f"Sampling profiler stopped after {self.profiler.samples} samples.")
+        return self.profiler
+
+    def toggle_profiler(self):
+        if self.profiler is not None and self.profiler.running():
+            return self.stop_profiler()
+        return self.start_profiler()
+
+instrumentation = Instrumentation()
+
+# Wall-clock sampling profiler: a daemon thread snapshots the other threads' stacks every interval and
+# counts the innermost function (self) and every function on the stack (inclusive), skipping threads
+# parked in PROFILER_IDLE_FRAMES. Nothing is traced,
+# so profiled code runs at full speed and the cost only depends on the interval and thread count
+class SamplingProfiler:
+    def __init__(self, interval=PROFILER_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0  # Samples of parked threads, left out of the tables
+        self.self_counts = {}  # (file, first line, function) -> samples with it innermost
+        self.inclusive_counts = {}  # (file, first line, function) -> samples with it anywhere on the stack
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.sample(frame)
+
+    def sample(self, frame):
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in PROFILER_IDLE_FRAMES:
+            self.idle += 1
+            return
+        self.samples += 1
+        seen = set()
+        innermost = True
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            if innermost:
+                self.self_counts[key] = self.self_counts.get(key, 0) + 1
+                innermost = False
+            if key not in seen:  # Recursion counts once per sample
+                seen.add(key)
+                self.inclusive_counts[key] = self.inclusive_counts.get(key, 0) + 1
+            frame = frame.f_back
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def report(self, top_n=PROFILER_TOP_N):
+        def top(counts):
+            return [{'function': f"{name} ({os.path.basename(filename)}:{line})", 'samples': samples,
+                     'percent': samples / self.samples * 100}
+                    for (filename, line, name), samples in heapq.nlargest(top_n, list(counts.items()), key=lambda item: item[1])]
+        return {'samples': self.samples, 'idle_samples': self.idle, 'interval': self.interval, 'running': self.running(),
+                'self': top(self.self_counts), 'inclusive': top(self.inclusive_counts)}
+
+# Function to format the self-metrics report
+def display_self_metrics(report):
+    metrics_info = [f"=== Self Metrics ({report['uptime_seconds']:.0f}s, {report['process']['cpu_seconds']:.1f}s CPU, "
+                    f"RSS {report['process']['rss_bytes'] / (1024 ** 2):.0f} MB, {report['process']['threads']} threads) ==="]
+    if not report['enabled']:
+        metrics_info.append("Instrumentation is disabled.")
+    for name, timing in report['timings'].items():
+        metrics_info.append(f"{name}: {timing['count']} calls, {timing['total_seconds']:.3f}s total, mean {timing['mean_ms']:.3f} ms, "
+                            f"p95 <= {timing['p95_ms']:.3f} ms, max {timing['max_ms']:.3f} ms")
+    for name, value in report['counters'].items():
+        metrics_info.append(f"{name}: {value}")
+    profile = report.get('profile')
+    if profile and profile['samples']:
+        metrics_info.append(f"=== Profile ({profile['samples']} thread samples every {profile['interval'] * 1000:.0f} ms, "
+                            f"{profile['idle_samples']} of parked threads skipped) ===")
+        for entry in profile['self']:
+            metrics_info.append(f"self {entry['percent']:5.1f}%  {entry['function']}")
+        for entry in profile['inclusive']:
+            metrics_info.append(f"incl {entry['percent']:5.1f}%  {entry['function']}")
+    return '\n'.join(metrics_info)
+
+# Function to show the self-metrics report and start or stop the sampling profiler
+def display_instrumentation():
+    logging.info(display_self_metrics(instrumentation.report()))
+    running = instrumentation.profiler is not None and instrumentation.profiler.running()
+    if input(f"{'Stop' if running else 'Start'} the sampling profiler? (y/N): ").strip().lower() == 'y':
+        instrumentation.toggle_profiler()
+
+# Collector registry: each collector name maps to one backend class per operating system ('*' matches
+# any). Backends are resolved once at startup, open long-lived handles in open(), and return a dict
+# from collect(). expensive backends spawn processes or take seconds and can be left out.
+COLLECTOR_BACKENDS = {}  # Collector name -> {system: backend class}
+collectors = {}  # Collector name -> resolved and opened backend instance
+collectors_resolved = False
+
+# Decorator to register a collector backend for one or more operating systems
+def register_collector(name, *systems):
+    def decorator(backend):
+        backend.name = name
+        for system in systems:
+            COLLECTOR_BACKENDS.setdefault(name, {})[system] = backend
+        return backend
+    return decorator
+
+class Collector(abc.ABC):
+    name = None
+    expensive = False  # Spawns processes or takes seconds per call
+    blocking = False  # May block, so samplers should run it in a worker thread
+
+    def open(self):
+        pass  # Acquire long-lived handles, raise OSError or RuntimeError if this backend cannot work here
+
+    @abc.abstractmethod
+    def collect(self):
+        pass  # Returns a dict of field -> value
+
+    def close(self):
+        pass
+
+# Function to resolve the backend for every collector once, skipping disabled and unsupported ones
+def resolve_collectors(disabled=DISABLED_COLLECTORS, include_expensive=True, system=None):
+    global collectors_resolved
+    system = system or platform.system()
+    close_collectors()
+    for name, backends in COLLECTOR_BACKENDS.items():
+        backend = backends.get(system) or backends.get('*')
+        if backend is None or name in disabled or (backend.expensive and not include_expensive):
+            continue
+        collector = backend()
+        try:
+            collector.open()
+        except Exception as e:
+            logging.info(f"Collector {name} unavailable on this system: {str(e)}")
+            continue
+        collector.collect = instrumentation.timed(f"collector.{name}", collector.collect)
+        collectors[name] = collector
+    collectors_resolved = True
+    return collectors
+
+# Function to get a resolved collector by name, None when it is unsupported or disabled
+def get_collector(name):
+    if not collectors_resolved:
+        resolve_collectors()
+    return collectors.get(name)
+
+# Function to release the handles held by resolved collectors
+def close_collectors():
+    for collector in collectors.values():
+        try:
+            collector.close()
+        except Exception:
+            pass
+    collectors.clear()
+
+wmi_connection = None  # Shared WMI connection, created on first use
+
+# Function to get the long-lived WMI connection on Windows
+def get_wmi_connection():
+    global wmi_connection
+    if wmi_connection is None:
+        import wmi
+        wmi_connection = wmi.WMI()
+    return wmi_connection
+
+# Function to locate the osx-cpu-temp binary: OSX_CPU_TEMP, the PyInstaller bundle, next to this module, or PATH
+def find_osx_cpu_temp():
+    base = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
+    for candidate in (os.environ.get('OSX_CPU_TEMP'),
+                      os.path.join(base, 'osx-cpu-temp', 'osx-cpu-temp'),
+                      os.path.join(base, 'osx-cpu-temp'),
+                      shutil.which('osx-cpu-temp')):
+        if candidate and os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+@register_collector('cpu', '*')
+class CpuCollector(Collector):
+    def open(self):
+        psutil.cpu_percent(interval=None)  # Prime the counters so the first delta is meaningful
+
+    def collect(self):
+        return sample_cpu()
+
+@register_collector('memory', '*')
+class MemoryCollector(Collector):
+    def collect(self):
+        return sample_memory()
+
+@register_collector('disk', '*')
+class DiskCollector(Collector):
+    blocking = True  # disk_usage can stall on a slow mount
+
+    def collect(self):
+        return sample_disk()
+
+@register_collector('network', '*')
+class NetworkCollector(Collector):
+    def collect(self):
+        return sample_network()
+
+@register_collector('throughput', '*')
+class ThroughputCollector(Collector):
+    def open(self):
+        self.monitor = ThroughputMonitor()
+        self.monitor.sample()  # Baseline for the first delta
+
+    def collect(self):
+        self.monitor.sample()
+        return self.monitor.current()
+
+@register_collector('temperature', 'Darwin')
+class OsxCpuTempCollector(Collector):
+    blocking = True
+
+    def open(self):
+        self.path = find_osx_cpu_temp()
+        if self.path is None:
+            raise FileNotFoundError("osx-cpu-temp binary not found (build it with make in osx-cpu-temp/)")
+
+    def collect(self):
+        temperature_output = subprocess.run([self.path], capture_output=True, text=True, check=True, timeout=10).stdout.strip()
+        # Extract the numeric temperature value (removing '°C')
+        return {'cpu_temperature': float(temperature_output.split(' ')[0].rstrip('°C'))}
+
+@register_collector('temperature', 'Windows')
+class WmiTemperatureCollector(Collector):
+    blocking = True
+
+    def open(self):
+        self.connection = get_wmi_connection()
+
+    def collect(self):
+        temperature_info = self.connection.Win32_TemperatureProbe()[0]
+        return {'cpu_temperature': float(temperature_info.CurrentReading)}
+
+# Function to turn a sensor label into a stable sample key, e.g. 'coretemp package_id_0'
+def sensor_key(chip, label):
+    return f"{chip} {re.sub(r'[^0-9a-z]+', '_', label.lower()).strip('_')}"
+
+# Function to read a small sysfs attribute, None when it is missing
+def read_sysfs_text(path):
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+@register_collector('temperature', 'Linux')
+class SysfsTemperatureCollector(Collector):
+    # Sensors are discovered once under /sys/class/hwmon and /sys/class/thermal and their files stay
+    # open, so each sample is one os.pread per sensor. NVIDIA GPUs (no hwmon with the proprietary
+    # driver) are read in-process through NVML when libnvidia-ml is present.
+    def __init__(self, root='/sys/class'):
+        self.root = root
+        self.sensors = []  # (key, file descriptor)
+        self.nvml = None
+        self.nvml_handles = []
+
+    def open(self):
+        chips = {}  # Chip name -> hwmon devices seen with it
+        for hwmon in sorted(glob.glob(os.path.join(self.root, 'hwmon', 'hwmon*')),
+                            key=lambda path: int(re.sub(r'\D', '', os.path.basename(path)) or 0)):
+            name = read_sysfs_text(os.path.join(hwmon, 'name')) or os.path.basename(hwmon)
+            # Names repeat per socket or drive (coretemp, nvme), later ones become coretemp_1, nvme_1, ...
+            chip = f"{name}_{chips[name]}" if name in chips else name
+            chips[name] = chips.get(name, 0) + 1
+            for input_path in sorted(glob.glob(os.path.join(hwmon, 'temp*_input'))):
+                label = read_sysfs_text(input_path[:-len('_input')] + '_label') or os.path.basename(input_path)[:-len('_input')]
+                self.add_sensor(sensor_key(chip, label), input_path)
+        for zone in sorted(glob.glob(os.path.join(self.root, 'thermal', 'thermal_zone*'))):
+            zone_type = read_sysfs_text(os.path.join(zone, 'type')) or os.path.basename(zone)
+            if zone_type not in chips:  # hwmon usually mirrors zones like acpitz already
+                self.add_sensor(sensor_key(zone_type, os.path.basename(zone)), os.path.join(zone, 'temp'))
+        self.open_nvml()
+        if not self.sensors and not self.nvml_handles:
+            raise FileNotFoundError("no hwmon, thermal zone or NVML temperature sensors found")
+
+    def add_sensor(self, key, path):
+        taken = {sensor[0] for sensor in self.sensors}
+        suffix = 0
+        unique = key
+        while unique in taken:  # Two labels that normalize to the same key
+            suffix += 1
+            unique = f"{key}_{suffix}"
+        key = unique
+        try:
+            self.sensors.append((key, os.open(path, os.O_RDONLY)))
+        except OSError:
+            pass  # Sensor not readable by this user
+
+    def open_nvml(self):
+        try:
+            nvml = ctypes.CDLL('libnvidia-ml.so.1')
+            if nvml.nvmlInit_v2() != 0:
+                return
+            count = ctypes.c_uint()
+            nvml.nvmlDeviceGetCount_v2(ctypes.byref(count))
+            for index in range(count.value):
+                handle = ctypes.c_void_p()
+                if nvml.nvmlDeviceGetHandleByIndex_v2(index, ctypes.byref(handle)) == 0:
+                    self.nvml_handles.append(handle)
+            self.nvml = nvml
+        except (OSError, AttributeError):
+            self.nvml = None
+
+    def collect(self):
+        readings = {}
+        for key, descriptor in self.sensors:
+            try:
+                readings[key] = int(os.pread(descriptor, 32, 0)) / 1000  # Millidegrees Celsius
+            except (OSError, ValueError):
+                continue  # Sensor reports no data right now
+        for index, handle in enumerate(self.nvml_handles):
+            temperature = ctypes.c_uint()
+            if self.nvml.nvmlDeviceGetTemperature(handle, 0, ctypes.byref(temperature)) == 0:  # 0 = NVML_TEMPERATURE_GPU
+                readings[f"nvidia gpu_{index}"] = float(temperature.value)
+        cpu_readings = [value for key, value in readings.items() if key.startswith(CPU_SENSOR_PREFIXES)]
+        gpu_readings = [value for key, value in readings.items() if key.startswith(GPU_SENSOR_PREFIXES)]
+        if cpu_readings:
+            readings['cpu_temperature'] = max(cpu_readings)
+        if gpu_readings:
+            readings['gpu_temperature'] = max(gpu_readings)
+        return readings
+
+    def close(self):
+        for _, descriptor in self.sensors:
+            os.close(descriptor)
+        self.sensors = []
+        if self.nvml is not None:
+            self.nvml.nvmlShutdown()
+            self.nvml = None
+            self.nvml_handles = []
+
+@register_collector('gpu', 'Darwin')
+class SystemProfilerGpuCollector(Collector):
+    expensive = True
+    blocking = True
+
+    def collect(self):
+        gpu_info = subprocess.run(['system_profiler', 'SPDisplaysDataType'], capture_output=True, text=True, timeout=60).stdout
+        # Extract the active GPU information
+        return {'gpu': gpu_info.split("Graphics/Displays:", 1)[-1].split("Displays:", 1)[0].strip()}
+
+@register_collector('gpu', 'Windows')
+class WmiGpuCollector(Collector):
+    blocking = True
+
+    def open(self):
+        self.connection = get_wmi_connection()
+
+    def collect(self):
+        return {'gpu': self.connection.Win32_VideoController()[0].Caption}
+
+@register_collector('battery', 'Darwin')
+class SystemProfilerBatteryCollector(Collector):
+    expensive = True
+    blocking = True
+
+    def collect(self):
+        # Run a command to check battery health on macOS
+        result = get_command_runner().run(['system_profiler', 'SPPowerDataType'], COMMAND_TIMEOUTS['battery'],
+                                          COMMAND_CACHE_TTL['battery'], check=True)
+        # Extract battery health information from the result
+        return {'health': extract_battery_health_info(result['stdout'])}
+
+@register_collector('battery', '*')
+class PsutilBatteryCollector(Collector):
+    def open(self):
+        if not hasattr(psutil, 'sensors_battery'):
+            raise RuntimeError("psutil cannot read batteries on this system")
+
+    def collect(self):
+        battery = psutil.sensors_battery()
+        if battery is None:
+            return {}
+        return {'health': f"Charge: {battery.percent:.0f}%, {'plugged in' if battery.power_plugged else 'on battery'}",
+                'percent': battery.percent, 'power_plugged': battery.power_plugged}
+
+@register_collector('antivirus', 'Windows')
+class DefenderStatusCollector(Collector):
+    expensive = True
+    blocking = True
+
+    def collect(self):
+        # Run a command to check antivirus status on Windows
+        result = get_command_runner().run(['powershell', '-NoProfile', 'Get-MpComputerStatus'], COMMAND_TIMEOUTS['antivirus'],
+                                          COMMAND_CACHE_TTL['antivirus'], check=True)
+        return {'status': result['stdout'].strip()}
+
+@register_collector('updates', 'Darwin')
+class SoftwareUpdateCollector(Collector):
+    expensive = True
+    blocking = True
+
+    def collect(self):
+        result = get_command_runner().run(["softwareupdate", "-l"], COMMAND_TIMEOUTS['updates'], COMMAND_CACHE_TTL['updates'])
+        return {'output': (result['stdout'] + result['stderr']).strip()}
+
+@register_collector('updates', 'Windows')
+class ChocolateyUpdateCollector(Collector):
+    expensive = True
+    blocking = True
+
+    def collect(self):
+        # List outdated packages only, installing them is left to the security checks' winget run
+        result = get_command_runner().run(["choco", "outdated"], COMMAND_TIMEOUTS['updates'], COMMAND_CACHE_TTL['updates'])
+        return {'output': (result['stdout'] + result['stderr']).strip()}
+
+# Function to make a sample value JSON-safe: NaN and infinity become null
+def json_value(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+# Function to turn a collector field into a Prometheus metric name, None when it needs a label instead
+def prometheus_name(collector, field):
+    name = f"{METRICS_PREFIX}_{collector}_{field}"
+    return name if re.fullmatch(r'[a-zA-Z_:][a-zA-Z0-9_:]*', name) else None
+
+# Function to escape a Prometheus label value
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Function to format a number in the Prometheus text format
+def prometheus_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+# Function to render the self-instrumentation histograms and counters in the Prometheus text format
+def prometheus_self_metrics(instrumentation):
+    metric = f"{METRICS_PREFIX}_self_duration_seconds"
+    lines = [f"# TYPE {metric} histogram"]
+    timings, counters = instrumentation.totals()
+    for name, timing in sorted(timings.items()):
+        label = prometheus_label(name)
+        cumulative = 0
+        for bound, count in zip(instrumentation.bounds, timing[3:]):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{operation="{label}",le="{prometheus_value(bound)}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{operation="{label}",le="+Inf"}} {timing[0]}')
+        lines.append(f'{metric}_sum{{operation="{label}"}} {prometheus_value(timing[1])}')
+        lines.append(f'{metric}_count{{operation="{label}"}} {timing[0]}')
+    metric = f"{METRICS_PREFIX}_self_events_total"
+    lines.append(f"# TYPE {metric} counter")
+    for name, value in sorted(counters.items()):
+        lines.append(f'{metric}{{counter="{prometheus_label(name)}"}} {value}')
+    return lines
+
+# Latest samples, served as JSON and Prometheus text (plain and gzip)
+# A collector report only stores the sample and drops the cached bodies; the first scrape after it
+# serializes once and later scrapes reuse the result, so sampling never pays for serialization
+class MetricsSnapshot:
+    def __init__(self, host=None):
+        self.host = host or socket.gethostname()
+        self.started = time.time()
+        self.samples = {}  # Collector name -> (timestamp, sample)
+        self.bodies = {}  # (content type key, gzip) -> body, built on the first request after a sample changed
+        self.lock = threading.Lock()
+
+    # Collectors only mark the bodies stale, serializing is left to the scrapes that need it
+    def update(self, name, timestamp, sample):
+        with self.lock:
+            self.samples[name] = (timestamp, sample)
+            self.bodies = {}
+
+    def to_dict(self):
+        return {
+            'type': 'snapshot',
+            'host': self.host,
+            'started': self.started,
+            'generated': time.time(),
+            'collectors': {name: {'timestamp': timestamp, 'values': {field: json_value(value) for field, value in sample.items()}}
+                           for name, (timestamp, sample) in self.samples.items()},
+            'self': instrumentation.report(profile=False) if instrumentation.enabled else None,
+        }
+
+    def to_prometheus(self):
+        lines = [f"# TYPE {METRICS_PREFIX}_up gauge", f"{METRICS_PREFIX}_up 1",
+                 f"# TYPE {METRICS_PREFIX}_collector_timestamp_seconds gauge"]
+        for name, (timestamp, sample) in sorted(self.samples.items()):
+            lines.append(f'{METRICS_PREFIX}_collector_timestamp_seconds{{collector="{prometheus_label(name)}"}} {timestamp:.3f}')
+        for name, (timestamp, sample) in sorted(self.samples.items()):
+            labelled = []
+            for field, value in sorted(sample.items()):
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue  # Only numbers are exported as metrics
+                metric = prometheus_name(name, field)
+                if metric is None:
+                    labelled.append((field, value))
+                else:
+                    lines.append(f"# TYPE {metric} {'counter' if field in METRICS_COUNTER_FIELDS else 'gauge'}")
+                    lines.append(f"{metric} {prometheus_value(value)}")
+            if labelled:
+                metric = f"{METRICS_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+                lines.append(f"# TYPE {metric} gauge")
+                for field, value in labelled:
+                    lines.append(f'{metric}{{field="{prometheus_label(field)}"}} {prometheus_value(value)}')
+        if instrumentation.enabled:
+            lines.extend(prometheus_self_metrics(instrumentation))
+        return '\n'.join(lines) + '\n'
+
+    # Returns the encoded body for 'json' or 'prometheus', serialized (and compressed) only when stale
+    def body(self, key, compressed=False):
+        with self.lock:
+            if (key, False) not in self.bodies:
+                self.bodies[(key, False)] = (json.dumps(self.to_dict()) if key == 'json' else self.to_prometheus()).encode()
+            if compressed and (key, True) not in self.bodies:
+                self.bodies[(key, True)] = gzip.compress(self.bodies[(key, False)], compresslevel=1)
+            return self.bodies[(key, compressed)]
+
+# Function to start the metrics HTTP server on a background thread
+# Serves /metrics (Prometheus text format), /snapshot.json and /healthz, bodies are cached until the next sample
+def start_metrics_server(snapshot, host=METRICS_HOST, port=METRICS_PORT):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        routes = {
+            '/metrics': ('prometheus', 'text/plain; version=0.0.4; charset=utf-8'),
+            '/snapshot.json': ('json', 'application/json'),
+        }
+
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path == '/healthz':
+                self.send_body(b'ok\n', 'text/plain')
+                return
+            route = self.routes.get(path)
+            if route is None:
+                self.send_error(404)
+                return
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                self.send_body(snapshot.body(route[0], True), route[1], 'gzip')
+            else:
+                self.send_body(snapshot.body(route[0]), route[1])
+
+        def send_body(self, body, content_type, encoding=None):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the log
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+# Typed JSON lines sink: one {"type": "sample", ...} record per collector run, to a file or stdout ('-')
+class JsonLinesSink:
+    def __init__(self, path, host=None):
+        self.host = host or socket.gethostname()
+        self.file = sys.stdout if path == '-' else open(path, 'a')
+
+    def update(self, name, timestamp, sample):
+        record = {'type': 'sample', 'host': self.host, 'collector': name, 'timestamp': timestamp,
+                  'values': {field: json_value(value) for field, value in sample.items()}}
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+latest_samples = {}  # Collector name -> (timestamp, sample) from the most recent run
+
+# Headless sampling daemon: each collector runs on its own interval as an asyncio task,
+# blocking collectors run in a thread so a slow one never delays the others
+class SamplingDaemon:
+    def __init__(self, intervals=None, collectors=None, write_history=True, latency_hosts=(), exporters=()):
+        self.intervals = dict(DAEMON_INTERVALS, **(intervals or {}))
+        if collectors is None:
+            # Resolved registry backends: name -> (collect function, runs in a worker thread)
+            collectors = {name: (get_collector(name).collect, get_collector(name).blocking)
+                          for name in self.intervals if get_collector(name) is not None}
+        self.collectors = dict(collectors)
+        self.latency_hosts = list(latency_hosts)
+        self.prober = None
+        if self.latency_hosts:
+            self.collectors['latency'] = (self.sample_latency, False)
+        self.write_history = write_history
+        self.exporters = list(exporters)  # Objects with update(name, timestamp, sample), e.g. MetricsSnapshot
+        self.writers = {}
+        self.overhead = {}  # Collector name -> [samples, total seconds, max seconds]
+        self.stopping = None
+
+    # Probe every latency host once per tick, concurrently from one socket
+    async def sample_latency(self):
+        if self.prober is None:
+            self.prober = LatencyProber()
+        sample = {}
+        for result in await self.prober.probe_many(self.latency_hosts, count=1):
+            sample[f"{result['target']} rtt_ms"] = result.get('avg_ms')
+            sample[f"{result['target']} loss"] = result.get('packet_loss', 100.0)
+        return sample
+
+    def record(self, name, timestamp, sample):
+        latest_samples[name] = (timestamp, sample)
+        for exporter in self.exporters:
+            try:
+                exporter.update(name, timestamp, sample or {})
+            except Exception as e:
+                logging.error(f"Error exporting {name}: {str(e)}")
+        if not self.write_history or not sample:
+            return
+        writer = self.writers.get(name)
+        if writer is None:
+            extension = 'csv' if HISTORICAL_DATA_FORMAT == 'csv' else 'bin'
+            writer = HistoricalDataWriter(f"historical_{name}.{extension}", ['Timestamp'] + sorted(sample), HISTORICAL_DATA_FORMAT)
+            self.writers[name] = writer
+        elif not set(sample).issubset(writer.fieldnames):
+            # New devices, targets or sensors: widen the columns (fields that vanish are kept, left empty)
+            writer.set_fieldnames(['Timestamp'] + sorted(set(writer.fieldnames[1:]).union(sample)))
+        writer.write((timestamp,) + tuple(sample.get(field) for field in writer.fieldnames[1:]))
+
+    async def run_collector(self, name, collect, interval, blocking):
+        loop = asyncio.get_running_loop()
+        stats = self.overhead.setdefault(name, [0, 0.0, 0.0])
+        next_run = loop.time()
+        while True:
+            start = time.perf_counter()
+            try:
+                if asyncio.iscoroutinefunction(collect):
+                    sample = await collect()
+                elif blocking:
+                    sample = await loop.run_in_executor(None, collect)
+                else:
+                    sample = collect()
+                self.record(name, time.time(), sample)
+            except Exception as e:
+                logging.error(f"Error sampling {name}: {str(e)}")
+            elapsed = time.perf_counter() - start
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            next_run += interval
+            delay = next_run - loop.time()
+            if delay < 0:
+                next_run = loop.time()  # Skip ticks we were too slow for instead of bursting
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def run(self, duration=None):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signal_name in ('SIGINT', 'SIGTERM'):
+            try:
+                loop.add_signal_handler(getattr(signal, signal_name), self.stopping.set)
+            except (NotImplementedError, AttributeError, RuntimeError):
+                pass  # Not available on Windows, KeyboardInterrupt still stops asyncio.run
+        try:
+            loop.add_signal_handler(signal.SIGUSR2, instrumentation.toggle_profiler)  # kill -USR2 starts/stops profiling
+        except (NotImplementedError, AttributeError, RuntimeError):
+            pass
+        tasks = [asyncio.create_task(self.run_collector(name, collect, self.intervals[name], blocking))
+                 for name, (collect, blocking) in self.collectors.items() if self.intervals.get(name)]
+        logging.info(f"Sampling daemon started: {', '.join(f'{name} every {self.intervals[name]}s' for name, _ in self.collectors.items() if self.intervals.get(name))}")
+        try:
+            await asyncio.wait_for(self.stopping.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for writer in self.writers.values():
+                writer.close()
+            if self.prober is not None:
+                self.prober.close()
+            self.log_overhead()
+            if instrumentation.enabled or instrumentation.profiler is not None:
+                instrumentation.stop_profiler()
+                logging.info(display_self_metrics(instrumentation.report()))
+
+    def log_overhead(self):
+        for name, (samples, total, worst) in self.overhead.items():
+            if samples:
+                logging.info(f"Collector {name}: {samples} samples, {total / samples * 1000:.3f} ms average, {worst * 1000:.3f} ms max")
+
+# Function to run the sampling daemon until interrupted (or for duration seconds)
+# metrics_port serves the latest samples over HTTP, json_lines appends every sample to a file ('-' for stdout)
+def run_daemon(intervals=None, duration=None, latency_hosts=(), metrics_port=None, metrics_host=METRICS_HOST, json_lines=None):
+    exporters = []
+    server = None
+    if metrics_port is not None:
+        snapshot = MetricsSnapshot()
+        server = start_metrics_server(snapshot, metrics_host, metrics_port)
+        exporters.append(snapshot)
+    if json_lines:
+        exporters.append(JsonLinesSink(json_lines))
+    try:
+        asyncio.run(SamplingDaemon(intervals, latency_hosts=latency_hosts, exporters=exporters).run(duration))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        for exporter in exporters:
+            if hasattr(exporter, 'close'):
+                exporter.close()
+    logging.info("Sampling daemon stopped.")
+
+# Fleet mode: agents (--agent) run diagnostic jobs for a coordinator (--fleet) over HTTP/1.1.
+# POST /jobs/<name> with JSON parameters answers with a chunked stream of JSON lines, tagged with the job
+# and host: {"type": "started"}, any number of "progress", "partial" or "problem" records, then one
+# {"type": "result", "result": ...} or {"type": "error", "error": ...}. Connections are kept alive so the
+# coordinator can reuse them across jobs
+AGENT_JOBS = {}  # Job name -> function(params, emit) returning the final result
+
+# Decorator to register an agent job
+def register_agent_job(name):
+    def decorator(job):
+        AGENT_JOBS[name] = job
+        return job
+    return decorator
+
+# Agent job: static hardware inventory plus current CPU and memory load
+@register_agent_job('hardware')
+def hardware_job(params, emit):
+    return {'inventory': get_hardware_inventory(persist=False), 'cpu_percent': psutil.cpu_percent(interval=None),
+            'memory_percent': psutil.virtual_memory().percent, 'boot_time': psutil.boot_time()}
+
+# Agent job: the storage inventory, one entry per real partition
+@register_agent_job('storage')
+def storage_job(params, emit):
+    return get_storage_inventory(refresh=True)
+
+# Agent job: network diagnostics, each target's probe results are streamed as a partial record as soon as it is done
+@register_agent_job('network')
+def network_job(params, emit):
+    targets = params.get('targets') or list(NETWORK_TARGETS)
+    probes = params.get('probes') or NETWORK_PROBES
+    timeouts = dict(NETWORK_PROBE_TIMEOUTS, **params.get('timeouts', {}))
+
+    async def diagnose():
+        prober = LatencyProber()
+        failed = 0
+        try:
+            for outcome in asyncio.as_completed([diagnose_target(target, probes, timeouts, params.get('tcp_port'), prober)
+                                                 for target in targets]):
+                results = await outcome
+                failed += sum(1 for result in results if not result['ok'])
+                emit({'type': 'partial', 'results': results})
+        finally:
+            prober.close()
+        return {'targets': len(targets), 'failed_probes': failed}
+    return asyncio.run(diagnose())
+
+# Scan sink for agents: problems and periodic progress go to the coordinator instead of a spool
+class StreamingScanSink(ScanResultSink):
+    def __init__(self, emit):
+        super().__init__(None)
+        self.emit = emit
+        self.task = None  # Scan task, cancelled when the coordinator goes away
+        self.last_progress = time.monotonic()
+
+    def write(self, record):
+        if self.task is not None and self.task.cancelled():
+            return
+        try:
+            self.emit(record)
+        except ConnectionError:
+            if self.task is not None:
+                self.task.cancel()
+
+    def add(self, file_entry, problem):
+        super().add(file_entry, problem)
+        self.progress()
+
+    # Also called from a timer, so a long listing or one huge file still streams a record every interval
+    def progress(self):
+        if time.monotonic() - self.last_progress >= FLEET_PROGRESS_INTERVAL:
+            self.last_progress = time.monotonic()
+            self.write(dict(self.counters(), type='progress'))
+
+    def directory_done(self, path, files, size):
+        pass
+
+# Agent job: file scan of params['roots'], problems are streamed as they are found
+@register_agent_job('scan')
+def scan_job(params, emit):
+    roots = params.get('roots')
+    if not roots:
+        raise ValueError("scan needs at least one root")
+    extensions = tuple(params['extensions']) if params.get('extensions') else file_extensions_to_scan
+    sink = StreamingScanSink(emit)
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(FLEET_PROGRESS_INTERVAL)
+            sink.progress()
+
+    async def scan():
+        sink.task = asyncio.current_task()
+        beat = asyncio.create_task(heartbeat())
+        try:
+            await scan_selected_drives(roots, extensions, None, None, full_crc=params.get('full_crc', False), sink=sink)
+        finally:
+            beat.cancel()
+    asyncio.run(scan())
+    return sink.counters()
+
+# Function to check that a bind address only reaches this machine (every address it resolves to is loopback)
+def is_loopback_host(host):
+    import ipaddress
+    if not host:
+        return False  # '' binds every interface
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except OSError:
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split('%', 1)[0]).is_loopback for address in addresses)
+
+# Function to start the agent HTTP server on a background thread
+# With a token, job requests must carry "Authorization: Bearer <token>"
+def start_agent_server(host=AGENT_HOST, port=AGENT_PORT, token=None):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    if not token and not is_loopback_host(host):
+        raise ValueError(f"refusing to serve agent jobs on {host or 'all interfaces'} without a token, set {AGENT_TOKEN_ENV}")
+    hostname = socket.gethostname()
+
+    class AgentRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, coordinators reuse their connections
+
+        def do_GET(self):
+            if self.path == '/healthz':
+                self.send_body(200, b'ok\n', 'text/plain')
+            elif self.path == '/jobs':
+                self.send_body(200, json.dumps(sorted(AGENT_JOBS)).encode(), 'application/json')
+            else:
+                self.send_body(404, b'not found\n', 'text/plain')
+
+        def do_POST(self):
+            name = self.path[len('/jobs/'):] if self.path.startswith('/jobs/') else None
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if token and not hmac.compare_digest(self.headers.get('Authorization', ''), f"Bearer {token}"):
+                self.send_body(401, b'unauthorized\n', 'text/plain')
+                return
+            if name not in AGENT_JOBS:
+                self.send_body(404, b'unknown job\n', 'text/plain')
+                return
+            try:
+                params = json.loads(body or b'{}')
+            except ValueError:
+                self.send_body(400, b'parameters must be JSON\n', 'text/plain')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            def emit(record):
+                line = (json.dumps(dict(record, job=name, host=hostname), default=json_value) + '\n').encode()
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+
+            started = time.perf_counter()
+            try:
+                emit({'type': 'started', 'params': params})
+                try:
+                    result = AGENT_JOBS[name](params, emit)
+                except (ConnectionError, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    emit({'type': 'error', 'error': str(e), 'seconds': time.perf_counter() - started})
+                else:
+                    emit({'type': 'result', 'result': result, 'seconds': time.perf_counter() - started})
+                self.wfile.write(b'0\r\n\r\n')
+            except (ConnectionError, asyncio.CancelledError):  # Broken pipe, or a scan cancelled because of one
+                logging.info(f"Coordinator {self.client_address[0]} went away during job {name}.")
+                self.close_connection = True
+            instrumentation.observe(f"agent.{name}", time.perf_counter() - started)
+
+        def send_body(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), AgentRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='agent-server', daemon=True).start()
+    logging.info(f"Agent serving jobs {', '.join(sorted(AGENT_JOBS))} on http://{host}:{server.server_address[1]}")
+    return server
+
+# Function to run as a fleet agent until interrupted
+def run_agent(host=AGENT_HOST, port=AGENT_PORT, token=None):
+    server = start_agent_server(host, port, token)
+    stopping = threading.Event()
+    for signal_name in ('SIGINT', 'SIGTERM'):
+        if hasattr(signal, signal_name):
+            signal.signal(getattr(signal, signal_name), lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(1):
+            pass
+    finally:
+        server.shutdown()
+        server.server_close()
+    logging.info("Agent stopped.")
+
+# Function to split an agent address ("host:port", "[v6]:port" or just "host") into (host, port)
+def parse_agent_address(address):
+    if address.startswith('['):
+        host, _, port = address[1:].partition(']')
+        return host, int(port[1:]) if port.startswith(':') else AGENT_PORT
+    if address.count(':') == 1:
+        host, port = address.split(':')
+        return host, int(port)
+    return address, AGENT_PORT
+
+# Function to read agent addresses from a file, one per line, # starts a comment
+def read_agent_file(path):
+    with open(path) as file:
+        return [line.split('#', 1)[0].strip() for line in file if line.split('#', 1)[0].strip()]
+
+# Keep-alive HTTP connections to one agent, at most size of them in use at a time
+class AgentConnectionPool:
+    def __init__(self, address, size=FLEET_CONNECTIONS_PER_AGENT):
+        self.address = address
+        self.host, self.port = parse_agent_address(address)
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()  # Most recently used first, the least likely to have been closed
+
+    def acquire(self, timeout):
+        import http.client
+        self.slots.acquire()
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        return connection
+
+    def release(self, connection, reusable):
+        if reusable:
+            self.idle.put(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+# Function to run one job on an agent, passing every streamed record to on_record
+# Returns the final result or error record; a pooled connection the agent already closed is retried once
+def run_agent_job(pool, job, params, on_record, token=None, timeout=None):
+    import http.client
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+    body = json.dumps(params).encode()
+    timeout = timeout or FLEET_TIMEOUTS.get(job, COMMAND_TIMEOUT)
+    for attempt in range(FLEET_RETRIES + 1):
+        connection = pool.acquire(timeout)
+        reused = connection.sock is not None
+        reusable = False
+        try:
+            try:
+                connection.request('POST', f"/jobs/{job}", body, headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if reused and attempt < FLEET_RETRIES:
+                    continue  # Stale keep-alive connection, the agent never saw the request
+                raise
+            if response.status != 200:
+                reusable = not response.will_close
+                raise RuntimeError(f"HTTP {response.status}: {response.read().decode(errors='replace').strip()}")
+            final = None
+            for line in response:
+                record = json.loads(line)
+                on_record(record)
+                if record['type'] in ('result', 'error'):
+                    final = record
+            if final is None:
+                raise ConnectionError("agent closed the stream before the job finished")
+            reusable = not response.will_close
+            return final
+        finally:
+            pool.release(connection, reusable)
+
+# Fleet report: the records streamed by every agent merged per agent and job, with fleet-wide summaries
+# Records arrive on the coordinator's worker threads, so updates take the lock
+class FleetReport:
+    def __init__(self, agents, jobs):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.agents = {agent: {'host': None, 'jobs': {job: {'status': 'pending'} for job in jobs}} for agent in agents}
+
+    def add(self, agent, job, record):
+        with self.lock:
+            entry = self.agents[agent]['jobs'][job]
+            if record.get('host'):
+                self.agents[agent]['host'] = record['host']
+            kind = record['type']
+            if kind == 'started':
+                entry['status'] = 'running'
+            elif kind == 'progress':
+                entry['progress'] = {field: value for field, value in record.items() if field not in ('type', 'job', 'host')}
+            elif kind == 'partial':
+                entry.setdefault('partials', []).extend(record['results'])
+            elif kind == 'problem':
+                entry['problem_count'] = entry.get('problem_count', 0) + 1
+                problems = entry.setdefault('problems', [])
+                if len(problems) < FLEET_PROBLEMS_PER_AGENT:
+                    problems.append(record['problem'])
+            elif kind == 'result':
+                entry.update(status='ok', result=record['result'], seconds=record.get('seconds'))
+            elif kind == 'error':
+                entry.update(status='failed', error=record['error'], seconds=record.get('seconds'))
+
+    # Job entries that finished ok, as (agent, result, entry)
+    def finished(self, job):
+        return [(agent, state['jobs'][job]['result'], state['jobs'][job]) for agent, state in self.agents.items()
+                if state['jobs'].get(job, {}).get('status') == 'ok']
+
+    def summary(self):
+        with self.lock:
+            jobs = {job for state in self.agents.values() for job in state['jobs']}
+            summary = {
+                'agents': len(self.agents),
+                'reachable': sum(1 for state in self.agents.values() if any(entry['status'] == 'ok' for entry in state['jobs'].values())),
+                'failed_jobs': [{'agent': agent, 'job': job, 'error': entry.get('error')}
+                                for agent, state in self.agents.items() for job, entry in state['jobs'].items() if entry['status'] != 'ok'],
+            }
+            if 'hardware' in jobs:
+                hardware = self.finished('hardware')
+                systems = {}
+                for agent, result, _ in hardware:
+                    system = result['inventory']['system']
+                    systems[system] = systems.get(system, 0) + 1
+                summary['hardware'] = {
+                    'systems': systems,
+                    'logical_cpus': sum(result['inventory']['cpu_count_logical'] or 0 for _, result, _ in hardware),
+                    'total_ram': sum(result['inventory']['total_ram'] for _, result, _ in hardware),
+                    'busiest_cpu': heapq.nlargest(FLEET_TOP_N, ((result['cpu_percent'], agent) for agent, result, _ in hardware)),
+                    'fullest_memory': heapq.nlargest(FLEET_TOP_N, ((result['memory_percent'], agent) for agent, result, _ in hardware)),
+                }
+            if 'storage' in jobs:
+                volumes = [(agent, volume) for agent, result, _ in self.finished('storage') for volume in result]
+                healthy = [(agent, volume) for agent, volume in volumes if volume['status'] == 'ok']
+                summary['storage'] = {
+                    'volumes': len(volumes),
+                    'total': sum(volume['total'] for _, volume in healthy),
+                    'used': sum(volume['used'] for _, volume in healthy),
+                    'nearly_full': sorted(((volume['percent'], agent, volume['mountpoint']) for agent, volume in healthy
+                                           if volume['percent'] >= FLEET_STORAGE_WARN_PERCENT), reverse=True),
+                    'unhealthy': [(agent, volume['mountpoint'], volume['status']) for agent, volume in volumes if volume['status'] != 'ok'],
+                }
+            if 'network' in jobs:
+                probes = {}
+                for agent, _, entry in self.finished('network'):
+                    for result in entry.get('partials', []):
+                        stats = probes.setdefault(f"{result['probe']} {result['target']}", {'ok': 0, 'failed': [], 'latencies': []})
+                        if result['ok']:
+                            stats['ok'] += 1
+                            if result.get('avg_ms') is not None:
+                                stats['latencies'].append((result['avg_ms'], agent))
+                        else:
+                            stats['failed'].append(agent)
+                for stats in probes.values():
+                    latencies = stats.pop('latencies')
+                    stats['median_ms'] = percentile([latency for latency, _ in latencies], 0.5)
+                    stats['slowest'] = heapq.nlargest(FLEET_TOP_N, latencies)
+                summary['network'] = probes
+            if 'scan' in jobs:
+                scans = self.finished('scan')
+                summary['scan'] = {
+                    'scanned': sum(result['scanned'] for _, result, _ in scans),
+                    'bytes': sum(result['bytes'] for _, result, _ in scans),
+                    'problems': sum(result['problems'] for _, result, _ in scans),
+                    'most_problems': heapq.nlargest(FLEET_TOP_N, ((result['problems'], agent) for agent, result, _ in scans if result['problems'])),
+                }
+            return summary
+
+    def to_dict(self):
+        summary = self.summary()
+        with self.lock:
+            return {'type': 'fleet_report', 'generated': time.time(), 'started': self.started,
+                    'summary': summary, 'agents': self.agents}
+
+    def export_json(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, default=json_value)
+        logging.info(f"Fleet report exported to {path}")
+
+# Function to run jobs on every agent with bounded concurrency and merge the streamed results
+# params maps a job name to its parameters; jobs are queued job by job so no agent is flooded first
+def run_fleet(agents, jobs=FLEET_JOBS, params=None, concurrency=FLEET_CONCURRENCY, token=None):
+    params = params or {}
+    report = FleetReport(agents, jobs)
+    pools = {agent: AgentConnectionPool(agent) for agent in agents}
+    executor = ThreadPoolExecutor(concurrency, thread_name_prefix='fleet')
+    futures = {}
+    for job in jobs:
+        for agent in agents:
+            on_record = lambda record, agent=agent, job=job: report.add(agent, job, record)
+            futures[executor.submit(run_agent_job, pools[agent], job, params.get(job, {}), on_record, token)] = (agent, job)
+    try:
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            agent, job = futures[future]
+            try:
+                final = future.result()
+            except Exception as e:
+                report.add(agent, job, {'type': 'error', 'error': f"{type(e).__name__}: {str(e)}"})
+                final = {'type': 'error', 'error': str(e)}
+            status = f"{final.get('seconds', 0):.2f}s" if final['type'] == 'result' else f"failed: {final['error']}"
+            logging.info(f"[{done}/{len(futures)}] {agent} {job}: {status}")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        for pool in pools.values():
+            pool.close()
+    return report
+
+# Function to format the fleet summary
+def display_fleet_report(summary):
+    fleet_info = [f"=== Fleet Report: {summary['reachable']}/{summary['agents']} agents reachable ==="]
+    if 'hardware' in summary:
+        hardware = summary['hardware']
+        fleet_info.append(f"Hardware: {', '.join(f'{count} {system}' for system, count in sorted(hardware['systems'].items()))}, "
+                          f"{hardware['logical_cpus']} logical CPUs, {hardware['total_ram'] / (1024 ** 3):.1f} GB RAM")
+        fleet_info.extend(f"Busy CPU: {agent} {percent:.1f}%" for percent, agent in hardware['busiest_cpu'] if percent >= 90)
+        fleet_info.extend(f"High memory: {agent} {percent:.1f}%" for percent, agent in hardware['fullest_memory'] if percent >= 90)
+    if 'storage' in summary:
+        storage = summary['storage']
+        fleet_info.append(f"Storage: {storage['volumes']} volumes, {storage['used'] / (1024 ** 4):.2f} of {storage['total'] / (1024 ** 4):.2f} TB used")
+        fleet_info.extend(f"Nearly full: {agent} {mountpoint} {percent:.1f}%" for percent, agent, mountpoint in storage['nearly_full'])
+        fleet_info.extend(f"Unhealthy volume: {agent} {mountpoint} ({status})" for agent, mountpoint, status in storage['unhealthy'])
+    for name, stats in sorted(summary.get('network', {}).items()):
+        latency = f", median {stats['median_ms']:.2f} ms" if stats['median_ms'] is not None else ""
+        failed = f", failed on {', '.join(stats['failed'][:FLEET_TOP_N])}" if stats['failed'] else ""
+        fleet_info.append(f"Network {name}: ok on {stats['ok']} agents{latency}{failed}")
+    if 'scan' in summary:
+        scan = summary['scan']
+        fleet_info.append(f"Scan: {scan['scanned']} files, {scan['bytes'] / 10**9:.2f} GB, {scan['problems']} problems")
+        fleet_info.extend(f"Problems: {agent} {count}" for count, agent in scan['most_problems'])
+    for failure in summary['failed_jobs']:
+        fleet_info.append(f"Failed: {failure['agent']} {failure['job']}: {failure['error']}")
+    return '\n'.join(fleet_info)
+
+# Function to run the coordinator from the command line and export the merged report
+def coordinate_fleet(agents, jobs=FLEET_JOBS, params=None, concurrency=FLEET_CONCURRENCY):
+    token = os.environ.get(AGENT_TOKEN_ENV)
+    logging.info(f"Running {', '.join(jobs)} on {len(agents)} agents, {concurrency} jobs at a time...")
+    report = run_fleet(agents, jobs, params, concurrency, token)
+    logging.info(display_fleet_report(report.summary()))
+    report.export_json(f"{FLEET_REPORT_PREFIX}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    return report
+
+# Function to parse command line options
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="PCtricorder system diagnostics")
+    parser.add_argument('--daemon', action='store_true', help="Run headless and sample metrics continuously")
+    parser.add_argument('--duration', type=float, help="Stop the daemon after this many seconds")
+    parser.add_argument('--network-target', action='append', dest='network_targets',
+                        help="Host for network diagnostics (repeat for several), defaults to NETWORK_TARGETS")
+    parser.add_argument('--disable-collector', action='append', dest='disabled_collectors', default=[],
+                        help="Collector to leave out, e.g. gpu or updates (repeat for several)")
+    parser.add_argument('--latency-host', action='append', dest='latency_hosts', default=[],
+                        help="Host to probe for latency in daemon mode (repeat for several)")
+    parser.add_argument('--metrics-port', type=int, nargs='?', const=METRICS_PORT,
+                        help=f"Serve /metrics and /snapshot.json in daemon mode (default port {METRICS_PORT})")
+    parser.add_argument('--metrics-host', default=METRICS_HOST, help="Address the metrics endpoint binds to")
+    parser.add_argument('--json-lines', metavar='PATH', help="Append every daemon sample as a JSON line to PATH ('-' for stdout)")
+    parser.add_argument('--agent', action='store_true', help="Serve diagnostic jobs to a fleet coordinator")
+    parser.add_argument('--agent-host', default=AGENT_HOST, help="Address the agent binds to")
+    parser.add_argument('--agent-port', type=int, default=AGENT_PORT, help=f"Agent port (default {AGENT_PORT})")
+    parser.add_argument('--fleet', action='append', dest='fleet_agents', default=[], metavar='HOST:PORT',
+                        help="Run jobs on this agent as the coordinator (repeat for several)")
+    parser.add_argument('--fleet-file', help="File listing agent addresses, one per line")
+    parser.add_argument('--fleet-job', action='append', dest='fleet_jobs', choices=sorted(AGENT_JOBS),
+                        help=f"Job to run on every agent (repeat for several), defaults to {', '.join(FLEET_JOBS)}")
+    parser.add_argument('--fleet-concurrency', type=int, default=FLEET_CONCURRENCY, help="Jobs in flight across the fleet")
+    parser.add_argument('--fleet-scan-root', action='append', dest='fleet_scan_roots', default=[],
+                        help="Directory the scan job checks on every agent (repeat for several)")
+    parser.add_argument('--no-instrumentation', action='store_true', help="Disable the self-metrics timing histograms and counters")
+    parser.add_argument('--profile', action='store_true',
+                        help="Run the sampling profiler from startup (toggle at runtime with I, or SIGUSR2 in daemon mode)")
+    for name in DAEMON_INTERVALS:
+        parser.add_argument(f'--{name}-interval', type=float, default=DAEMON_INTERVALS.get(name),
+                            help=f"Seconds between {name} samples in daemon mode (0 disables)")
+    return parser.parse_args(argv)
 
 # the main loop
 if __name__ == "__main__":
+    arguments = parse_arguments()
+    configure_logging()
+    instrumentation.enabled = not arguments.no_instrumentation
+    if arguments.profile:
+        instrumentation.start_profiler()
+    resolve_collectors(DISABLED_COLLECTORS + tuple(arguments.disabled_collectors))
+    if arguments.agent:
+        try:
+            run_agent(arguments.agent_host, arguments.agent_port, os.environ.get(AGENT_TOKEN_ENV))
+        except ValueError as e:
+            logging.error(str(e))
+            sys.exit(2)
+        sys.exit(0)
+    if arguments.fleet_agents or arguments.fleet_file:
+        agents = arguments.fleet_agents + (read_agent_file(arguments.fleet_file) if arguments.fleet_file else [])
+        jobs = arguments.fleet_jobs or (FLEET_JOBS + ('scan',) if arguments.fleet_scan_roots else FLEET_JOBS)
+        params = {'network': {'targets': arguments.network_targets or list(NETWORK_TARGETS)},
+                  'scan': {'roots': arguments.fleet_scan_roots}}
+        report = coordinate_fleet(agents, jobs, params, arguments.fleet_concurrency)
+        sys.exit(1 if report.summary()['failed_jobs'] else 0)
+    if arguments.daemon:
+        run_daemon({name: getattr(arguments, f'{name}_interval') for name in DAEMON_INTERVALS}, arguments.duration,
+                   arguments.latency_hosts, arguments.metrics_port, arguments.metrics_host, arguments.json_lines)
+        sys.exit(0)
+
     # Display system recommendations at the beginning
     logging.info("=== System Recommendations ===")
+    # Collect CPU usage and memory percent (this one-second sample also primes later non-blocking reads)
+    process_sampler = ProcessSampler()
+    process_sampler.sample()
+    started = time.perf_counter()
     cpu_usage = psutil.cpu_percent(interval=1)
+    instrumentation.observe('startup.cpu_sample', time.perf_counter() - started)
     memory_percent = psutil.virtual_memory().percent
+    process_sampler.sample()
 
-    recommendations = system_recommendations(cpu_usage, memory_percent)
-
-     # Collect CPU usage and memory percent
-    cpu_usage = psutil.cpu_percent(interval=1)
-    memory_percent = psutil.virtual_memory().percent
+    recommendations = system_recommendations(cpu_usage, memory_percent, process_sampler.report()) + history_recommendations()
 
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")  # current timestamp
 
@@ -583,42 +4567,53 @@ if __name__ == "__main__":
 
     while True:
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        cpu_usage = psutil.cpu_percent(interval=None)
+        memory_percent = psutil.virtual_memory().percent
+        process_sampler.sample()
 
         # Log historical data
         log_historical_data(cpu_usage, memory_percent, timestamp)
 
         logging.info(display_hardware_info())
-        user_input = input("Choose an action (R: Refresh, S: Scan Files, D: Display Storage Info, B: Battery Check(Laptop), N: Perform Network Diagnostics, C: Windows Security Checks, U: Check for MacOS Updates, Q: Quit: ").lower()
+        user_input = input("Choose an action (R: Refresh, S: Scan Files, F: Find Duplicate Files, D: Display Storage Info, A: Analyze Disk Usage, P: Top Processes, H: Historical Usage, T: Throughput Monitor, I: Self Metrics, B: Battery Check(Laptop), N: Perform Network Diagnostics, C: Windows Security Checks, U: Check for MacOS Updates, Q: Quit: ").lower()
 
 
 
         if user_input == 'r':
             continue  # Refresh
         elif user_input == 's':
-            # Existing code for scanning files
-            available_drives = display_available_drives()
-            if available_drives:
-                drive_choice = input("Select drives to scan (e.g., 1,2,3): ").split(',')
-                drives_to_scan = [available_drives[int(choice) - 1][0] for choice in drive_choice if 1 <= int(choice) <= len(available_drives)]
-                if drives_to_scan:
-                    with tqdm(total=sum(len(os.listdir(drive)) for drive in drives_to_scan if os.path.isdir(drive))) as pbar:
-                        problem_files = []  # Reset problem_files
-                        scanned_files = []  # Reset scanned_files
-                        asyncio.run(scan_selected_drives(drives_to_scan, file_extensions_to_scan, problem_files, scanned_files))
-                        
-                        # Check if any problems were detected and log accordingly
-                        if not problem_files:
-                            logging.info("No problems detected in files.")
-                        else:
-                            logging.info(f"Problems found in {len(problem_files)} files.")
-                            for problem_file in problem_files:
-                                logging.info(problem_file)
+            # Scan files on the selected drives
+            scan_files()
+        elif user_input == 'f':
+            # Find duplicate files on the selected drives
+            find_duplicate_files()
         elif user_input == 'd':
             # Display storage information
             logging.info(display_storage_info())
+        elif user_input == 'a':
+            # Show the largest directories and files
+            display_disk_usage()
+        elif user_input == 'p':
+            # Show the heaviest processes and what they mean for the recommendations
+            process_report = process_sampler.report()
+            logging.info(display_top_processes(process_report))
+            for recommendation in system_recommendations(cpu_usage, memory_percent, process_report):
+                logging.info("- " + recommendation)
+        elif user_input == 'h':
+            # Summarize recorded usage and its trends
+            get_historical_writer().flush()
+            logging.info(display_history_summary())
+            for recommendation in history_recommendations():
+                logging.info("- " + recommendation)
+        elif user_input == 't':
+            # Watch disk and network throughput
+            monitor_throughput()
+        elif user_input == 'i':
+            # Show where the tool itself spends its time
+            display_instrumentation()
         elif user_input == 'n':
             # Perform network diagnostics
-            perform_network_diagnostics()
+            perform_network_diagnostics(arguments.network_targets or NETWORK_TARGETS)
         elif user_input == 'c':
             # Perform security checks
             perform_security_checks()
@@ -629,6 +4624,7 @@ if __name__ == "__main__":
             # Perform battery check
             check_battery_health()    
         elif user_input == 'q':
+            instrumentation.stop_profiler()
             logging.info("Thank you for using PCtricorder!")
             break  # Quit
         else:
@@ -1,10 +1,13 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
 
+# Bundle the osx-cpu-temp helper when it has been built (make -C osx-cpu-temp)
+osx_cpu_temp_binaries = [('osx-cpu-temp/osx-cpu-temp', 'osx-cpu-temp')] if os.path.isfile('osx-cpu-temp/osx-cpu-temp') else []
 
 a = Analysis(
     ['system_diagnostics.py'],
     pathex=[],
-    binaries=[],
+    binaries=osx_cpu_temp_binaries,
     datas=[],
     hiddenimports=[],
     hookspath=[],